@@ -1,17 +1,16 @@
 #!/bin/bash
 
-preprocess="../python-tools/preprocess_multrees_v3.py"
-fastmulrfs="../external/FastRFS/build/FastRFS"
+fastmulrfs="../python-tools/run_fastmulrfs.py"
+fastrfs="../external/FastRFS/build/FastRFS"
 
-python $preprocess \
-    -i g_trees-mult.trees \
-    -o g_trees-mult-for-fastrfs.trees \
-    --verbose
-
-if [ ! -e $fastmulrfs ]; then
+if [ ! -e $fastrfs ]; then
     echo "Need to get external dependencies!"
 else
-    $fastmulrfs \
-        -i g_trees-mult-for-fastrfs.trees \
-        -o fastmulrfs.tree &> fastmulrfs.log
+    # Preprocessed gene trees are written to g_trees-mult-for-fastrfs.trees
+    # before FastRFS is run, and the FastRFS log is written to fastmulrfs.log
+    python $fastmulrfs \
+        -i g_trees-mult.trees \
+        -o fastmulrfs.tree \
+        -x $fastrfs \
+        -p g_trees-mult-for-fastrfs.trees
 fi
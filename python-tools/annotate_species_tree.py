@@ -0,0 +1,278 @@
+"""
+This file is used to annotate each internal edge of a species tree (e.g.,
+estimated by FastMulRFS) with the number of preprocessed gene trees that
+support it and the number that conflict with it. The bipartition of a
+species tree edge is restricted to the species in each gene tree; a gene
+tree supports the edge if it has the restricted bipartition and conflicts
+with the edge if it has a bipartition that is incompatible with it (gene
+trees with polytomies can do neither).
+
+Support and conflict are looked up in tables built in one pass over the gene
+trees, with gene trees grouped by their species: the number of gene trees
+with each bipartition and the number with each polytomy. A gene tree in
+which the restricted bipartition is not trivial either has it (support),
+has a polytomy that could be refined to have it (neither), or has a
+bipartition that is incompatible with it (conflict).
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import argparse
+from fastmulrfs.tree_file_io import open_input
+from fastmulrfs.tree_file_io import open_output
+from fastmulrfs.tree_file_io import read_text
+from fastmulrfs.tree_topology import count_bits
+from fastmulrfs.tree_topology import get_postorder
+from fastmulrfs.tree_topology import get_splits
+from fastmulrfs.tree_topology import parse_newick
+from fastmulrfs.tree_topology import restrict_split
+import sys
+import treeswift
+
+
+def get_polytomies(labels, adj, index, leafset):
+    """
+    Gets the polytomies of a singly-labeled tree
+
+    Parameters
+    ----------
+    labels, adj : see parse_newick()
+    index : dictionary
+            maps species label to bit
+    leafset : int
+              bitmask of species in tree
+
+    Returns list with, for each node with more than two children (rooting
+    the tree at the lowest species in leafset), the sorted tuple of the
+    bitmasks of the species below each of its children
+    """
+    low = leafset & -leafset
+    start = [v for v in range(len(labels))
+             if labels[v] is not None and 1 << index[labels[v]] == low][0]
+
+    cluster = {}
+    polytomies = []
+    for [node, above] in get_postorder(adj, adj[start][0], start):
+        if labels[node] is not None:
+            cluster[node] = 1 << index[labels[node]]
+        else:
+            children = [cluster[u] for u in adj[node] if u != above]
+            mask = 0
+            for child in children:
+                mask |= child
+            cluster[node] = mask
+            if len(children) > 2:
+                polytomies.append(tuple(sorted(children)))
+    return polytomies
+
+
+def read_split_table(gfile, index):
+    """
+    Counts bipartitions and polytomies of preprocessed gene trees, grouping
+    gene trees by their species
+
+    Parameters
+    ----------
+    gfile : string
+            name of file containing preprocessed gene trees (one newick
+            string per line)
+    index : dictionary
+            maps species label to bit (see get_splits())
+
+    Returns
+    -------
+    ntrees : int
+             number of gene trees
+    groups : dictionary
+             maps bitmask of species to [number of gene trees, dictionary
+             mapping side of bipartition (see get_splits()) to number of
+             gene trees, dictionary mapping polytomy (see get_polytomies())
+             to number of gene trees]
+    """
+    nspecies = len(index)
+    ntrees = 0
+    groups = {}
+
+    with open_input(gfile) as f:
+        for g, line in enumerate(f, 1):
+            temp = "".join(line.split())
+            if not temp:
+                continue
+            ntrees += 1
+
+            [labels, adj] = parse_newick(temp)
+            [leafset, splits] = get_splits(labels, adj, index)
+            if len(index) > nspecies:
+                sys.exit("Error: Gene tree on line %d has species that are "
+                         "not in the species tree!\n" % g)
+
+            group = groups.get(leafset)
+            if group is None:
+                group = [0, {}, {}]
+                groups[leafset] = group
+            group[0] += 1
+            for side in splits:
+                group[1][side] = group[1].get(side, 0) + 1
+            for key in get_polytomies(labels, adj, index, leafset):
+                group[2][key] = group[2].get(key, 0) + 1
+
+    return [ntrees, groups]
+
+
+def can_refine(children, side):
+    """
+    Returns True if side is the union of at least two, but not all, of the
+    children of a polytomy, i.e., if the polytomy could be refined to have
+    the bipartition
+    """
+    inside = 0
+    n = 0
+    for child in children:
+        if child & side == child:
+            inside |= child
+            n += 1
+        elif child & side:
+            return False
+    return inside == side and 1 < n < len(children)
+
+
+def annotate_splits(splits, groups):
+    """
+    Counts gene trees that support and conflict with each bipartition
+
+    Parameters
+    ----------
+    splits : list of ints
+             sides of bipartitions of species tree
+    groups : dictionary
+             output of read_split_table()
+
+    Returns list of [support, conflict, informative] for each bipartition,
+    where informative is the number of gene trees in which the restricted
+    bipartition is not trivial
+    """
+    counts = [[0, 0, 0] for split in splits]
+
+    for [leafset, [ntrees, freq, polytomies]] in groups.items():
+        # Species below each polytomy, so most polytomies are ruled out
+        # with one test
+        below = []
+        for [children, npoly] in polytomies.items():
+            mask = 0
+            for child in children:
+                mask |= child
+            below.append([mask, children, npoly])
+
+        for [i, split] in enumerate(splits):
+            side = restrict_split(split, leafset)
+            if side is None:
+                continue
+
+            # A gene tree cannot have a polytomy that can be refined to have
+            # a bipartition it already has, or two polytomies that can be
+            # refined to have the same bipartition
+            support = freq.get(side, 0)
+            neither = 0
+            for [mask, children, npoly] in below:
+                if side & mask == side and can_refine(children, side):
+                    neither += npoly
+
+            counts[i][0] += support
+            counts[i][1] += ntrees - support - neither
+            counts[i][2] += ntrees
+
+    return counts
+
+
+def main(args):
+    stree = treeswift.read_tree_newick(read_text(args.stree))
+
+    index = {}
+    for leaf in stree.traverse_leaves():
+        index[leaf.get_label()] = len(index)
+    species = (1 << len(index)) - 1
+
+    [ntrees, groups] = read_split_table(args.gtrees, index)
+    if ntrees == 0:
+        sys.exit("Error: No trees in %s!\n" % args.gtrees)
+
+    # Bipartition of the edge above each internal node
+    nodes = []
+    splits = []
+    for node in stree.traverse_postorder():
+        if node.is_leaf():
+            node.cluster = 1 << index[node.get_label()]
+        else:
+            node.cluster = 0
+            for child in node.child_nodes():
+                node.cluster |= child.cluster
+            if not node.is_root():
+                nodes.append(node)
+                splits.append(node.cluster)
+
+    counts = annotate_splits(splits, groups)
+
+    # The two edges below the root of a rooted tree have the same
+    # bipartition, so they get the same label but one row in the table
+    rows = {}
+    for [node, [support, conflict, informative]] in zip(nodes, counts):
+        if count_bits(species ^ node.cluster) < 2:
+            # Edge at root of rooted tree with leaf on other side
+            node.label = None
+        else:
+            node.label = "%d/%d" % (support, conflict)
+            split = node.cluster
+            if split & 1:
+                split = species ^ split
+            rows[split] = [support, conflict, informative]
+
+    with open_output(args.output) as f:
+        f.write(stree.newick() + '\n')
+
+    if args.table is not None:
+        labels = [None] * len(index)
+        for [label, i] in index.items():
+            labels[i] = label
+        with open_output(args.table) as f:
+            f.write("support\tconflict\tinformative\tsupport_frequency\t"
+                    "conflict_frequency\tside1\tside2\n")
+            for [split, [support, conflict, informative]] in rows.items():
+                f.write("%d\t%d\t%d\t%1.6f\t%1.6f\t%s\t%s\n"
+                        % (support, conflict, informative,
+                           support / float(ntrees),
+                           conflict / float(ntrees),
+                           ",".join([labels[i] for i in range(len(labels))
+                                     if (split >> i) & 1]),
+                           ",".join([labels[i] for i in range(len(labels))
+                                     if not (split >> i) & 1])))
+
+    sys.stdout.write("Annotated %d edges using %d gene trees (%d sets of "
+                     "species)\n" % (len(rows), ntrees, len(groups)))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-s", "--stree", type=str,
+                        help="Input file containing species tree",
+                        required=True)
+    parser.add_argument("-g", "--gtrees", type=str,
+                        help="Input file containing preprocessed gene trees "
+                             "(output of preprocess_multrees_v3.py)",
+                        required=True)
+    parser.add_argument("-o", "--output", type=str,
+                        help="Output file for species tree with internal "
+                             "nodes labeled 'support/conflict' (numbers of "
+                             "gene trees)",
+                        required=True)
+    parser.add_argument("-t", "--table", type=str,
+                        help="Output TSV file with support, conflict, and "
+                             "number of informative gene trees for each "
+                             "edge, and the two sides of its bipartition",
+                        required=False)
+
+    main(parser.parse_args())
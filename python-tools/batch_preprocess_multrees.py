@@ -0,0 +1,260 @@
+"""
+This file is used to preprocess many files of gene family trees (e.g., one
+per simulation replicate) in one pool of worker processes. Each output file is
+written next to its input file, e.g., g_trees-mult.trees is preprocessed into
+g_trees-mult-for-fastrfs.trees, and output files that are up-to-date are
+skipped, so the same batch can be run again after adding replicates.
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import argparse
+from fastmulrfs.tree_file_io import split_compression_ext
+import glob
+import hashlib
+import multiprocessing
+import os
+from preprocess_multrees_v3 import read_preprocess_and_write_multrees
+import sys
+
+
+def get_output_name(ifile, suffix):
+    """
+    Gets name of output file written next to input file
+
+    Parameters
+    ----------
+    ifile : string
+            name of input file, e.g., rep1/g_trees-mult.trees.gz
+    suffix : string
+             added to input file name, e.g., -for-fastrfs
+
+    Returns name of output file, e.g., rep1/g_trees-mult-for-fastrfs.trees.gz
+    """
+    [name, ext] = split_compression_ext(ifile)
+    [base, dot, tail] = name.rpartition('.')
+    if not dot or os.sep in tail:
+        return name + suffix + ext
+    return base + suffix + '.' + tail + ext
+
+
+def hash_file(name):
+    """
+    Returns SHA-256 hash of file contents
+    """
+    h = hashlib.sha256()
+    with open(name, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def is_up_to_date(ifile, ofile, check):
+    """
+    Checks whether output file is up-to-date
+
+    Parameters
+    ----------
+    ifile : string
+            name of input file
+    ofile : string
+            name of output file
+    check : string
+            'mtime' if output must be newer than input, or 'hash' if the hash
+            of the input must match the hash recorded when the output was
+            written
+    """
+    if not os.path.exists(ofile):
+        return False
+
+    if check == "mtime":
+        return os.path.getmtime(ofile) >= os.path.getmtime(ifile)
+
+    hfile = ofile + ".sha256"
+    if not os.path.exists(hfile):
+        return False
+    with open(hfile, 'r') as f:
+        return f.read().strip() == hash_file(ifile)
+
+
+def preprocess_file(task):
+    """
+    Preprocesses one file (runs in a worker process); the output is written
+    to a temporary file that is renamed when it is complete, so an
+    interrupted batch never leaves behind an output that looks up-to-date
+
+    Parameters
+    ----------
+    task : list
+           [input file name, output file name, check]
+
+    Returns [input file name, error message or None]
+    """
+    [ifile, ofile, check] = task
+    [head, tail] = os.path.split(ofile)
+    temp = os.path.join(head, ".tmp-%d-%s" % (os.getpid(), tail))
+
+    try:
+        if check == "hash":
+            ihash = hash_file(ifile)
+        read_preprocess_and_write_multrees(ifile, temp, False)
+        os.replace(temp, ofile)
+        if check == "hash":
+            with open(ofile + ".sha256", 'w') as f:
+                f.write(ihash + '\n')
+    except Exception as e:
+        if os.path.exists(temp):
+            os.remove(temp)
+        return [ifile, "%s: %s" % (type(e).__name__, e)]
+
+    return [ifile, None]
+
+
+def read_manifest(mfile):
+    """
+    Reads file containing names of input files (one per line); relative
+    names are relative to the directory containing the manifest
+
+    Parameters
+    ----------
+    mfile : string
+            name of manifest file
+
+    Returns list of input file names
+    """
+    root = os.path.dirname(mfile)
+    names = []
+    with open(mfile, 'r') as f:
+        for line in f:
+            name = line.strip()
+            if name and not name.startswith('#'):
+                names.append(os.path.join(root, name))
+    return names
+
+
+def batch_preprocess_multrees(ifiles, suffix, nworkers, check, force,
+                              verbose):
+    """
+    Preprocesses files of gene family trees, largest first, in a pool of
+    worker processes
+
+    Parameters
+    ----------
+    ifiles : list of strings
+             names of input files
+    suffix : string
+             added to input file names to get output file names
+    nworkers : int
+               number of worker processes
+    check : string
+            'mtime' or 'hash' (see is_up_to_date())
+    force : boolean
+            preprocess files even if their outputs are up-to-date
+
+    Returns number of files that failed
+    """
+    tasks = []
+    nskip = 0
+    for ifile in ifiles:
+        ofile = get_output_name(ifile, suffix)
+        if not force and is_up_to_date(ifile, ofile, check):
+            nskip += 1
+            if verbose:
+                sys.stdout.write("Skipping %s as %s is up-to-date\n"
+                                 % (ifile, ofile))
+        else:
+            tasks.append([ifile, ofile, check])
+
+    # Start the largest files first, so the pool finishes at about the same
+    # time (longest processing time first)
+    tasks.sort(key=lambda task: os.path.getsize(task[0]), reverse=True)
+
+    nfail = 0
+    if tasks:
+        with multiprocessing.Pool(min(nworkers, len(tasks))) as pool:
+            for [ifile, error] in pool.imap_unordered(preprocess_file, tasks):
+                if error is not None:
+                    nfail += 1
+                    sys.stderr.write("Failed to preprocess %s (%s)!\n"
+                                     % (ifile, error))
+                elif verbose:
+                    sys.stdout.write("Preprocessed %s\n" % ifile)
+                    sys.stdout.flush()
+
+    sys.stdout.write("Preprocessed %d files, skipped %d up-to-date files, "
+                     "%d files failed\n"
+                     % (len(tasks) - nfail, nskip, nfail))
+    sys.stdout.flush()
+
+    return nfail
+
+
+def main(args):
+    ifiles = []
+    for pattern in args.input:
+        names = sorted(glob.glob(pattern))
+        if not names:
+            sys.exit("Error: No input files match %s!\n" % pattern)
+        ifiles += names
+    if args.manifest is not None:
+        ifiles += read_manifest(args.manifest)
+
+    if not ifiles:
+        sys.exit("Error: No input files given (use -i or -m)!\n")
+
+    # Do not preprocess the same file twice, or our own outputs and hashes
+    outputs = set([get_output_name(ifile, args.suffix) for ifile in ifiles])
+    found = set([])
+    unique = []
+    for ifile in ifiles:
+        if ifile.endswith(".sha256"):
+            continue
+        if ifile not in found and ifile not in outputs:
+            found.add(ifile)
+            unique.append(ifile)
+
+    nfail = batch_preprocess_multrees(unique, args.suffix, args.workers,
+                                      args.check, args.force, args.verbose)
+    if nfail:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-i", "--input", type=str, nargs='+', default=[],
+                        help="Input files or glob patterns, e.g., "
+                             "'rep*/g_trees-mult.trees' (quoted)",
+                        required=False)
+    parser.add_argument("-m", "--manifest", type=str,
+                        help="File listing input files (one per line)",
+                        required=False)
+    parser.add_argument("-s", "--suffix", type=str, default="-for-fastrfs",
+                        help="Added to input file name to get output file "
+                             "name (default: -for-fastrfs)",
+                        required=False)
+    parser.add_argument("-w", "--workers", type=int,
+                        default=os.cpu_count(),
+                        help="Number of worker processes "
+                             "(default: number of CPUs)",
+                        required=False)
+    parser.add_argument("--check", type=str, choices=["mtime", "hash"],
+                        default="mtime",
+                        help="Output is up-to-date if it is newer than the "
+                             "input (mtime) or if it was written for an "
+                             "input with the same SHA-256 hash (hash) "
+                             "(default: mtime)",
+                        required=False)
+    parser.add_argument("--force", action="store_true",
+                        help="Preprocess files even if outputs are "
+                             "up-to-date")
+    parser.add_argument("--verbose", action="store_true")
+
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("argument -w/--workers: must be at least 1")
+
+    main(args)
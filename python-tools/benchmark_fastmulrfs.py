@@ -0,0 +1,303 @@
+"""
+This file is used to benchmark preprocessing (and its stages), the MulRF
+checker, and the RF tools on simulated gene family trees of increasing size.
+Results are written as JSON, which can be given back with --baseline to flag
+performance regressions between commits.
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import argparse
+import json
+import os
+import platform
+from preprocess_multrees_v3 import preprocess_multree
+from preprocess_multrees_v3 import profile_preprocess_newick
+from simulate_multrees import simulate_multrees
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import treeswift
+
+
+PYTHON_TOOLS = os.path.dirname(os.path.abspath(__file__))
+
+
+def time_preprocessing(gtrees):
+    """
+    Times each stage of preprocessing over gene family trees
+
+    Parameters
+    ----------
+    gtrees : list of strings
+             newick strings for gene family trees
+
+    Returns dictionary mapping stage to total wall time (seconds); stages
+    that were not run are missing
+    """
+    totals = {}
+    for newick in gtrees:
+        [result, times, peaks] = profile_preprocess_newick(newick)
+        for [stage, seconds] in times.items():
+            totals[stage] = totals.get(stage, 0.0) + seconds
+    return totals
+
+
+def time_preprocess_multree(gtrees):
+    """
+    Times preprocess_multree() (end-to-end) over gene family trees
+
+    Returns
+    -------
+    seconds : float
+              total wall time
+    preprocessed : list of strings
+                   newick strings for preprocessed trees with >=4 leaves
+    """
+    preprocessed = []
+    start = time.perf_counter()
+    for newick in gtrees:
+        tree = treeswift.read_tree_newick(newick)
+        [nEM, nLM, nR, c, nEMX, nLMX] = preprocess_multree(tree)
+        if nLMX >= 4:
+            preprocessed.append(tree.newick())
+    return [time.perf_counter() - start, preprocessed]
+
+
+def time_script(script, args):
+    """
+    Times python script in python-tools (including python start-up); a
+    warning is written if the script fails, e.g., if check_mulrf_scores_v3.py
+    finds a mismatch, as the timing is still recorded
+
+    Returns wall time (seconds)
+    """
+    cmd = [sys.executable, os.path.join(PYTHON_TOOLS, script)] + args
+    start = time.perf_counter()
+    status = subprocess.call(cmd, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.DEVNULL)
+    seconds = time.perf_counter() - start
+    if status != 0:
+        sys.stderr.write("Warning: %s exited with status %d!\n"
+                         % (script, status))
+    return seconds
+
+
+def run_benchmark(nspecies, ntrees, copies, skew, degree, seed, repeats,
+                  mulrf, workdir):
+    """
+    Runs benchmark for one problem size
+
+    Returns dictionary with problem size and timings (seconds); the median
+    over repeats is reported for each timing
+    """
+    [stree, gtrees] = simulate_multrees(nspecies, ntrees, copies, skew,
+                                        degree, 0.0, seed)
+    nleaves = sum([newick.count(',') + 1 for newick in gtrees])
+
+    sfile = os.path.join(workdir, "s_tree.trees")
+    gfile = os.path.join(workdir, "g_trees-mult.trees")
+    pfile = os.path.join(workdir, "g_trees-mult-for-fastrfs.trees")
+    with open(sfile, 'w') as f:
+        f.write(stree + '\n')
+    with open(gfile, 'w') as f:
+        f.write('\n'.join(gtrees) + '\n')
+
+    repeated = {}
+
+    def record(name, seconds):
+        repeated.setdefault(name, []).append(seconds)
+
+    for r in range(repeats):
+        for [stage, seconds] in time_preprocessing(gtrees).items():
+            record("stage:" + stage, seconds)
+
+        [seconds, preprocessed] = time_preprocess_multree(gtrees)
+        record("preprocess_multree", seconds)
+
+        with open(pfile, 'w') as f:
+            f.write('\n'.join(preprocessed) + '\n')
+
+        record("script:preprocess_multrees_v3",
+               time_script("preprocess_multrees_v3.py",
+                           ["-i", gfile, "-o", pfile]))
+        record("script:compute_total_rf_score",
+               time_script("compute_total_rf_score.py",
+                           ["-s", sfile, "-g", pfile]))
+
+        cfile = os.path.join(workdir, "compare_trees.csv")
+        record("script:compare_tree_lists",
+               time_script("compare_tree_lists.py",
+                           ["-l1", pfile, "-l2", pfile, "-o", cfile]))
+        os.remove(cfile)
+
+        if mulrf is not None:
+            record("script:check_mulrf_scores_v3",
+                   time_script("check_mulrf_scores_v3.py",
+                               ["-s", sfile, "-g", gfile, "-x", mulrf]))
+
+    timings = dict([(name, statistics.median(values))
+                    for [name, values] in repeated.items()])
+
+    return {"species": nspecies,
+            "trees": ntrees,
+            "copies": copies,
+            "skew": skew,
+            "degree": degree,
+            "seed": seed,
+            "leaves": nleaves,
+            "trees_per_second": ntrees / timings["preprocess_multree"],
+            "timings": timings}
+
+
+def get_commit():
+    """
+    Returns git commit of python-tools (or None)
+    """
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], cwd=PYTHON_TOOLS,
+                             check=True, stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.decode("utf-8").strip()
+
+
+def compare_to_baseline(results, bfile, tolerance, min_delta):
+    """
+    Compares timings to baseline results
+
+    Parameters
+    ----------
+    results : dictionary
+              output of main()
+    bfile : string
+            name of JSON file with baseline results
+    tolerance : float
+                timings more than this fraction slower than the baseline
+                are regressions
+    min_delta : float
+                timings less than this many seconds slower than the
+                baseline are never regressions, as short timings are noisy
+
+    Returns number of regressions
+    """
+    with open(bfile, 'r') as f:
+        baseline = json.load(f)
+
+    def key(run):
+        return (run["species"], run["trees"], run["copies"], run["skew"],
+                run["degree"], run["seed"])
+
+    old_runs = dict([(key(run), run) for run in baseline["runs"]])
+
+    nregress = 0
+    for run in results["runs"]:
+        if key(run) not in old_runs:
+            continue
+        old = old_runs[key(run)]["timings"]
+        for [name, seconds] in sorted(run["timings"].items()):
+            if name not in old or old[name] <= 0:
+                continue
+            ratio = seconds / old[name]
+            if ratio > 1.0 + tolerance and seconds - old[name] > min_delta:
+                nregress += 1
+                sys.stdout.write("REGRESSION species=%d copies=%g %s: "
+                                 "%1.4f s -> %1.4f s (%1.2fx)\n"
+                                 % (run["species"], run["copies"], name,
+                                    old[name], seconds, ratio))
+    return nregress
+
+
+def main(args):
+    results = {"commit": get_commit(),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "runs": []}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for nspecies in args.species:
+            for copies in args.copies:
+                run = run_benchmark(nspecies, args.trees, copies, args.skew,
+                                    args.degree, args.seed, args.repeats,
+                                    args.mulrf, workdir)
+                results["runs"].append(run)
+
+                sys.stdout.write("species=%d copies=%g leaves=%d: "
+                                 "%1.1f trees/s\n"
+                                 % (nspecies, copies, run["leaves"],
+                                    run["trees_per_second"]))
+                for [name, seconds] in sorted(run["timings"].items()):
+                    sys.stdout.write("    %-45s %10.4f s\n" % (name, seconds))
+                sys.stdout.flush()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+    if args.baseline is not None:
+        nregress = compare_to_baseline(results, args.baseline,
+                                       args.tolerance, args.min_delta)
+        if nregress:
+            sys.exit("%d timings regressed!\n" % nregress)
+        sys.stdout.write("No timings regressed\n")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-n", "--species", type=int, nargs='+',
+                        default=[25, 50, 100, 200],
+                        help="Numbers of species (default: 25 50 100 200)",
+                        required=False)
+    parser.add_argument("-c", "--copies", type=float, nargs='+',
+                        default=[1.5, 3.0],
+                        help="Mean numbers of copies per species "
+                             "(default: 1.5 3)",
+                        required=False)
+    parser.add_argument("-t", "--trees", type=int, default=100,
+                        help="Number of gene family trees (default: 100)",
+                        required=False)
+    parser.add_argument("--skew", type=float, default=1.0,
+                        help="Skew of extra copies across species "
+                             "(default: 1)",
+                        required=False)
+    parser.add_argument("-d", "--degree", type=int, default=2,
+                        help="Maximum number of children of a node "
+                             "(default: 2)",
+                        required=False)
+    parser.add_argument("--seed", type=int, default=1,
+                        help="Seed for random number generator (default: 1)",
+                        required=False)
+    parser.add_argument("-r", "--repeats", type=int, default=3,
+                        help="Number of repeats; the median is reported "
+                             "(default: 3)",
+                        required=False)
+    parser.add_argument("-x", "--mulrf", type=str,
+                        help="MulRFScorer binary including full path; if "
+                             "given, check_mulrf_scores_v3.py is timed",
+                        required=False)
+    parser.add_argument("-o", "--output", type=str,
+                        default="benchmark.json",
+                        help="Output JSON file (default: benchmark.json)",
+                        required=False)
+    parser.add_argument("-b", "--baseline", type=str,
+                        help="JSON file written by an earlier run; timings "
+                             "are compared against it",
+                        required=False)
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Timings more than this fraction slower than "
+                             "the baseline are regressions (default: 0.25)",
+                        required=False)
+    parser.add_argument("--min-delta", type=float, default=0.05,
+                        help="Timings less than this many seconds slower "
+                             "than the baseline are not regressions "
+                             "(default: 0.05)",
+                        required=False)
+
+    main(parser.parse_args())
@@ -0,0 +1,209 @@
+"""
+This file is used to build the set of bipartitions searched by FastRFS (the
+constraint set) from preprocessed gene trees, without running ASTRAL. Every
+bipartition in the gene trees is counted, bipartitions below frequency
+thresholds are dropped, and (optionally) bipartitions from gene trees that
+are missing species are completed and the set is augmented with the greedy
+consensus of the gene trees.
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import argparse
+from fastmulrfs.tree_file_io import open_input
+from fastmulrfs.tree_file_io import open_output
+from fastmulrfs.tree_topology import complete_split
+from fastmulrfs.tree_topology import format_label
+from fastmulrfs.tree_topology import get_splits
+from fastmulrfs.tree_topology import greedy_consensus
+from fastmulrfs.tree_topology import parse_newick
+import sys
+
+
+def count_splits(ifile):
+    """
+    Counts bipartitions in trees
+
+    Parameters
+    ----------
+    ifile : string
+            name of file containing singly-labeled trees (e.g., output of
+            preprocess_multrees_v3.py)
+
+    Returns
+    -------
+    ntrees : int
+             number of trees
+    index : dictionary
+            maps species label to bit
+    counts : dictionary
+             maps [leaf set, side] (see get_splits()) to number of trees
+    """
+    ntrees = 0
+    index = {}
+    counts = {}
+
+    with open_input(ifile) as f:
+        for line in f:
+            temp = "".join(line.split())
+            if not temp:
+                continue
+            ntrees += 1
+
+            [labels, adj] = parse_newick(temp)
+            [leafset, splits] = get_splits(labels, adj, index)
+            for side in splits:
+                key = (leafset, side)
+                counts[key] = counts.get(key, 0) + 1
+
+    return [ntrees, index, counts]
+
+
+def build_constraint_set(ntrees, species, counts, min_count, min_frequency,
+                         complete, greedy):
+    """
+    Builds constraint set from bipartition counts
+
+    Parameters
+    ----------
+    ntrees : int
+             number of trees
+    species : int
+              bitmask of all species
+    counts : dictionary
+             output of count_splits()
+    min_count : int
+                drop bipartitions found in fewer trees
+    min_frequency : float
+                    drop bipartitions found in a smaller fraction of trees
+    complete : boolean
+               complete bipartitions over subsets of species using the
+               greedy consensus (otherwise they are kept as they are)
+    greedy : boolean
+             add bipartitions in the greedy consensus (even if they are below
+             the thresholds)
+
+    Returns list of [leaf set, side, count]
+    """
+    full = {}
+    partial = {}
+    for [[leafset, side], count] in counts.items():
+        if leafset == species:
+            full[side] = count
+        else:
+            partial[(leafset, side)] = count
+
+    if complete and partial:
+        consensus = greedy_consensus(full)
+        for [[leafset, side], count] in partial.items():
+            side = complete_split(leafset, side, species, consensus)
+            full[side] = full.get(side, 0) + count
+        partial = {}
+
+    threshold = max(min_count, min_frequency * ntrees)
+
+    rows = [[species, side, count] for [side, count] in full.items()
+            if count >= threshold]
+    rows += [[leafset, side, count]
+             for [[leafset, side], count] in partial.items()
+             if count >= threshold]
+
+    if greedy:
+        kept = set([side for [leafset, side, count] in rows
+                    if leafset == species])
+        for side in greedy_consensus(full):
+            if side not in kept:
+                rows.append([species, side, full[side]])
+
+    rows.sort(key=lambda row: (-row[2], row[0], row[1]))
+    return rows
+
+
+def get_labels(mask, labels):
+    """
+    Returns labels of species in bitmask
+    """
+    return [labels[i] for i in range(len(labels)) if (mask >> i) & 1]
+
+
+def write_constraint_set(rows, ntrees, index, ofile, tfile):
+    """
+    Writes bipartitions to TSV file (count, frequency, and the two sides)
+    and optionally as trees with one internal edge, e.g., to give to
+    FastRFS or ASTRAL as extra bipartitions
+    """
+    labels = [None] * len(index)
+    for [label, i] in index.items():
+        labels[i] = label
+
+    with open_output(ofile) as f:
+        f.write("count\tfrequency\tside1\tside2\n")
+        for [leafset, side, count] in rows:
+            f.write("%d\t%1.6f\t%s\t%s\n"
+                    % (count, count / float(ntrees),
+                       ",".join(get_labels(side, labels)),
+                       ",".join(get_labels(leafset ^ side, labels))))
+
+    if tfile is not None:
+        with open_output(tfile) as f:
+            for [leafset, side, count] in rows:
+                side1 = [format_label(l) for l in get_labels(side, labels)]
+                side2 = [format_label(l)
+                         for l in get_labels(leafset ^ side, labels)]
+                f.write("((" + ",".join(side1) + ")," + ",".join(side2) +
+                        ");\n")
+
+
+def main(args):
+    [ntrees, index, counts] = count_splits(args.input)
+    if ntrees == 0:
+        sys.exit("Error: No trees in %s!\n" % args.input)
+
+    species = (1 << len(index)) - 1
+    rows = build_constraint_set(ntrees, species, counts, args.min_count,
+                                args.min_frequency, args.complete,
+                                args.greedy)
+
+    write_constraint_set(rows, ntrees, index, args.output, args.trees)
+
+    sys.stdout.write("Found %d distinct bipartitions in %d trees on %d "
+                     "species; wrote %d bipartitions\n"
+                     % (len(counts), ntrees, len(index), len(rows)))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-i", "--input", type=str,
+                        help="Input file containing preprocessed gene trees "
+                             "(one newick string per line)",
+                        required=True)
+    parser.add_argument("-o", "--output", type=str,
+                        help="Output TSV file with count, frequency, and the "
+                             "two sides of each bipartition",
+                        required=True)
+    parser.add_argument("-t", "--trees", type=str,
+                        help="Also write each bipartition as a tree with one "
+                             "internal edge (e.g., extra trees for FastRFS "
+                             "or ASTRAL)",
+                        required=False)
+    parser.add_argument("--min-count", type=int, default=1,
+                        help="Drop bipartitions found in fewer gene trees "
+                             "(default: 1)",
+                        required=False)
+    parser.add_argument("--min-frequency", type=float, default=0.0,
+                        help="Drop bipartitions found in a smaller fraction "
+                             "of gene trees (default: 0)",
+                        required=False)
+    parser.add_argument("--complete", action="store_true",
+                        help="Complete bipartitions from gene trees that are "
+                             "missing species using the greedy consensus")
+    parser.add_argument("--greedy", action="store_true",
+                        help="Add bipartitions in the greedy consensus, even "
+                             "if they are below the thresholds")
+
+    main(parser.parse_args())
@@ -1,10 +1,12 @@
 import argparse
 import dendropy
+from fastmulrfs.tree_file_io import open_input
+from fastmulrfs.tree_file_io import read_text
+import os
+import os.path
 from preprocess_multrees_v1 import compute_score_shift
 from preprocess_multrees_v1 import preprocess_multree
 from preprocess_multrees_v1 import read_label_map
-import os
-import os.path
 import sys
 
 
@@ -95,7 +97,7 @@ def check_mulrf_scores(sfile, gfile, mfile, mulrf):
            name including full path of MulRFScorer binary
     """
     # Read species tree
-    stree = dendropy.Tree.get(path=sfile,
+    stree = dendropy.Tree.get(data=read_text(sfile),
                               schema="newick",
                               preserve_underscores=True)
     remove_internal_node_labels(stree)
@@ -105,9 +107,9 @@ def check_mulrf_scores(sfile, gfile, mfile, mulrf):
 
     total_rf = 0
 
-    with open(gfile, 'r') as f:
+    with open_input(gfile) as f:
         g = 1
-        for line in f.readlines():
+        for line in f:
             temp = "".join(line.split())
 
             # Build MUL-tree
@@ -1,10 +1,12 @@
 import argparse
+from fastmulrfs.tree_file_io import open_input
+from fastmulrfs.tree_file_io import read_text
+import os
+import os.path
 from preprocess_multrees_v2 import compute_score_shift
 from preprocess_multrees_v2 import preprocess_multree
 from preprocess_multrees_v2 import read_label_map
 from preprocess_multrees_v2 import unroot
-import os
-import os.path
 import sys
 import treeswift
 
@@ -98,7 +100,7 @@ def check_mulrf_scores(sfile, gfile, mfile, mulrf):
            name including full path of MulRFScorer binary
     """
     # Read species tree
-    stree = treeswift.read_tree(sfile, "newick")
+    stree = treeswift.read_tree_newick(read_text(sfile))
     remove_internal_node_labels(stree)
     stree.suppress_unifurcations()
 
@@ -107,9 +109,9 @@ def check_mulrf_scores(sfile, gfile, mfile, mulrf):
 
     total_rf = 0
 
-    with open(gfile, 'r') as f:
+    with open_input(gfile) as f:
         g = 1
-        for line in f.readlines():
+        for line in f:
             temp = "".join(line.split())
 
             # Build MUL-tree
@@ -1,9 +1,18 @@
 import argparse
+from fastmulrfs.checkpoint import open_for_resume
+from fastmulrfs.checkpoint import read_checkpoint
+from fastmulrfs.checkpoint import write_checkpoint
+from fastmulrfs.sampling import reservoir_sample
+from fastmulrfs.sampling import write_estimates
+from fastmulrfs.tree_file_io import get_codec
+from fastmulrfs.tree_file_io import open_input
+from fastmulrfs.tree_file_io import open_output
+from fastmulrfs.tree_file_io import read_text
+import os
+import os.path
 from preprocess_multrees_v3 import compute_score_shift
 from preprocess_multrees_v3 import preprocess_multree
 from preprocess_multrees_v3 import unroot
-import os
-import os.path
 import sys
 import treeswift
 
@@ -67,7 +76,9 @@ def remove_internal_node_labels(tree):
             node.label = None
 
 
-def check_mulrf_scores(sfile, gfile, mulrf):
+def check_mulrf_scores(sfile, gfile, mulrf, cfile=None, every=1,
+                       resume=False, keep_going=False, ffile=None,
+                       sample=None, seed=None):
     """
     Checks RF scores are the same regardless of preprocessing gene family trees
 
@@ -79,17 +90,60 @@ def check_mulrf_scores(sfile, gfile, mulrf):
             name of file containing gene family trees
     mulrf: string
            name including full path of MulRFScorer binary
+    cfile : string
+            name of checkpoint file (optional)
+    every : int
+            number of lines between checkpoints
+    resume : boolean
+             resume from checkpoint file (if it exists)
+    keep_going : boolean
+                 record failures and continue instead of exiting on the
+                 first failure
+    ffile : string
+            name of file for recording failures (optional)
+    sample : int
+             if given, only this many gene family trees, sampled uniformly at
+             random, are checked and the total RF score is estimated from
+             them (cannot be used with checkpoints)
+    seed : int
+           seed for sampling (optional)
     """
     # Read species tree
-    stree = treeswift.read_tree(sfile, "newick")
+    stree = treeswift.read_tree_newick(read_text(sfile))
     remove_internal_node_labels(stree)
     stree.suppress_unifurcations()
 
     total_rf = 0
+    nfail = 0
+    start = 0
+    offset = 0
+
+    if resume:
+        state = read_checkpoint(cfile, gfile)
+        if state is not None:
+            start = state["line"]
+            total_rf = state["total_rf"]
+            nfail = state["failures"]
+            offset = state["offset"]
+
+    if ffile is None:
+        ff = None
+    elif start:
+        ff = open_for_resume(ffile, offset)
+    else:
+        ff = open_output(ffile)
+
+    scores = []
+    with open_input(gfile) as f:
+        if sample is None:
+            lines = enumerate(f, 1)
+        else:
+            [lines, n] = reservoir_sample(f, sample, seed)
+
+        for [g, line] in lines:
+            if g <= start:
+                continue
 
-    with open(gfile, 'r') as f:
-        g = 1
-        for line in f.readlines():
             temp = "".join(line.split())
 
             # Build MUL-tree
@@ -107,21 +161,60 @@ def check_mulrf_scores(sfile, gfile, mulrf):
 
             # Compute MulRF scores
             temp = gfile.rsplit('.', 1)[0]
-            mscore = score_with_MulRF(mulrf, stree, mtree,
-                                      temp + "-scored")
-            mxscore = score_with_MulRF(mulrf, stree, mxtree,
-                                       temp + "-preprocessed-and-scored")
+            try:
+                mscore = score_with_MulRF(mulrf, stree, mtree,
+                                          temp + "-scored")
+                mxscore = score_with_MulRF(mulrf, stree, mxtree,
+                                           temp + "-preprocessed-and-scored")
+            except (IOError, IndexError, ValueError):
+                if not keep_going:
+                    raise
+                mscore = None
+                mxscore = None
 
             # Check scores match!
-            if mxscore + score_shift != mscore:
-                sys.exit("Gene tree on line %d failed!\n" % g)
-
-            total_rf += mscore
-
-            g += 1
-
-    sys.stdout.write('%d\n' % total_rf)
-    sys.stdout.flush()
+            if mscore is None or mxscore + score_shift != mscore:
+                if not keep_going:
+                    sys.exit("Gene tree on line %d failed!\n" % g)
+
+                nfail += 1
+                if mscore is None:
+                    msg = "Gene tree on line %d failed, as MulRF did not " \
+                          "produce a score!\n" % g
+                else:
+                    msg = "Gene tree on line %d failed, as %d + %d != %d!\n" \
+                          % (g, mxscore, score_shift, mscore)
+                if ff is None:
+                    sys.stderr.write(msg)
+                else:
+                    ff.write(msg)
+            else:
+                total_rf += mscore
+                scores.append(mscore)
+
+            if cfile is not None and g % every == 0:
+                if ff is not None:
+                    ff.flush()
+                    offset = ff.tell()
+                write_checkpoint(cfile, gfile, {"line": g,
+                                                "total_rf": total_rf,
+                                                "failures": nfail,
+                                                "offset": offset})
+
+    if ff is not None:
+        ff.close()
+
+    if sample is None:
+        sys.stdout.write('%d\n' % total_rf)
+        sys.stdout.flush()
+    else:
+        # Failed trees have no score, so the estimate is only over the
+        # trees that were scored
+        write_estimates([["total_rf", scores]], len(scores), n, nfail=nfail)
+
+    if nfail:
+        sys.stderr.write("%d gene trees failed!\n" % nfail)
+        os._exit(1)
     os._exit(0)  # CRITICAL ON BLUE WATERS LOGIN NODE
 
 
@@ -129,7 +222,27 @@ def main(args):
     if not os.path.exists(args.mulrf):
         sys.exit(args.mulrf + " does not exist!\n")
 
-    check_mulrf_scores(args.stree, args.gtree, args.mulrf)
+    if args.resume and args.checkpoint is None:
+        sys.exit("Error: --resume requires a checkpoint file (-c)!\n")
+
+    if args.checkpoint is not None and args.failures is not None and \
+       get_codec(args.failures, 'w') is not None:
+        sys.exit("Error: Cannot checkpoint a compressed failures file!\n")
+
+    if args.sample is not None:
+        if args.checkpoint is not None:
+            sys.exit("Error: Cannot checkpoint with --sample!\n")
+        if args.sample < 2:
+            sys.exit("Error: --sample must be at least 2!\n")
+
+    check_mulrf_scores(args.stree, args.gtree, args.mulrf,
+                       cfile=args.checkpoint,
+                       every=args.checkpoint_every,
+                       resume=args.resume,
+                       keep_going=args.keep_going,
+                       ffile=args.failures,
+                       sample=args.sample,
+                       seed=args.seed)
 
 
 if __name__ == '__main__':
@@ -145,5 +258,31 @@ if __name__ == '__main__':
     parser.add_argument("-x", "--mulrf", type=str,
                         help="MulRFScorer binary including full path",
                         required=True)
+    parser.add_argument("-c", "--checkpoint", type=str,
+                        help="Checkpoint file recording the last line "
+                             "checked and the running total RF score",
+                        required=False)
+    parser.add_argument("--checkpoint-every", type=int, default=1,
+                        help="Number of lines between checkpoints "
+                             "(default: 1)",
+                        required=False)
+    parser.add_argument("--resume", action="store_true",
+                        help="Resume from checkpoint file (if it exists)")
+    parser.add_argument("--keep-going", action="store_true",
+                        help="Record failures and keep going instead of "
+                             "exiting on the first failure")
+    parser.add_argument("-f", "--failures", type=str,
+                        help="Output file for recording failures when "
+                             "keeping going (default: standard error)",
+                        required=False)
+    parser.add_argument("--sample", type=int,
+                        help="Check only this many gene trees, sampled "
+                             "uniformly at random in one pass, and print the "
+                             "total RF score estimated from the sample with "
+                             "a 95%% confidence interval",
+                        required=False)
+    parser.add_argument("--seed", type=int,
+                        help="Seed for --sample (optional)",
+                        required=False)
 
     main(parser.parse_args())
@@ -1,6 +1,11 @@
 import argparse
-import dendropy
 from compare_two_trees import compare_trees
+import dendropy
+from fastmulrfs.tree_file_io import open_input
+from fastmulrfs.tree_file_io import open_output
+from fastmulrfs.tree_topology import count_internal_edges
+from fastmulrfs.tree_topology import hash_topology
+from fastmulrfs.tree_topology import parse_newick
 
 
 def main(args):
@@ -9,12 +14,25 @@ def main(args):
     else:
         p = str(args.prefix + ",")
 
-    with open(args.output, 'a+') as fo, \
-         open(args.treelist1, 'r') as f1, \
-         open(args.treelist2, 'r') as f2:
+    with open_output(args.output, 'a') as fo, \
+         open_input(args.treelist1) as f1, \
+         open_input(args.treelist2) as f2:
 
         i = 1
         for l1, l2 in zip(f1, f2):
+            # Identical topologies have RF distance 0, so only pairs with
+            # different (canonical) hashes are compared with DendroPy
+            [labels, adj] = parse_newick(l1)
+            nl = len([l for l in labels if l is not None])
+            if nl >= 4 and len(set(labels)) == nl + 1:
+                h1 = hash_topology(labels, adj)
+                if h1 == hash_topology(*parse_newick(l2)):
+                    ei = count_internal_edges(labels, adj)
+                    fo.write('%s%d,%d,%d,%d,%d,%d,%1.6f\n' % \
+                             (p, i, nl, ei, ei, 0, 0, 0.0))
+                    i = i + 1
+                    continue
+
             taxa = dendropy.TaxonNamespace()
             tre1 = dendropy.Tree.get(string=l1,
                                      schema='newick',
@@ -37,7 +55,7 @@ def main(args):
             i = i + 1
 
 
-if __name__ == "__main__":
+def get_parser():
     parser = argparse.ArgumentParser()
 
     parser.add_argument("-l1", "--treelist1", type=str,
@@ -49,4 +67,8 @@ if __name__ == "__main__":
     parser.add_argument("-o", "--output", type=str,
                         help="Output CSV file", required=True)
 
-    main(parser.parse_args())
+    return parser
+
+
+if __name__ == "__main__":
+    main(get_parser().parse_args())
@@ -11,6 +11,7 @@ import argparse
 import dendropy
 from dendropy.calculate.treecompare \
     import false_positives_and_negatives
+from fastmulrfs.tree_file_io import read_text
 import os
 import sys
 
@@ -94,12 +95,12 @@ def compare_trees(tr1, tr2):
 def main(args):
     taxa = dendropy.TaxonNamespace()
 
-    tree1 = dendropy.Tree.get(path=args.tree1,
+    tree1 = dendropy.Tree.get(data=read_text(args.tree1),
                               schema='newick',
                               rooting='force-unrooted',
                               taxon_namespace=taxa)
 
-    tree2 = dendropy.Tree.get(path=args.tree2,
+    tree2 = dendropy.Tree.get(data=read_text(args.tree2),
                               schema='newick',
                               rooting='force-unrooted',
                               taxon_namespace=taxa)
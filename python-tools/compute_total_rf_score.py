@@ -1,44 +1,275 @@
 import argparse
-import dendropy
 from compare_two_trees import compare_trees
+import dendropy
+from fastmulrfs.sampling import reservoir_sample
+from fastmulrfs.sampling import write_estimates
+from fastmulrfs.tree_file_io import open_input
+from fastmulrfs.tree_file_io import open_output
+from fastmulrfs.tree_file_io import read_text
+from fastmulrfs.tree_topology import count_bits
+from fastmulrfs.tree_topology import get_splits
+from fastmulrfs.tree_topology import parse_newick
+from fastmulrfs.tree_topology import restrict_split
+import functools
+import multiprocessing
 import os
 import sys
 
 
-def main(args):
-    with open(args.stree, 'r') as f:
-        temp = f.read()
+def read_species_tree(temp):
+    """
+    Parses species tree once for score_gene_tree()
+
+    Parameters
+    ----------
+    temp : string
+           newick string of species tree
+
+    Returns
+    -------
+    stree : list
+            [newick string, index, bitmask of species, sides of
+            bipartitions] (see get_splits()); index is None if the species
+            tree is not singly-labeled
+    """
+    temp = "".join(temp.split())
+    [labels, adj] = parse_newick(temp)
+    leaves = [label for label in labels if label is not None]
+    if len(set(leaves)) != len(leaves):
+        return [temp, None, 0, []]
+
+    index = {}
+    [species, splits] = get_splits(labels, adj, index)
+    return [temp, index, species, splits]
+
+
+def score_gene_tree(stree, line):
+    """
+    Computes RF distance between species tree and gene tree restricted to
+    their shared leaves, as compare_trees() does, using bitmasks; trees
+    that are not singly-labeled are compared with DendroPy
+
+    Parameters
+    ----------
+    stree : list
+            output of read_species_tree()
+    line : string
+           newick string of gene tree
+
+    Returns [nl, ei1, ei2, fn, fp, rf] (see compare_trees()), where rf is 0
+    if the trees share fewer than four leaves
+    """
+    [temp, index, species, ssplits] = stree
+
+    [labels, adj] = parse_newick("".join(line.split()))
+    leaves = [label for label in labels if label is not None]
+    if index is None or len(set(leaves)) != len(leaves):
+        return compute_rf_score(temp, line)
+
+    # Gene tree labels that are not in the species tree get bits outside
+    # of the species bitmask
+    index = dict(index)
+    [leafset, gsplits] = get_splits(labels, adj, index)
+    common = leafset & species
+
+    restricted1 = set([restrict_split(side, common) for side in ssplits])
+    restricted1.discard(None)
+    restricted2 = set([restrict_split(side, common) for side in gsplits])
+    restricted2.discard(None)
+
+    nl = count_bits(common)
+    fn = len(restricted1 - restricted2)
+    fp = len(restricted2 - restricted1)
+    if nl < 4:
+        rf = 0.0
+    else:
+        rf = (fn + fp) / (2.0 * nl - 6.0)
+
+    return [nl, len(restricted1), len(restricted2), fn, fp, rf]
+
+
+def score_lines(stree, lines):
+    """
+    Scores block of [line number, line] pairs (runs in a worker process)
+
+    Returns list of [line number] + output of score_gene_tree()
+    """
+    return [[l] + score_gene_tree(stree, line) for [l, line] in lines]
+
+
+def read_numbered_blocks(f, size):
+    """
+    Yields blocks of [line number, line] pairs from file
+    """
+    block = []
+    for l, line in enumerate(f, 1):
+        block.append([l, line])
+        if len(block) == size:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+def compute_total_rf_score(sfile, gfile, ofile=None, nworkers=0):
+    """
+    Computes total RF score between species tree and gene trees
+
+    Parameters
+    ----------
+    sfile : string
+            name of file containing species tree
+    gfile : string
+            name of file containing gene trees (one newick string per line)
+    ofile : string
+            name of output file for the scores of each gene tree, written
+            as they are computed (optional); each row has form:
+            line,nl,ei1,ei2,fn,fp,rf (see compare_trees())
+    nworkers : int
+               number of worker processes; if greater than 0, blocks of
+               gene trees are scored in parallel (and written in order)
+
+    Returns
+    -------
+    total_fn : int
+               total number of species tree edges missing from gene trees
+    total_fp : int
+               total number of gene tree edges missing from species tree
+    total_rf : float
+               total normalized RF distance
+    """
+    stree = read_species_tree(read_text(sfile))
 
     total_fp = 0
     total_fn = 0
     total_rf = 0
 
-    with open(args.gtreelist, 'r') as f:
-        for l, line in enumerate(f.readlines()):
-            taxa = dendropy.TaxonNamespace()
+    if ofile is None:
+        fo = None
+    else:
+        fo = open_output(ofile)
+
+    def record(row):
+        [l, nl, ei1, ei2, fn, fp, rf] = row
+        if fo is not None:
+            fo.write('%d,%d,%d,%d,%d,%d,%1.6f\n'
+                     % (l, nl, ei1, ei2, fn, fp, rf))
+        return [fn, fp, rf]
 
-            stree = dendropy.Tree.get(string=temp,
-                                      schema='newick',
-                                      rooting='force-unrooted',
-                                      taxon_namespace=taxa)
+    with open_input(gfile) as f:
+        if nworkers > 0:
+            with multiprocessing.Pool(nworkers) as pool:
+                for rows in pool.imap(functools.partial(score_lines, stree),
+                                      read_numbered_blocks(f, 256)):
+                    for row in rows:
+                        [fn, fp, rf] = record(row)
+                        total_fp += fp
+                        total_fn += fn
+                        total_rf += rf
+        else:
+            for l, line in enumerate(f, 1):
+                [fn, fp, rf] = record([l] + score_gene_tree(stree, line))
 
-            gtree = dendropy.Tree.get(string=line,
-                                      schema='newick',
-                                      rooting='force-unrooted',
-                                      taxon_namespace=taxa)
+                total_fp += fp
+                total_fn += fn
+                total_rf += rf
 
-            [nl, ei1, ei2, fn, fp, rf] = compare_trees(stree, gtree)
+    if fo is not None:
+        fo.close()
 
-            total_fp += fp
-            total_fn += fn
-            total_rf += rf
+    return [total_fn, total_fp, total_rf]
+
+
+def compute_rf_score(temp, line):
+    """
+    Computes RF score between species tree and gene tree with DendroPy
+
+    Parameters
+    ----------
+    temp : string
+           newick string of species tree
+    line : string
+           newick string of gene tree
+
+    Returns [nl, ei1, ei2, fn, fp, rf] (see compare_trees())
+    """
+    taxa = dendropy.TaxonNamespace()
+
+    stree = dendropy.Tree.get(string=temp,
+                              schema='newick',
+                              rooting='force-unrooted',
+                              taxon_namespace=taxa)
+
+    gtree = dendropy.Tree.get(string=line,
+                              schema='newick',
+                              rooting='force-unrooted',
+                              taxon_namespace=taxa)
+
+    return list(compare_trees(stree, gtree))
+
+
+def estimate_total_rf_score(sfile, gfile, k, seed=None):
+    """
+    Estimates total RF score between species tree and gene trees from K gene
+    trees sampled uniformly at random (in one pass over the gene tree file)
+
+    Parameters
+    ----------
+    sfile : string
+            name of file containing species tree
+    gfile : string
+            name of file containing gene trees (one newick string per line)
+    k : int
+        number of gene trees to sample
+    seed : int
+           seed for random number generator (optional)
+
+    Returns
+    -------
+    rows : list
+           [name, values] pairs for write_estimates()
+    n : int
+        number of gene trees
+    """
+    stree = read_species_tree(read_text(sfile))
+
+    with open_input(gfile) as f:
+        [sample, n] = reservoir_sample(f, k, seed)
+
+    fns = []
+    fps = []
+    rfs = []
+    for [l, line] in sample:
+        [nl, ei1, ei2, fn, fp, rf] = score_gene_tree(stree, line)
+        fns.append(fn)
+        fps.append(fp)
+        rfs.append(rf)
+
+    rows = [["total_fn", fns],
+            ["total_fp", fps],
+            ["total_rf", rfs]]
+    return [rows, n]
+
+
+def main(args):
+    if args.sample is not None:
+        if args.sample < 2:
+            sys.exit("Error: --sample must be at least 2!\n")
+        [rows, n] = estimate_total_rf_score(args.stree, args.gtreelist,
+                                            args.sample, seed=args.seed)
+        write_estimates(rows, args.sample, n)
+        return
+
+    [total_fn, total_fp, total_rf] = compute_total_rf_score(args.stree,
+                                                            args.gtreelist,
+                                                            args.output,
+                                                            args.workers)
 
     sys.stdout.write('%d,%d,%d\n' % (total_fn, total_fp, total_rf))
     sys.stdout.flush()
-    os._exit(0)  # CRITICAL ON BLUE WATERS LOGIN NODE
 
 
-if __name__ == "__main__":
+def get_parser():
     parser = argparse.ArgumentParser()
 
     parser.add_argument("-s", "--stree", type=str,
@@ -48,5 +279,27 @@ if __name__ == "__main__":
                         help="Input file containing gene trees "
                              "(one newick string per line)",
                         required=True)
+    parser.add_argument("-o", "--output", type=str,
+                        help="Output file for the scores of each gene tree "
+                             "(one row per line with form: "
+                             "line,nl,ei1,ei2,fn,fp,rf)",
+                        required=False)
+    parser.add_argument("-w", "--workers", type=int, default=0,
+                        help="Number of worker processes (default: 0)",
+                        required=False)
+    parser.add_argument("--sample", type=int,
+                        help="Score only this many gene trees, sampled "
+                             "uniformly at random in one pass, and print "
+                             "totals estimated from the sample with 95%% "
+                             "confidence intervals",
+                        required=False)
+    parser.add_argument("--seed", type=int,
+                        help="Seed for --sample (optional)",
+                        required=False)
+
+    return parser
 
-    main(parser.parse_args())
+
+if __name__ == "__main__":
+    main(get_parser().parse_args())
+    os._exit(0)  # CRITICAL ON BLUE WATERS LOGIN NODE
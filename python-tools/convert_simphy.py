@@ -0,0 +1,157 @@
+"""
+This file is used to convert locus or gene trees generated by SimPhy in one
+pass, writing the same files as relabel_and_strip_multrees_simphy.py and
+map_species_to_gene_simphy.py:
+    [prefix]-mult.trees : leaves relabeled [sid]
+    [prefix]-s2g.trees : leaves relabeled [sid]_[xgen]
+    [prefix]-s2g-map.txt : species to gene map for ASTRAL-multi
+Trees are written as soon as they are converted, so memory is bounded by the
+number of species, not by the size of the input file.
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import argparse
+from fastmulrfs.tree_file_io import open_input
+from fastmulrfs.tree_file_io import open_output
+from fastmulrfs.tree_file_io import split_compression_ext
+import multiprocessing
+import re
+from relabel_and_strip_multrees_simphy import read_blocks
+from relabel_and_strip_multrees_simphy import relabel_newick_simphy
+
+
+LEAF_LABEL = re.compile(r"[^(),;]+")
+
+
+def number_copies(newick):
+    """
+    Relabels leaves [sid] to [sid]_[xgen], where [xgen] is an integer between
+    1 and the number of copies of the species in the tree (in leaf order)
+
+    Parameters
+    ----------
+    newick : string
+             output of relabel_newick_simphy()
+
+    Returns
+    -------
+    newick : string
+             relabeled newick string
+    ngen : dictionary
+           maps species to number of copies (in order of first appearance)
+    """
+    ngen = {}
+
+    def relabel(match):
+        species = match.group(0)
+        x = ngen.get(species, 0) + 1
+        ngen[species] = x
+        return species + '_' + str(x)
+
+    return [LEAF_LABEL.sub(relabel, newick), ngen]
+
+
+def convert_newick_simphy(temp):
+    """
+    Converts tree given as a newick string
+
+    Parameters
+    ----------
+    temp : string
+           newick string without whitespace
+
+    Returns
+    -------
+    mult : string
+           newick string with leaves relabeled [sid]
+    s2g : string
+          newick string with leaves relabeled [sid]_[xgen]
+    ngen : dictionary
+           maps species to number of copies
+    """
+    mult = relabel_newick_simphy(temp)
+    [s2g, ngen] = number_copies(mult)
+    return [mult, s2g, ngen]
+
+
+def convert_lines_simphy(lines):
+    """
+    Converts block of lines (runs in a worker process)
+
+    Returns list of outputs of convert_newick_simphy()
+    """
+    return [convert_newick_simphy("".join(line.split())) for line in lines]
+
+
+def convert_simphy(ifil, omult, os2g, omap, nworkers=0):
+    """
+    Converts locus or gene trees generated by SimPhy
+
+    Parameters
+    ----------
+    ifil : string
+           name of input file (one newick string per line)
+    omult : string
+            name of output file for trees with leaves relabeled [sid]
+    os2g : string
+           name of output file for trees with leaves relabeled [sid]_[xgen]
+    omap : string
+           name of output file (ASTRAL-multi mapping file)
+    nworkers : int
+               number of worker processes; if greater than 0, blocks of
+               lines are converted in parallel (and written in order)
+    """
+    max_ngen = {}
+
+    def write(fm, fs, result):
+        [mult, s2g, ngen] = result
+        fm.write(mult + '\n')
+        fs.write(s2g + '\n')
+        for [s, x] in ngen.items():
+            if max_ngen.get(s, 0) < x:
+                max_ngen[s] = x
+
+    with open_input(ifil) as fi, open_output(omult) as fm, \
+         open_output(os2g) as fs:
+        if nworkers > 0:
+            with multiprocessing.Pool(nworkers) as pool:
+                for results in pool.imap(convert_lines_simphy,
+                                         read_blocks(fi, 1024)):
+                    for result in results:
+                        write(fm, fs, result)
+        else:
+            for line in fi:
+                write(fm, fs, convert_newick_simphy("".join(line.split())))
+
+    # Write gene to species map
+    with open_output(omap) as f:
+        for s in max_ngen:
+            ng = max_ngen[s]
+            f.write(s + ':')
+            f.write(",".join([s + '_' + str(g) for g in range(1, ng + 1)]))
+            f.write('\n')
+
+
+def main(args):
+    [name, ext] = split_compression_ext(args.input)
+    base = name.rsplit('.', 1)
+    omult = base[0] + "-mult." + base[1] + ext
+    os2g = base[0] + "-s2g." + base[1] + ext
+    omap = base[0] + "-s2g-map.txt" + ext
+    convert_simphy(args.input, omult, os2g, omap, nworkers=args.workers)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-i", "--input", type=str,
+                        help="Input file", required=True)
+    parser.add_argument("-w", "--workers", type=int, default=0,
+                        help="Number of worker processes (default: 0)",
+                        required=False)
+
+    main(parser.parse_args())
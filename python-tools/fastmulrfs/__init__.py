@@ -0,0 +1,79 @@
+"""
+This package exposes the FastMulRFS preprocessing as a python API, so that
+gene family trees can be preprocessed in-process on streaming inputs, e.g.,
+
+    from fastmulrfs import iter_preprocessed, open_input
+
+    with open_input("g_trees-mult.trees.gz") as f:
+        for [newick, stats] in iter_preprocessed(f):
+            if newick is not None:
+                ...
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+from fastmulrfs.tree_file_io import open_input
+from fastmulrfs.tree_file_io import open_output
+from fastmulrfs.tree_topology import canonical_hash
+from fastmulrfs.tree_topology import canonical_newick
+
+
+# preprocess_multrees_v3 imports the helper modules in this package, so it is
+# only imported when one of its functions is first used
+PREPROCESS_FUNCTIONS = ["compute_score_shift",
+                        "preprocess_multree",
+                        "preprocess_newick",
+                        "read_preprocess_and_write_multrees",
+                        "unroot"]
+
+
+def __getattr__(name):
+    if name in PREPROCESS_FUNCTIONS:
+        import preprocess_multrees_v3
+        return getattr(preprocess_multrees_v3, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+SKIP_REASONS = {1: "empty line",
+                2: "<4 leaves before preprocessing",
+                3: "<4 leaves after preprocessing"}
+
+
+def iter_preprocessed(lines):
+    """
+    Preprocesses gene family trees one at a time
+
+    Parameters
+    ----------
+    lines : iterable of strings
+            gene family trees (one newick string per item), e.g., an open
+            file or a generator
+
+    Yields
+    ------
+    newick : string
+             preprocessed MUL-tree or None if the tree should not be given
+             to FastRFS
+    stats : dictionary
+            'line' is the (1-based) position of the tree in lines;
+            'skipped' is None or the reason the tree should not be given to
+            FastRFS; and, if the tree was preprocessed, 'nEM', 'nLM', 'nR',
+            'c', 'nEMX', 'nLMX' are as described in compute_score_shift()
+            and 'score_shift' is the constant shift for its RF score
+    """
+    from preprocess_multrees_v3 import compute_score_shift
+    from preprocess_multrees_v3 import preprocess_newick
+
+    for g, line in enumerate(lines, 1):
+        [donot, newick, counts] = preprocess_newick("".join(line.split()))
+
+        stats = {"line": g, "skipped": SKIP_REASONS.get(donot)}
+        if counts is not None:
+            [nEM, nLM, nR, c, nEMX, nLMX] = counts
+            stats.update(nEM=nEM, nLM=nLM, nR=nR, c=c, nEMX=nEMX, nLMX=nLMX)
+            stats["score_shift"] = compute_score_shift(*counts)
+
+        yield [newick, stats]
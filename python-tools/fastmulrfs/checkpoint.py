@@ -0,0 +1,93 @@
+"""
+This file is used to save and restore the progress of long runs, so that a
+run that dies part way through a file of gene trees can be resumed.
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import json
+import os
+import sys
+
+
+def read_checkpoint(cfile, ifile):
+    """
+    Reads checkpoint file
+
+    Parameters
+    ----------
+    cfile : string
+            name of checkpoint file
+    ifile : string
+            name of input file that the run is processing
+
+    Returns
+    -------
+    state : dictionary
+            progress saved by write_checkpoint(), or None if the checkpoint
+            file does not exist
+    """
+    if not os.path.exists(cfile):
+        return None
+
+    with open(cfile, 'r') as f:
+        state = json.load(f)
+
+    if state["input"] != os.path.abspath(ifile):
+        sys.exit("Error: Checkpoint file %s was written for input file %s!\n"
+                 % (cfile, state["input"]))
+
+    return state
+
+
+def write_checkpoint(cfile, ifile, state):
+    """
+    Writes checkpoint file; the file is replaced atomically, so the last
+    checkpoint survives if the run is killed while writing
+
+    Parameters
+    ----------
+    cfile : string
+            name of checkpoint file
+    ifile : string
+            name of input file that the run is processing
+    state : dictionary
+            progress to save, e.g., last line committed to the output
+    """
+    state["input"] = os.path.abspath(ifile)
+
+    temp = cfile + ".tmp"
+    with open(temp, 'w') as f:
+        json.dump(state, f)
+        f.write('\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, cfile)
+
+
+def open_for_resume(ofile, offset):
+    """
+    Opens output file for appending after discarding anything written after
+    the last checkpoint
+
+    Parameters
+    ----------
+    ofile : string
+            name of output file
+    offset : int
+             size of output file at the last checkpoint
+
+    Returns file object positioned at the end of the output file
+    """
+    if not os.path.exists(ofile):
+        if offset:
+            sys.exit("Error: Cannot resume as %s does not exist!\n" % ofile)
+        return open(ofile, 'w')
+
+    f = open(ofile, 'r+')
+    f.truncate(offset)
+    f.seek(offset)
+    return f
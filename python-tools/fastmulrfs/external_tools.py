@@ -0,0 +1,31 @@
+"""
+This file is used to find the external programs run by the FastMulRFS
+pipeline (see external/README.md for how to get them).
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import os
+import shutil
+
+
+EXTERNAL = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "..", "..", "external")
+
+
+def get_fastrfs():
+    """
+    Returns name of FastRFS binary including full path, i.e.,
+    external/FastRFS/build/FastRFS in a clone of this repository if it was
+    built there, and otherwise FastRFS on the PATH (if there is one)
+    """
+    fastrfs = os.path.normpath(os.path.join(EXTERNAL, "FastRFS", "build",
+                                            "FastRFS"))
+    if not os.path.exists(fastrfs):
+        found = shutil.which("FastRFS")
+        if found is not None:
+            return found
+    return fastrfs
@@ -0,0 +1,195 @@
+"""
+This file is used to report the progress of long runs: a short progress line
+is written at most every few seconds, and metrics are written to a file in
+the Prometheus text format, so that they can be picked up by the textfile
+collector of node-exporter while the run is going.
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import os
+import sys
+import time
+
+
+SKIP_LABELS = {1: "empty_line",
+               2: "few_leaves_before",
+               3: "few_leaves_after"}
+
+
+def escape_label_value(value):
+    """
+    Escapes label value for the Prometheus text format
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RunMetrics:
+    """
+    Counts gene trees as they are preprocessed, writes a progress line at
+    most every progress_every seconds, and rewrites the metrics file at most
+    every metrics_every seconds (and when the run ends)
+    """
+    def __init__(self, ifile, mfile=None, metrics_every=15.0,
+                 progress_every=None):
+        self.ifile = ifile
+        self.mfile = mfile
+        self.metrics_every = metrics_every
+        self.progress_every = progress_every
+
+        self.line = 0
+        self.nread = 0
+        self.nwritten = 0
+        self.nskipped = dict([(donot, 0) for donot in SKIP_LABELS])
+        self.score_shift = 0
+        self.ncontracted = 0
+        self.npruned = 0
+        self.nverified = 0
+        self.nfailed = 0
+
+        # Number of gene trees in last progress line
+        self.nprogress = None
+
+        self.start = time.time()
+        self.next_metrics = self.start
+        if progress_every is None:
+            self.next_progress = None
+        else:
+            self.next_progress = self.start + progress_every
+
+    def update(self, g, donot, score_shift, ncontracted, npruned):
+        """
+        Records gene tree
+
+        Parameters
+        ----------
+        g : int
+            line number of gene tree in input file
+        donot : int
+                see preprocess_newick()
+        score_shift : int
+                      constant shift for the RF score of the gene tree
+                      (0 if it was not written)
+        ncontracted : int
+                      number of edges contracted as they induce invalid
+                      bipartitions
+        npruned : int
+                  number of leaves pruned as they are extra copies of species
+        """
+        self.line = g
+        self.nread += 1
+        if donot:
+            self.nskipped[donot] += 1
+        else:
+            self.nwritten += 1
+        self.score_shift += score_shift
+        self.ncontracted += ncontracted
+        self.npruned += npruned
+
+        now = time.time()
+        if self.next_progress is not None and now >= self.next_progress:
+            self.write_progress(now)
+            self.next_progress = now + self.progress_every
+        if self.mfile is not None and now >= self.next_metrics:
+            self.write_metrics(now, False)
+            self.next_metrics = now + self.metrics_every
+
+    def update_verified(self, passed):
+        """
+        Records gene tree checked by verifying its score shift
+
+        Parameters
+        ----------
+        passed : boolean
+                 True if the scores matched
+        """
+        self.nverified += 1
+        if not passed:
+            self.nfailed += 1
+
+    def get_rate(self, now):
+        elapsed = now - self.start
+        if elapsed <= 0:
+            return 0.0
+        return self.nread / elapsed
+
+    def write_progress(self, now):
+        self.nprogress = self.nread
+        sys.stdout.write("Preprocessed %d gene trees (line %d, %d skipped, "
+                         "%1.1f trees/s)\n"
+                         % (self.nread, self.line,
+                            sum(self.nskipped.values()),
+                            self.get_rate(now)))
+        sys.stdout.flush()
+
+    def write_metrics(self, now, done):
+        """
+        Writes metrics file; the file is replaced atomically, so the
+        collector never reads a partial file
+        """
+        label = 'input="%s"' % escape_label_value(os.path.abspath(self.ifile))
+
+        rows = [["trees_read_total", "counter",
+                 "Gene trees read in this run", [["", self.nread]]],
+                ["trees_written_total", "counter",
+                 "Preprocessed gene trees written", [["", self.nwritten]]],
+                ["trees_skipped_total", "counter",
+                 "Gene trees not written by reason",
+                 [[',reason="%s"' % SKIP_LABELS[donot], self.nskipped[donot]]
+                  for donot in sorted(SKIP_LABELS)]],
+                ["score_shift_total", "counter",
+                 "Sum of RF score shifts of written gene trees",
+                 [["", self.score_shift]]],
+                ["edges_contracted_total", "counter",
+                 "Edges contracted as they induce invalid bipartitions",
+                 [["", self.ncontracted]]],
+                ["leaves_pruned_total", "counter",
+                 "Leaves pruned as extra copies of species",
+                 [["", self.npruned]]],
+                ["trees_verified_total", "counter",
+                 "Gene trees checked by verifying the score shift",
+                 [["", self.nverified]]],
+                ["verification_failures_total", "counter",
+                 "Gene trees whose score shift failed verification",
+                 [["", self.nfailed]]],
+                ["last_line", "gauge",
+                 "Line number of last gene tree read", [["", self.line]]],
+                ["trees_per_second", "gauge",
+                 "Gene trees read per second", [["", self.get_rate(now)]]],
+                ["elapsed_seconds", "gauge",
+                 "Seconds since the run started",
+                 [["", now - self.start]]],
+                ["done", "gauge",
+                 "1 if the run finished successfully",
+                 [["", int(done)]]],
+                ["last_update_timestamp_seconds", "gauge",
+                 "Time the metrics were written", [["", now]]]]
+
+        temp = self.mfile + ".tmp"
+        with open(temp, 'w') as f:
+            for [name, kind, text, samples] in rows:
+                name = "fastmulrfs_preprocess_" + name
+                f.write("# HELP %s %s\n" % (name, text))
+                f.write("# TYPE %s %s\n" % (name, kind))
+                for [extra, value] in samples:
+                    f.write("%s{%s%s} %s\n" % (name, label, extra, value))
+        os.replace(temp, self.mfile)
+
+    def close(self, done):
+        """
+        Writes final progress line (unless the last progress line was
+        written after the last gene tree) and metrics
+
+        Parameters
+        ----------
+        done : boolean
+               True if the run finished successfully
+        """
+        now = time.time()
+        if self.progress_every is not None and self.nprogress != self.nread:
+            self.write_progress(now)
+        if self.mfile is not None:
+            self.write_metrics(now, done)
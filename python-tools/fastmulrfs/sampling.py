@@ -0,0 +1,128 @@
+"""
+This file is used to get quick estimates for very large collections of gene
+trees: K trees are sampled uniformly at random in one pass over the input
+(reservoir sampling), and totals over all trees are extrapolated from the
+sample with confidence intervals.
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import math
+import random
+import sys
+
+
+def reservoir_sample(items, k, seed=None):
+    """
+    Samples k items uniformly at random without replacement in one pass
+    (Algorithm R), keeping at most k items in memory
+
+    Parameters
+    ----------
+    items : iterable
+            items to sample from (e.g., lines of a file)
+    k : int
+        number of items to sample
+    seed : int
+           seed for random number generator (optional)
+
+    Returns
+    -------
+    sample : list
+             [position, item] pairs in the order of the input, where
+             position starts at 1 (e.g., line number)
+    n : int
+        number of items
+    """
+    rng = random.Random(seed)
+    sample = []
+    n = 0
+    for item in items:
+        n += 1
+        if len(sample) < k:
+            sample.append([n, item])
+        else:
+            j = rng.randrange(n)
+            if j < k:
+                sample[j] = [n, item]
+    sample.sort(key=lambda pair: pair[0])
+    return [sample, n]
+
+
+def extrapolate_total(values, n, z=1.96):
+    """
+    Estimates total over all items from values for a uniform sample without
+    replacement; the confidence interval uses the normal approximation with
+    the finite population correction, so it has zero width when every item
+    is in the sample (and the total is unknown when there are no values)
+
+    Parameters
+    ----------
+    values : list of numbers
+             value for each item in the sample
+    n : int
+        number of items in the population
+    z : float
+        standard normal quantile (default: 1.96 for a 95% interval)
+
+    Returns
+    -------
+    total : float
+            estimated total
+    lower : float
+            lower bound of confidence interval
+    upper : float
+            upper bound of confidence interval
+    """
+    k = len(values)
+    if k == 0:
+        if n == 0:
+            return [0.0, 0.0, 0.0]
+        return [math.nan, -math.inf, math.inf]
+
+    mean = sum(values) / float(k)
+    total = n * mean
+    if k == 1 or k >= n:
+        if k >= n:
+            return [total, total, total]
+        return [total, -math.inf, math.inf]
+
+    var = sum([(x - mean) ** 2 for x in values]) / (k - 1)
+    se = n * math.sqrt(var / k) * math.sqrt((n - k) / float(n - 1))
+    return [total, total - z * se, total + z * se]
+
+
+def write_estimates(rows, k, n, f=sys.stdout, nfail=0):
+    """
+    Writes extrapolated totals
+
+    Parameters
+    ----------
+    rows : list
+           [name, values] pairs, where values has one value per sampled
+           item (see extrapolate_total())
+    k : int
+        number of items sampled and scored
+    n : int
+        number of items in the population
+    f : file object
+        output file (default: standard output)
+    nfail : int
+            number of other sampled items that failed; they are left out of
+            the estimates, which treat the k scored items as the sample
+    """
+    if nfail:
+        f.write("Sampled %d of %d gene trees (%d more failed and are not "
+                "in the estimates); estimated totals with 95%% confidence "
+                "intervals:\n" % (min(k, n), n, nfail))
+    else:
+        f.write("Sampled %d of %d gene trees; estimated totals with 95%% "
+                "confidence intervals:\n" % (min(k, n), n))
+    for [name, values] in rows:
+        [total, lower, upper] = extrapolate_total(values, n)
+        f.write("%-30s %14.1f  [%1.1f, %1.1f]\n"
+                % (name, total, lower, upper))
+    f.flush()
@@ -0,0 +1,54 @@
+"""
+This file is used to find the Unix domain socket shared by
+fastmulrfs_server.py and fastmulrfs_client.py.
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import os
+import socket
+import tempfile
+
+
+def get_socket_dir():
+    """
+    Returns directory for the default server socket, i.e., $XDG_RUNTIME_DIR
+    or, if it is not set, fastmulrfs-$UID in the temporary directory
+    """
+    try:
+        return os.environ["XDG_RUNTIME_DIR"]
+    except KeyError:
+        return os.path.join(tempfile.gettempdir(),
+                            "fastmulrfs-%d" % os.getuid())
+
+
+def get_default_socket():
+    """
+    Returns default name of the server socket
+    """
+    try:
+        return os.environ["FASTMULRFS_SOCKET"]
+    except KeyError:
+        return os.path.join(get_socket_dir(), "fastmulrfs.sock")
+
+
+def is_listening(sock):
+    """
+    Checks whether a server is accepting connections on socket
+
+    Parameters
+    ----------
+    sock : string
+           name of server socket
+
+    Returns True if a connection can be made and False otherwise
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(sock)
+        except OSError:
+            return False
+    return True
@@ -0,0 +1,281 @@
+"""
+This file is used to open (possibly compressed) tree files. Files compressed
+with gzip, bzip2, or xz are detected by their extension or by their magic
+bytes, and are decompressed (or compressed) on a background thread, so that
+decompression overlaps with parsing trees.
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import bz2
+import gzip
+import lzma
+import os
+import queue
+import threading
+
+
+CODECS = {".gz": gzip, ".bz2": bz2, ".xz": lzma}
+
+MAGIC_BYTES = [(b"\x1f\x8b", gzip),
+               (b"BZh", bz2),
+               (b"\xfd7zXZ\x00", lzma)]
+
+# Number of characters passed between threads at a time
+BLOCK_SIZE = 1 << 20
+
+# Number of blocks that can be waiting to be read or written
+QUEUE_SIZE = 8
+
+
+def split_compression_ext(name):
+    """
+    Splits compression extension from file name
+
+    Parameters
+    ----------
+    name : string
+           name of file
+
+    Returns
+    -------
+    base : string
+           name of file without compression extension
+    ext : string
+          compression extension (e.g. ".gz") or empty string
+    """
+    [base, ext] = os.path.splitext(name)
+    if ext in CODECS:
+        return [base, ext]
+    return [name, ""]
+
+
+def get_codec(name, mode):
+    """
+    Gets compression module for file
+
+    Parameters
+    ----------
+    name : string
+           name of file
+    mode : string
+           'r' for reading, 'w' for writing, or 'a' for appending
+
+    Returns compression module (gzip, bz2, or lzma) or None if file is not
+    compressed; when reading, the magic bytes of the file are checked if the
+    extension is not recognized
+    """
+    ext = split_compression_ext(name)[1]
+    if ext:
+        return CODECS[ext]
+
+    if mode != 'r':
+        return None
+
+    with open(name, 'rb') as f:
+        head = f.read(6)
+    for [magic, codec] in MAGIC_BYTES:
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+class BackgroundReader:
+    """
+    Text file object for reading a compressed file; lines are decompressed on
+    a background thread and handed over in blocks through a bounded queue
+    """
+    def __init__(self, name, codec):
+        self.name = name
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.stop = threading.Event()
+        self.lines = []
+        self.index = 0
+        self.done = False
+        self.thread = threading.Thread(target=self._decompress,
+                                       args=(codec,), daemon=True)
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _decompress(self, codec):
+        try:
+            with codec.open(self.name, 'rt') as f:
+                while not self.stop.is_set():
+                    block = f.readlines(BLOCK_SIZE)
+                    if not block:
+                        break
+                    self._put(block)
+        except Exception as e:
+            self._put(e)
+            return
+        self._put(None)
+
+    def _next_block(self):
+        item = self.queue.get()
+        if item is None:
+            self.done = True
+            return False
+        if isinstance(item, Exception):
+            self.done = True
+            raise item
+        self.lines = item
+        self.index = 0
+        return True
+
+    def readline(self):
+        while self.index >= len(self.lines):
+            if self.done or not self._next_block():
+                return ""
+        line = self.lines[self.index]
+        self.index += 1
+        return line
+
+    def readlines(self):
+        return [line for line in self]
+
+    def read(self):
+        return "".join(self.readlines())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class BackgroundWriter:
+    """
+    Text file object for writing a compressed file; text is handed over in
+    blocks through a bounded queue and compressed on a background thread
+    """
+    def __init__(self, name, codec, mode):
+        self.name = name
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.buffer = []
+        self.size = 0
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._compress,
+                                       args=(codec, mode), daemon=True)
+        self.thread.start()
+
+    def _compress(self, codec, mode):
+        try:
+            with codec.open(self.name, mode + 't') as f:
+                while True:
+                    block = self.queue.get()
+                    if block is None:
+                        break
+                    f.write(block)
+        except Exception as e:
+            self.error = e
+            # Keep draining the queue so the writing thread does not block
+            while self.queue.get() is not None:
+                pass
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.size += len(text)
+        if self.size >= BLOCK_SIZE:
+            self.flush()
+
+    def flush(self):
+        self._check()
+        if self.buffer:
+            self.queue.put("".join(self.buffer))
+            self.buffer = []
+            self.size = 0
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_input(name):
+    """
+    Opens (possibly compressed) file for reading text
+
+    Parameters
+    ----------
+    name : string
+           name of file
+
+    Returns file object
+    """
+    codec = get_codec(name, 'r')
+    if codec is None:
+        return open(name, 'r')
+    return BackgroundReader(name, codec)
+
+
+def open_output(name, mode='w'):
+    """
+    Opens file for writing text; the file is compressed if its name ends
+    with ".gz", ".bz2", or ".xz"
+
+    Parameters
+    ----------
+    name : string
+           name of file
+    mode : string
+           'w' for writing or 'a' for appending
+
+    Returns file object
+    """
+    codec = get_codec(name, mode)
+    if codec is None:
+        return open(name, mode)
+    return BackgroundWriter(name, codec, mode)
+
+
+def read_text(name):
+    """
+    Reads (possibly compressed) file into string
+
+    Parameters
+    ----------
+    name : string
+           name of file
+
+    Returns contents of file
+    """
+    with open_input(name) as f:
+        return f.read()
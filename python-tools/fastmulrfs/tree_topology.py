@@ -0,0 +1,460 @@
+"""
+This file is used to work with the topology of singly-labeled trees given as
+newick strings, without building treeswift or DendroPy trees: branch lengths,
+internal node labels, and comments are ignored, and trees are unrooted.
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import hashlib
+import re
+
+
+TOKEN = re.compile(r"'(?:[^']|'')*'|\[[^\]]*\]|[(),;:]|[^(),;:'\[\s]+")
+UNSAFE = re.compile(r"[(),;:'\[\]\s]")
+
+
+def parse_newick(newick):
+    """
+    Parses newick string into an unrooted tree; internal nodes with two
+    neighbors (e.g., the root of a rooted tree) are suppressed
+
+    Parameters
+    ----------
+    newick : string
+             newick string
+
+    Returns
+    -------
+    labels : list
+             label of each node (None for internal nodes)
+    adj : list of lists
+          neighbors of each node
+    """
+    labels = []
+    adj = []
+    stack = []
+    prev = None
+
+    for token in TOKEN.findall(newick):
+        if token == '(':
+            node = len(labels)
+            labels.append(None)
+            adj.append([])
+            if stack:
+                adj[stack[-1]].append(node)
+                adj[node].append(stack[-1])
+            stack.append(node)
+        elif token == ')':
+            stack.pop()
+        elif token == ';':
+            break
+        elif token[0] == '[':
+            # Comments do not change what the next token means
+            continue
+        elif token not in ",:" and prev not in (')', ':'):
+            # Label of a leaf (labels after ')' are internal node labels and
+            # labels after ':' are branch lengths)
+            if token[0] == "'":
+                token = token[1:-1].replace("''", "'")
+            node = len(labels)
+            labels.append(token)
+            adj.append([])
+            if stack:
+                adj[stack[-1]].append(node)
+                adj[node].append(stack[-1])
+        prev = token
+
+    return suppress_degree_two(labels, adj)
+
+
+def suppress_degree_two(labels, adj):
+    """
+    Removes internal nodes with one or two neighbors, joining the neighbors,
+    and renumbers the remaining nodes
+
+    Returns [labels, adj] as for parse_newick()
+    """
+    todo = [v for v in range(len(labels))
+            if labels[v] is None and len(adj[v]) <= 2]
+    while todo:
+        v = todo.pop()
+        if adj[v] is None or len(adj[v]) > 2:
+            continue
+        if len(adj[v]) == 2:
+            [a, b] = adj[v]
+            adj[a][adj[a].index(v)] = b
+            adj[b][adj[b].index(v)] = a
+        elif len(adj[v]) == 1:
+            a = adj[v][0]
+            adj[a].remove(v)
+            if labels[a] is None and len(adj[a]) <= 2:
+                todo.append(a)
+        adj[v] = None
+
+    keep = [v for v in range(len(labels)) if adj[v] is not None]
+    index = dict([(v, i) for i, v in enumerate(keep)])
+    return [[labels[v] for v in keep],
+            [[index[u] for u in adj[v]] for v in keep]]
+
+
+def format_label(label):
+    """
+    Returns label, quoted if it cannot be written in newick as is
+    """
+    if UNSAFE.search(label):
+        return "'" + label.replace("'", "''") + "'"
+    return label
+
+
+def get_postorder(adj, root, parent):
+    """
+    Returns list of [node, parent] pairs for the subtree below root, with
+    each node after the nodes below it
+
+    Parameters
+    ----------
+    adj : list of lists
+          neighbors of each node
+    root : int
+           root of subtree
+    parent : int
+             neighbor of root that is not in the subtree
+    """
+    order = []
+    stack = [[root, parent]]
+    while stack:
+        [node, above] = stack.pop()
+        order.append([node, above])
+        for u in adj[node]:
+            if u != above:
+                stack.append([u, node])
+    order.reverse()
+    return order
+
+
+def get_canonical_start(labels):
+    """
+    Returns leaf with the smallest label (where canonical forms start) or
+    None if the tree has no leaves
+    """
+    leaves = [v for v in range(len(labels)) if labels[v] is not None]
+    if not leaves:
+        return None
+    return min(leaves, key=lambda v: labels[v])
+
+
+def canonical_newick(newick):
+    """
+    Computes canonical newick string for the unrooted topology of a
+    singly-labeled tree: the tree is written from the leaf with the smallest
+    label, children are sorted, and branch lengths and internal node labels
+    are dropped, so two trees have the same canonical newick string if and
+    only if they have the same unrooted topology
+
+    Parameters
+    ----------
+    newick : string
+             newick string
+
+    Returns canonical newick string
+    """
+    [labels, adj] = parse_newick(newick)
+    return newick_topology(labels, adj)
+
+
+def newick_topology(labels, adj):
+    """
+    Writes canonical newick string for tree returned by parse_newick() (see
+    canonical_newick())
+    """
+    start = get_canonical_start(labels)
+    if start is None:
+        return ";"
+    if not adj[start]:
+        return format_label(labels[start]) + ";"
+
+    below = adj[start][0]
+    text = {}
+    for [node, above] in get_postorder(adj, below, start):
+        if labels[node] is not None:
+            text[node] = format_label(labels[node])
+        else:
+            text[node] = "(" + ",".join(sorted([text[u] for u in adj[node]
+                                                if u != above])) + ")"
+
+    if labels[below] is not None:
+        subtrees = [text[below]]
+    else:
+        subtrees = sorted([text[u] for u in adj[below] if u != start])
+    return "(" + ",".join([format_label(labels[start])] + subtrees) + ");"
+
+
+def hash_topology(labels, adj):
+    """
+    Computes canonical hash for the unrooted topology of a singly-labeled
+    tree in linear time: the digest of each subtree is computed from the
+    sorted digests of its children (below the leaf with the smallest label),
+    so the hash does not depend on the rooting or the order of children
+
+    Parameters
+    ----------
+    labels : list
+             label of each node (see parse_newick())
+    adj : list of lists
+          neighbors of each node (see parse_newick())
+
+    Returns hexadecimal SHA-1 digest
+    """
+    start = get_canonical_start(labels)
+    if start is None:
+        return hashlib.sha1(b";").hexdigest()
+
+    def leaf_digest(label):
+        return hashlib.sha1(b"L" + label.encode("utf-8")).digest()
+
+    if not adj[start]:
+        return hashlib.sha1(leaf_digest(labels[start])).hexdigest()
+
+    below = adj[start][0]
+    digest = {}
+    for [node, above] in get_postorder(adj, below, start):
+        if labels[node] is not None:
+            digest[node] = leaf_digest(labels[node])
+        else:
+            digest[node] = hashlib.sha1(
+                b"(" + b"".join(sorted([digest[u] for u in adj[node]
+                                        if u != above])) + b")").digest()
+
+    if labels[below] is not None:
+        subtrees = [digest[below]]
+    else:
+        subtrees = sorted([digest[u] for u in adj[below] if u != start])
+    return hashlib.sha1(b"(" + leaf_digest(labels[start]) +
+                        b"".join(subtrees) + b")").hexdigest()
+
+
+def canonical_hash(newick):
+    """
+    Computes canonical hash for the unrooted topology of a singly-labeled
+    tree (see hash_topology()); two trees have the same hash if and only if
+    they have the same unrooted topology (barring SHA-1 collisions)
+
+    Parameters
+    ----------
+    newick : string
+             newick string
+
+    Returns hexadecimal SHA-1 digest
+    """
+    [labels, adj] = parse_newick(newick)
+    return hash_topology(labels, adj)
+
+
+def count_internal_edges(labels, adj):
+    """
+    Returns number of internal edges in tree returned by parse_newick()
+    """
+    ninternal = len([v for v in range(len(labels)) if labels[v] is None])
+    return max(ninternal - 1, 0)
+
+
+def get_splits(labels, adj, index):
+    """
+    Gets the nontrivial bipartitions (splits) of a singly-labeled tree as
+    bitmasks over species
+
+    Parameters
+    ----------
+    labels : list
+             label of each node (see parse_newick())
+    adj : list of lists
+          neighbors of each node (see parse_newick())
+    index : dictionary
+            maps species label to bit; species that are not in the
+            dictionary are added to it
+
+    Returns
+    -------
+    leafset : int
+              bitmask of species in the tree
+    splits : list of ints
+             bitmask of one side of each split; the side without the lowest
+             bit in leafset is given
+    """
+    leafset = 0
+    for label in labels:
+        if label is not None:
+            if label not in index:
+                index[label] = len(index)
+            leafset |= 1 << index[label]
+
+    start = get_canonical_start(labels)
+    if start is None or not adj[start]:
+        return [leafset, []]
+
+    low = leafset & -leafset
+    below = adj[start][0]
+    mask = {}
+    splits = []
+    for [node, above] in get_postorder(adj, below, start):
+        if labels[node] is not None:
+            mask[node] = 1 << index[labels[node]]
+        else:
+            mask[node] = 0
+            for u in adj[node]:
+                if u != above:
+                    mask[node] |= mask[u]
+            side = mask[node]
+            if node != below and count_bits(leafset ^ side) > 1:
+                if side & low:
+                    side = leafset ^ side
+                splits.append(side)
+
+    return [leafset, splits]
+
+
+def restrict_split(side, leafset):
+    """
+    Restricts bipartition of species tree (either side) to species in
+    leafset
+
+    Returns side of restricted bipartition without the lowest species in
+    leafset (see get_splits()), or None if the restricted bipartition is
+    trivial
+    """
+    side = side & leafset
+    other = leafset ^ side
+    if count_bits(side) < 2 or count_bits(other) < 2:
+        return None
+    if side & leafset & -leafset:
+        return other
+    return side
+
+
+def count_bits(mask):
+    """
+    Returns number of bits set in bitmask
+    """
+    return bin(mask).count('1')
+
+
+def are_compatible(side1, side2):
+    """
+    Checks whether two splits over the same species (given by their sides
+    without the lowest species, see get_splits()) can be in the same tree
+    """
+    inter = side1 & side2
+    return inter == 0 or inter == side1 or inter == side2
+
+
+def greedy_consensus(counts):
+    """
+    Builds greedy consensus of splits over the same species: splits are
+    added from most to least frequent if they are compatible with every
+    split added so far
+
+    Parameters
+    ----------
+    counts : dictionary
+             maps side of split (see get_splits()) to number of trees
+
+    Returns list of sides of splits in the greedy consensus
+    """
+    order = sorted(counts.keys(), key=lambda side: (-counts[side], side))
+    accepted = []
+    for side in order:
+        if all([are_compatible(side, other) for other in accepted]):
+            accepted.append(side)
+    return accepted
+
+
+def complete_split(leafset, side, species, consensus):
+    """
+    Completes split over a subset of species (e.g., from a gene tree that
+    is missing species) to a split over all species: each missing species
+    joins the side that is more common in the smallest cluster of the
+    consensus tree that contains it and decides between the two sides
+
+    Parameters
+    ----------
+    leafset : int
+              bitmask of species in the split
+    side : int
+           bitmask of one side of the split (see get_splits())
+    species : int
+              bitmask of all species
+    consensus : list of ints
+                sides of compatible splits over all species (e.g., output of
+                greedy_consensus()); each side is a cluster that does not
+                contain the lowest species
+
+    Returns side of completed split that does not contain the lowest species
+    """
+    other = leafset ^ side
+    clusters = sorted(consensus, key=count_bits)
+
+    completed = side
+    missing = species ^ leafset
+    while missing:
+        bit = missing & -missing
+        missing ^= bit
+        for cluster in clusters:
+            if cluster & bit:
+                a = count_bits(cluster & side)
+                b = count_bits(cluster & other)
+                if a > b:
+                    completed |= bit
+                    break
+                if b > a:
+                    break
+        # Missing species that no cluster decides join the other side
+
+    low = species & -species
+    if completed & low:
+        completed = species ^ completed
+    return completed
+
+
+class TopologyCounter:
+    """
+    Counts distinct unrooted topologies among trees, in order of first
+    appearance (see canonical_newick())
+    """
+    def __init__(self):
+        self.index = {}
+        self.counts = []
+        self.ntrees = 0
+
+    def add(self, newick):
+        """
+        Counts tree
+
+        Parameters
+        ----------
+        newick : string
+                 newick string
+
+        Returns canonical newick string if this is the first tree with its
+        topology, and otherwise None
+        """
+        self.ntrees += 1
+        canon = canonical_newick(newick)
+        i = self.index.get(canon)
+        if i is None:
+            self.index[canon] = len(self.counts)
+            self.counts.append(1)
+            return canon
+        self.counts[i] += 1
+        return None
+
+    def get_ratio(self):
+        """
+        Returns number of trees per distinct topology
+        """
+        if not self.counts:
+            return 1.0
+        return self.ntrees / float(len(self.counts))
@@ -0,0 +1,96 @@
+"""
+This file is used to send requests to fastmulrfs_server.py, e.g.,
+
+    python fastmulrfs_client.py preprocess -i g_trees-mult.trees \
+                                           -o g_trees-mult-for-fastrfs.trees
+
+runs preprocess_multrees_v3.py on the server. The arguments after the command
+are the same as for the script that runs the command:
+
+    preprocess : preprocess_multrees_v3.py
+    score : compute_total_rf_score.py
+    compare : compare_tree_lists.py
+
+This file only imports the python standard library and the fastmulrfs
+package (which does not import treeswift or dendropy), so it starts quickly.
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import argparse
+from fastmulrfs.server_socket import get_default_socket
+import json
+import os
+import socket
+import sys
+
+
+def send_request(sock, command, argv):
+    """
+    Sends request to server and waits for reply
+
+    Parameters
+    ----------
+    sock : string
+           name of server socket
+    command : string
+              'preprocess', 'score', 'compare', or 'shutdown'
+    argv : list of strings
+           command line arguments for the script that runs the command
+
+    Returns reply as dictionary with keys 'status', 'stdout', and 'stderr'
+    """
+    request = {"command": command, "argv": argv, "cwd": os.getcwd()}
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(sock)
+        with s.makefile('rwb') as f:
+            f.write((json.dumps(request) + '\n').encode("utf-8"))
+            f.flush()
+            reply = f.readline()
+
+    if not reply:
+        sys.exit("Error: Server closed connection without replying!\n")
+
+    return json.loads(reply.decode("utf-8"))
+
+
+def main(args):
+    sock = args.socket
+    if sock is None:
+        sock = get_default_socket()
+
+    try:
+        reply = send_request(sock, args.command, args.args)
+    except (ConnectionRefusedError, FileNotFoundError):
+        sys.exit("Error: No server listening on %s; start one with "
+                 "fastmulrfs_server.py!\n" % sock)
+
+    sys.stdout.write(reply["stdout"])
+    sys.stdout.flush()
+    sys.stderr.write(reply["stderr"])
+    sys.stderr.flush()
+    sys.exit(reply["status"])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-S", "--socket", type=str,
+                        help="Unix domain socket of server "
+                             "(default: $FASTMULRFS_SOCKET or "
+                             "fastmulrfs.sock in $XDG_RUNTIME_DIR or in "
+                             "/tmp/fastmulrfs-$UID)",
+                        required=False)
+    parser.add_argument("command", type=str,
+                        choices=["preprocess", "score", "compare",
+                                 "shutdown"],
+                        help="Command to run on server")
+    parser.add_argument("args", nargs=argparse.REMAINDER,
+                        help="Arguments for command (same as for the script "
+                             "that runs the command)")
+
+    main(parser.parse_args())
@@ -0,0 +1,172 @@
+"""
+This file is used to run a long-lived local server that keeps the python
+tools (and their dependencies) loaded, so that many small runs do not pay for
+starting python and importing treeswift and dendropy each time. Requests are
+sent over a Unix domain socket by fastmulrfs_client.py, which has the same
+command line interface as the scripts.
+
+Each request is handled in a process forked from the server, so requests run
+in parallel and cannot change the state of the server.
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import argparse
+import compare_tree_lists
+import compute_total_rf_score
+import contextlib
+from fastmulrfs.server_socket import get_default_socket
+from fastmulrfs.server_socket import get_socket_dir
+from fastmulrfs.server_socket import is_listening
+import io
+import json
+import os
+import preprocess_multrees_v3
+import signal
+import socketserver
+import stat
+import sys
+
+
+COMMANDS = {"preprocess": preprocess_multrees_v3,
+            "score": compute_total_rf_score,
+            "compare": compare_tree_lists}
+
+
+def run_command(command, argv, cwd):
+    """
+    Runs script as if it was called from the command line
+
+    Parameters
+    ----------
+    command : string
+              'preprocess', 'score', or 'compare'
+    argv : list of strings
+           command line arguments for the script
+    cwd : string
+          working directory of the client
+
+    Returns
+    -------
+    status : int
+             exit status
+    stdout : string
+             standard output
+    stderr : string
+             standard error
+    """
+    out = io.StringIO()
+    err = io.StringIO()
+    status = 0
+
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            if command not in COMMANDS:
+                sys.exit("Error: Unknown command %s!\n" % command)
+            os.chdir(cwd)
+            module = COMMANDS[command]
+            parser = module.get_parser()
+            parser.prog = "fastmulrfs_client.py " + command
+            module.main(parser.parse_args(argv))
+        except SystemExit as e:
+            if e.code is None:
+                status = 0
+            elif isinstance(e.code, int):
+                status = e.code
+            else:
+                err.write(str(e.code))
+                status = 1
+        except Exception as e:
+            err.write("Error: %s: %s\n" % (type(e).__name__, e))
+            status = 1
+
+    return [status, out.getvalue(), err.getvalue()]
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handles one request, i.e., one JSON object on one line with keys
+    'command', 'argv', and 'cwd'; replies with one JSON object on one line
+    with keys 'status', 'stdout', and 'stderr'
+    """
+    def handle(self):
+        request = json.loads(self.rfile.readline().decode("utf-8"))
+
+        if request["command"] == "shutdown":
+            reply = {"status": 0, "stdout": "", "stderr": ""}
+            os.kill(os.getppid(), signal.SIGTERM)
+        else:
+            [status, out, err] = run_command(request["command"],
+                                             request["argv"],
+                                             request["cwd"])
+            reply = {"status": status, "stdout": out, "stderr": err}
+
+        self.wfile.write((json.dumps(reply) + '\n').encode("utf-8"))
+        self.wfile.flush()
+
+
+class Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def exit_on_signal(signum, frame):
+    sys.exit(0)
+
+
+def main(args):
+    signal.signal(signal.SIGTERM, exit_on_signal)
+
+    sdir = os.path.dirname(os.path.abspath(args.socket))
+    if not os.path.isdir(sdir):
+        os.makedirs(sdir, mode=0o700)
+    if sdir == os.path.abspath(get_socket_dir()):
+        info = os.stat(sdir)
+        if info.st_uid != os.getuid() or info.st_mode & 0o077:
+            sys.exit("Error: Socket directory %s must be owned by and only "
+                     "accessible to the current user!\n" % sdir)
+
+    if os.path.exists(args.socket):
+        if is_listening(args.socket):
+            sys.exit("Error: Another server is listening on %s!\n"
+                     % args.socket)
+        if not stat.S_ISSOCK(os.stat(args.socket).st_mode):
+            sys.exit("Error: %s exists and is not a socket!\n" % args.socket)
+        # Left behind by a server that did not shut down cleanly
+        os.remove(args.socket)
+
+    umask = os.umask(0o077)
+    server = Server(args.socket, RequestHandler)
+    os.umask(umask)
+
+    sys.stdout.write("Listening on %s...\n" % args.socket)
+    sys.stdout.flush()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-S", "--socket", type=str,
+                        default=get_default_socket(),
+                        help="Unix domain socket to listen on "
+                             "(default: $FASTMULRFS_SOCKET or "
+                             "fastmulrfs.sock in $XDG_RUNTIME_DIR or in "
+                             "/tmp/fastmulrfs-$UID)",
+                        required=False)
+
+    return parser
+
+
+if __name__ == '__main__':
+    main(get_parser().parse_args())
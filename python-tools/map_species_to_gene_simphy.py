@@ -9,6 +9,9 @@ see https://opensource.org/licenses/BSD-3-Clause
 """
 import argparse
 import dendropy
+from fastmulrfs.tree_file_io import open_input
+from fastmulrfs.tree_file_io import open_output
+from fastmulrfs.tree_file_io import split_compression_ext
 import sys
 
 
@@ -29,10 +32,10 @@ def map_species_to_genes_simphy(ifil, otre, omap):
            name of output file (ASTRAL-multi mapping file)
     """
     max_ngen = {}
-    ostr = ""
 
-    with open(ifil, 'r') as f:
-        for line in f.readlines():
+    # Write multrees with re-labeled leaves as they are read
+    with open_input(ifil) as f, open_output(otre) as fo:
+        for line in f:
             ngen = {}
             temp = "".join(line.split())
             taxa = dendropy.TaxonNamespace()
@@ -57,7 +60,7 @@ def map_species_to_genes_simphy(ifil, otre, omap):
                     # Remove internal node label
                     node.label = None
 
-            ostr += tree.as_string(schema="newick")[5:].replace("'", "")
+            fo.write(tree.as_string(schema="newick")[5:].replace("'", ""))
 
             for s in ngen:
                 try:
@@ -67,12 +70,8 @@ def map_species_to_genes_simphy(ifil, otre, omap):
                 except KeyError:
                     max_ngen[s] = ngen[s]
 
-    # Write multrees with re-labeled leaves
-    with open(otre, 'w') as f:
-        f.write(ostr)
-
     # Write gene to species map
-    with open(omap, 'w') as f:
+    with open_output(omap) as f:
         for s in max_ngen:
             ng = max_ngen[s]
             f.write(s + ':')
@@ -82,11 +81,12 @@ def map_species_to_genes_simphy(ifil, otre, omap):
 
 
 def main(args):
-    base = args.input.rsplit('.', 1)
+    [name, ext] = split_compression_ext(args.input)
+    base = name.rsplit('.', 1)
     prefix = base[0]
     suffix = base[1]
-    otre = base[0] + "-s2g." + base[1]
-    omap = base[0] + "-s2g-map.txt"
+    otre = base[0] + "-s2g." + base[1] + ext
+    omap = base[0] + "-s2g-map.txt" + ext
     map_species_to_genes_simphy(args.input, otre, omap)
 
 
@@ -0,0 +1,319 @@
+"""
+This file is used to compute the distance between every pair of MUL-trees
+(e.g., gene family trees) in a collection, e.g., to cluster gene families by
+topology. Each internal edge of a MUL-tree splits its leaves into two
+multisets of species labels (a multiset bipartition); the distance between
+two MUL-trees is the number of multiset bipartitions that are in one tree but
+not the other (counted with multiplicity), so it is the RF distance when both
+trees are singly-labeled. Trees are unrooted, and branch lengths and internal
+node labels are ignored.
+
+Each tree is reduced to a signature (its multiset bipartitions as integer
+ids) in one pass, an inverted index maps each multiset bipartition to the
+trees that have it, and the matrix is computed in blocks of rows with numpy
+and written as a .npy file, so it can be memory-mapped, e.g.,
+numpy.load(name, mmap_mode='r').
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import argparse
+from fastmulrfs.tree_file_io import open_input
+from fastmulrfs.tree_file_io import open_output
+from fastmulrfs.tree_topology import get_canonical_start
+from fastmulrfs.tree_topology import get_postorder
+from fastmulrfs.tree_topology import parse_newick
+import hashlib
+import multiprocessing
+import numpy
+import sys
+
+
+MASK = (1 << 64) - 1
+
+WORKER_STATE = {}
+
+
+def get_label_hash(label, cache):
+    """
+    Returns 64-bit hash of species label; the hash of a multiset of labels is
+    the sum of the hashes of its labels (modulo 2^64), so the hash of one
+    side of an edge can be computed from the hash of the other side
+    """
+    value = cache.get(label)
+    if value is None:
+        digest = hashlib.sha1(label.encode("utf-8")).digest()
+        value = int.from_bytes(digest[:8], "little")
+        cache[label] = value
+    return value
+
+
+def get_multiset_bipartitions(labels, adj, cache):
+    """
+    Gets the multiset bipartitions induced by the internal edges of a
+    MUL-tree
+
+    Parameters
+    ----------
+    labels : list
+             label of each node (see parse_newick())
+    adj : list of lists
+          neighbors of each node (see parse_newick())
+    cache : dictionary
+            maps species label to hash (see get_label_hash())
+
+    Returns list of [hash of one side, hash of other side] pairs (the smaller
+    hash first), one for each internal edge; two edges, in the same tree or
+    in different trees, induce the same multiset bipartition if and only if
+    they have the same pair (barring hash collisions)
+    """
+    start = get_canonical_start(labels)
+    if start is None or not adj[start]:
+        return []
+
+    below = adj[start][0]
+    down = {}
+    for [node, above] in get_postorder(adj, below, start):
+        if labels[node] is not None:
+            down[node] = get_label_hash(labels[node], cache)
+        else:
+            value = 0
+            for u in adj[node]:
+                if u != above:
+                    value += down[u]
+            down[node] = value & MASK
+
+    total = (down[below] + get_label_hash(labels[start], cache)) & MASK
+
+    keys = []
+    for node in down:
+        # The edge above node is internal if both of its ends are internal
+        # nodes; the edge above below ends at start, which is a leaf
+        if labels[node] is None and node != below:
+            side = down[node]
+            other = (total - side) & MASK
+            keys.append((min(side, other), max(side, other)))
+    return keys
+
+
+def build_signatures(ifile):
+    """
+    Computes signature of each MUL-tree in file
+
+    Parameters
+    ----------
+    ifile : string
+            name of file containing MUL-trees (one newick string per line)
+
+    Returns
+    -------
+    sigs : list of numpy arrays
+           sorted ids of the multiset bipartitions of each tree; the k-th
+           copy of a multiset bipartition in a tree has its own id, so the
+           number of shared ids of two trees is the size of the intersection
+           of their multisets of multiset bipartitions
+    nids : int
+           number of ids
+    lines : list of ints
+            line number of each tree (empty lines are skipped)
+    """
+    cache = {}
+    ids = {}
+    sigs = []
+    lines = []
+
+    with open_input(ifile) as f:
+        for g, line in enumerate(f, 1):
+            temp = "".join(line.split())
+            if not temp:
+                continue
+
+            [labels, adj] = parse_newick(temp)
+
+            copies = {}
+            sig = []
+            for key in get_multiset_bipartitions(labels, adj, cache):
+                k = copies.get(key, 0)
+                copies[key] = k + 1
+                i = ids.get((key, k))
+                if i is None:
+                    i = len(ids)
+                    ids[(key, k)] = i
+                sig.append(i)
+
+            sigs.append(numpy.array(sorted(sig), dtype=numpy.int64))
+            lines.append(g)
+
+    return [sigs, len(ids), lines]
+
+
+def build_inverted_index(sigs, nids):
+    """
+    Builds inverted index from ids to trees
+
+    Returns list with, for each id, sorted numpy array of the trees (row
+    numbers) with that id, or None if only one tree has it (as it adds
+    nothing to the distances between pairs of trees)
+    """
+    sizes = numpy.array([len(sig) for sig in sigs], dtype=numpy.int64)
+    if sizes.sum() == 0:
+        return [None] * nids
+
+    ids = numpy.concatenate(sigs)
+    trees = numpy.repeat(numpy.arange(len(sigs), dtype=numpy.int64), sizes)
+
+    # Stable sort keeps the trees of each id in order
+    order = numpy.argsort(ids, kind="stable")
+    counts = numpy.bincount(ids, minlength=nids)
+    postings = numpy.split(trees[order], numpy.cumsum(counts)[:-1])
+
+    return [p if len(p) > 1 else None for p in postings]
+
+
+def compute_distance_block(a, b, sigs, postings, sizes):
+    """
+    Computes rows a to b-1 of distance matrix
+
+    Returns numpy array with b - a rows and one column per tree
+    """
+    shared = numpy.zeros((b - a, len(sigs)), dtype=numpy.int64)
+
+    block = [sig for sig in sigs[a:b] if len(sig)]
+    if block:
+        for i in numpy.unique(numpy.concatenate(block)):
+            p = postings[i]
+            if p is None:
+                continue
+            lo = numpy.searchsorted(p, a)
+            hi = numpy.searchsorted(p, b)
+            # Every tree in the block with this id shares it with every
+            # tree in the posting list
+            shared[numpy.ix_(p[lo:hi] - a, p)] += 1
+
+    distances = sizes[a:b, None] + sizes[None, :] - 2 * shared
+
+    # Ids that only one tree has are not in the index
+    rows = numpy.arange(b - a)
+    distances[rows, rows + a] = 0
+    return distances
+
+
+def init_worker(sigs, postings, sizes, ofile):
+    WORKER_STATE["sigs"] = sigs
+    WORKER_STATE["postings"] = postings
+    WORKER_STATE["sizes"] = sizes
+    WORKER_STATE["matrix"] = numpy.load(ofile, mmap_mode="r+")
+
+
+def write_distance_block(bounds):
+    """
+    Computes block of rows and writes it to the memory-mapped matrix (runs
+    in a worker process)
+    """
+    [a, b] = bounds
+    matrix = WORKER_STATE["matrix"]
+    matrix[a:b] = compute_distance_block(a, b, WORKER_STATE["sigs"],
+                                         WORKER_STATE["postings"],
+                                         WORKER_STATE["sizes"])
+    matrix.flush()
+    return b - a
+
+
+def write_distance_matrix(ofile, sigs, postings, chunk=None, nworkers=0):
+    """
+    Computes distance matrix and writes it to .npy file
+
+    Parameters
+    ----------
+    ofile : string
+            name of output file
+    sigs : list of numpy arrays
+           output of build_signatures()
+    postings : list of numpy arrays
+               output of build_inverted_index()
+    chunk : int
+            number of rows per block (default: blocks of about 2^24 entries)
+    nworkers : int
+               number of worker processes; if greater than 0, blocks are
+               computed in parallel
+    """
+    n = len(sigs)
+    sizes = numpy.array([len(sig) for sig in sigs], dtype=numpy.int64)
+
+    if n and 2 * sizes.max() > numpy.iinfo(numpy.uint16).max:
+        dtype = numpy.uint32
+    else:
+        dtype = numpy.uint16
+
+    matrix = numpy.lib.format.open_memmap(ofile, mode="w+", dtype=dtype,
+                                          shape=(n, n))
+
+    if chunk is None:
+        chunk = max(1, (1 << 24) // max(n, 1))
+    bounds = [[a, min(a + chunk, n)] for a in range(0, n, chunk)]
+
+    if nworkers > 0:
+        matrix.flush()
+        del matrix
+        with multiprocessing.Pool(nworkers, initializer=init_worker,
+                                  initargs=(sigs, postings, sizes,
+                                            ofile)) as pool:
+            for nrows in pool.imap_unordered(write_distance_block, bounds):
+                pass
+    else:
+        for [a, b] in bounds:
+            matrix[a:b] = compute_distance_block(a, b, sigs, postings, sizes)
+        matrix.flush()
+        del matrix
+
+
+def main(args):
+    [sigs, nids, lines] = build_signatures(args.input)
+    if not sigs:
+        sys.exit("Error: No trees in %s!\n" % args.input)
+
+    postings = build_inverted_index(sigs, nids)
+
+    write_distance_matrix(args.output, sigs, postings,
+                          chunk=args.chunk_rows, nworkers=args.workers)
+
+    if args.lines is not None:
+        with open_output(args.lines) as f:
+            for g in lines:
+                f.write("%d\n" % g)
+
+    sys.stdout.write("Wrote %d x %d distance matrix (%d distinct multiset "
+                     "bipartitions, %d in more than one tree)\n"
+                     % (len(sigs), len(sigs), nids,
+                        len([p for p in postings if p is not None])))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-i", "--input", type=str,
+                        help="Input file containing MUL-trees, e.g., gene "
+                             "family trees with leaves labeled by species "
+                             "(one newick string per line)",
+                        required=True)
+    parser.add_argument("-o", "--output", type=str,
+                        help="Output .npy file with the distance matrix "
+                             "(one row and column per nonempty line)",
+                        required=True)
+    parser.add_argument("-l", "--lines", type=str,
+                        help="Output file with the line number of the tree "
+                             "in each row (one per line)",
+                        required=False)
+    parser.add_argument("--chunk-rows", type=int,
+                        help="Number of rows computed at a time (default: "
+                             "blocks of about 2^24 entries)",
+                        required=False)
+    parser.add_argument("-w", "--workers", type=int, default=0,
+                        help="Number of worker processes (default: 0)",
+                        required=False)
+
+    main(parser.parse_args())
@@ -12,6 +12,8 @@ see https://opensource.org/licenses/BSD-3-Clause
 """
 import argparse
 import dendropy
+from fastmulrfs.tree_file_io import open_input
+from fastmulrfs.tree_file_io import open_output
 import sys
 
 
@@ -236,8 +238,8 @@ def read_label_map(ifile):
     g2s_map = {}
     s2g_map = {}
 
-    with open(ifile, 'r') as f:
-        for line in f.readlines():
+    with open_input(ifile) as f:
+        for line in f:
             [species, genes] = line.split(':')
             genes = genes.split(',')
             genes[-1] = genes[-1].replace('\n', '')
@@ -270,9 +272,9 @@ def read_preprocess_and_write_multrees(ifile, mfile, ofile, verbose):
     """
     [g2s_map, s2g_map] = read_label_map(mfile)
 
-    with open(ifile, 'r') as fi, open(ofile, 'w') as fo:
+    with open_input(ifile) as fi, open_output(ofile) as fo:
         g = 1
-        for line in fi.readlines():
+        for line in fi:
             if verbose:
                 sys.stdout.write("Preprocessing gene tree on line %d...\n" % g)
                 sys.stdout.flush()
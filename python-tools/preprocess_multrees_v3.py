@@ -11,7 +11,28 @@ License: 3-Clause BSD,
 see https://opensource.org/licenses/BSD-3-Clause
 """
 import argparse
+import collections
+from fastmulrfs.checkpoint import open_for_resume
+from fastmulrfs.checkpoint import read_checkpoint
+from fastmulrfs.checkpoint import write_checkpoint
+from fastmulrfs.run_metrics import RunMetrics
+from fastmulrfs.sampling import reservoir_sample
+from fastmulrfs.sampling import write_estimates
+from fastmulrfs.tree_file_io import get_codec
+from fastmulrfs.tree_file_io import open_input
+from fastmulrfs.tree_file_io import open_output
+from fastmulrfs.tree_file_io import read_text
+from fastmulrfs.tree_topology import TopologyCounter
+import multiprocessing
+import os
+from preprocess_multrees_v2 import read_label_map
+import queue
+import random
 import sys
+import tempfile
+import threading
+import time
+import tracemalloc
 import treeswift
 
 
@@ -28,6 +49,51 @@ def count_leaves(tree):
     return len([l for l in tree.traverse_leaves()])
 
 
+def read_gene_to_species_map(mfile):
+    """
+    Reads file containing map from gene copy to species labels
+
+    Parameters
+    ----------
+    mfile : string
+            name of file containing map between gene copy and species labels
+            each row has form:
+            species_name:gene_name_1,gene_name_2,...
+
+    Returns dictionary mapping gene copy label to [species label, index of
+    gene copy in its row]; species labels are interned, so every leaf of the
+    same species shares one string object (whose hash is computed once)
+    """
+    [g2s_map, s2g_map] = read_label_map(mfile)
+
+    label_map = {}
+    for [species, genes] in s2g_map.items():
+        species = sys.intern(species)
+        for rank, gene in enumerate(genes):
+            label_map[gene] = [species, rank]
+
+    return label_map
+
+
+def relabel_gene_copies(tree, label_map):
+    """
+    Relabels leaves from gene copy to species labels, annotating each leaf
+    with the index of its gene copy in the label map (its 'rank')
+
+    Parameters
+    ----------
+    tree : treeswift tree object
+    label_map : dictionary
+                output of read_gene_to_species_map()
+    """
+    for leaf in tree.traverse_leaves():
+        try:
+            [leaf.label, leaf.rank] = label_map[leaf.label]
+        except KeyError:
+            raise ValueError("Gene copy label %s is not in label map"
+                             % leaf.label)
+
+
 def unroot(tree):
     """
     Unroot tree
@@ -52,7 +118,96 @@ def unroot(tree):
             left.contract()
 
 
-def build_down_profiles(tree):
+class SubtreeCache:
+    """
+    Assigns each rooted subtree an id by hash-consing, so subtrees with the
+    same topology and leaf labels get the same id across gene trees, and
+    caches the down profile of each subtree by id. The cached profiles hold
+    at most maxsize species labels in total, and the least recently used
+    subtrees are evicted first (ids are not reused, so a later copy of an
+    evicted subtree just gets a new id)
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.size = 0
+        self.subtrees = collections.OrderedDict()
+        self.nids = 0
+        self.hits = 0
+        self.misses = 0
+        self.nevicted = 0
+
+    def find(self, key):
+        """
+        Returns [id, down profile] of subtree with key, or None if it is not
+        cached
+        """
+        entry = self.subtrees.get(key)
+        if entry is not None:
+            self.subtrees.move_to_end(key)
+            self.hits += 1
+        return entry
+
+    def add(self, key, profile):
+        """
+        Caches down profile of subtree with key under a new id, evicting the
+        least recently used subtrees if the cache is full
+
+        Returns [id, down profile] of subtree
+        """
+        self.misses += 1
+        entry = [self.nids, profile]
+        self.nids += 1
+        self.subtrees[key] = entry
+        self.size += len(entry[1])
+        while self.size > self.maxsize:
+            [old, evicted] = self.subtrees.popitem(last=False)
+            self.size -= len(evicted[1])
+            self.nevicted += 1
+        return entry
+
+    def get_leaf(self, label):
+        """
+        Returns [id, down profile] of leaf (its key is its label)
+        """
+        entry = self.find(label)
+        if entry is None:
+            entry = self.add(label, frozenset([label]))
+        return entry
+
+    def get_subtree(self, children):
+        """
+        Returns [id, down profile] of subtree given [id, down profile] of
+        each child of its root (its key is the sorted ids of the children)
+        """
+        if len(children) == 2:
+            [x, y] = children
+            if x[0] < y[0]:
+                key = (x[0], y[0])
+            else:
+                key = (y[0], x[0])
+        else:
+            key = tuple(sorted([child[0] for child in children]))
+
+        entry = self.find(key)
+        if entry is None:
+            entry = self.add(key, frozenset().union(*[child[1]
+                                                      for child in children]))
+        return entry
+
+    def write_report(self):
+        total = self.hits + self.misses
+        if total:
+            rate = 100.0 * self.hits / total
+        else:
+            rate = 0.0
+        sys.stdout.write("Subtree cache: %d of %d subtrees found (%1.1f%%), "
+                         "%d profiles built, %d evicted, %d cached\n"
+                         % (self.hits, total, rate, self.misses,
+                            self.nevicted, len(self.subtrees)))
+        sys.stdout.flush()
+
+
+def build_down_profiles(tree, cache=None):
     """
     Annotates edge above each node with an 'down profile', i.e., the set of
     species below the edge
@@ -60,7 +215,21 @@ def build_down_profiles(tree):
     Parameters
     ----------
     tree : treeswift tree object
+    cache : SubtreeCache object
+            if given, down profiles are looked up by subtree and shared
+            (as frozensets) with other gene trees (optional)
     """
+    if cache is not None:
+        for node in tree.traverse_postorder():
+            if node.is_leaf():
+                entry = cache.get_leaf(node.get_label())
+            else:
+                entry = cache.get_subtree([child.subtree
+                                           for child in node.child_nodes()])
+            node.subtree = entry
+            node.down = entry[1]
+        return
+
     for node in tree.traverse_postorder():
         if node.is_leaf():
             node.down = set([node.get_label()])
@@ -112,7 +281,18 @@ def build_up_profiles(tree):
                     node.up = node.up.union(sibl.down)
 
 
-def contract_edges_w_invalid_bipartitions(tree):
+def get_support(node):
+    """
+    Returns support value of edge above node, read from the node label, or
+    None if the label is not a number
+    """
+    try:
+        return float(node.get_label())
+    except (TypeError, ValueError):
+        return None
+
+
+def contract_edges_w_invalid_bipartitions(tree, min_support=None):
     """
     Contracts edges that do not induce valid bipartitions
 
@@ -121,6 +301,11 @@ def contract_edges_w_invalid_bipartitions(tree):
     Parameters
     ----------
     tree : treeswift tree object
+    min_support : float
+                  also contract internal edges with support (internal node
+                  label) below this value; as if they had been contracted
+                  before preprocessing, they are not counted as edges of the
+                  MUL-tree (optional)
     """
     nLM = 0
     nX = 0
@@ -133,6 +318,10 @@ def contract_edges_w_invalid_bipartitions(tree):
         elif node.is_leaf():
             node.edge_length = None
             nLM += 1
+        elif min_support is not None and \
+             get_support(node) is not None and \
+             get_support(node) < min_support:
+            node.edge_length = 0.0
         else:
             test = node.down.intersection(node.up)
             if len(test) != 0:
@@ -154,23 +343,34 @@ def contract_edges_w_invalid_bipartitions(tree):
     return [nLM, nEM, nR, nO]
 
 
-def prune_multiple_copies_of_species(tree):
+def prune_multiple_copies_of_species(tree, ranked=False):
     """
     Removes all but one leaf with the same species label
 
     Parameters
     ----------
     tree : treeswift tree object
+    ranked : boolean
+             keep the leaf with the lowest rank (i.e., the gene copy listed
+             first in the label map; see relabel_gene_copies()) instead of
+             the first leaf found
     """
     found = set([])
     found_duplicate = set([])
     nLMX = 0
     c = 0
 
+    if ranked:
+        keep = {}
+        for leaf in tree.traverse_leaves():
+            species = leaf.get_label()
+            if species not in keep or leaf.rank < keep[species].rank:
+                keep[species] = leaf
+
     for leaf in tree.traverse_leaves():
         species = leaf.get_label()
 
-        if species not in found:
+        if species not in found and (not ranked or keep[species] is leaf):
             found.add(species)
             nLMX += 1
         else:
@@ -184,23 +384,30 @@ def prune_multiple_copies_of_species(tree):
     return [nLMX, c]
 
 
-def preprocess_multree(tree):
+def preprocess_multree(tree, ranked=False, min_support=None, cache=None):
     """
     Preprocesses MUL-tree as described in the FastMulRFS paper
 
     Parameters
     ----------
     tree : treeswift tree object
+    ranked : boolean
+             see prune_multiple_copies_of_species()
+    min_support : float
+                  see contract_edges_w_invalid_bipartitions()
+    cache : SubtreeCache object
+            see build_down_profiles()
     """
     unroot(tree)
 
-    build_down_profiles(tree)
+    build_down_profiles(tree, cache)
 
     build_up_profiles(tree)
 
-    [nLM, nEM, nR, nO] = contract_edges_w_invalid_bipartitions(tree)
+    [nLM, nEM, nR, nO] = contract_edges_w_invalid_bipartitions(tree,
+                                                               min_support)
 
-    [nLMX, c] = prune_multiple_copies_of_species(tree)
+    [nLMX, c] = prune_multiple_copies_of_species(tree, ranked)
 
     nEMX = nO + nLMX
 
@@ -235,7 +442,733 @@ def compute_score_shift(nEM, nLM, nR, c, nEMX, nLMX):
     return nLMX + c + nEM - nEMX - (2 * nR) - nLM
 
 
-def read_preprocess_and_write_multrees(ifile, ofile, verbose):
+def preprocess_newick(temp, label_map=None, min_support=None, cache=None):
+    """
+    Preprocesses MUL-tree given as a newick string
+
+    Parameters
+    ----------
+    temp : string
+           newick string without whitespace
+    label_map : dictionary
+                output of read_gene_to_species_map(), if leaves are labeled
+                by gene copy (optional)
+    min_support : float
+                  see contract_edges_w_invalid_bipartitions()
+    cache : SubtreeCache object
+            see build_down_profiles()
+
+    Returns
+    -------
+    donot : int
+            0 if the tree should be written, 1 if the line is empty,
+            2 if the tree has <4 leaves before preprocessing, and
+            3 if the tree has <4 leaves after preprocessing
+    newick : string
+             preprocessed MUL-tree (None unless donot is 0)
+    counts : list
+             [nEM, nLM, nR, c, nEMX, nLMX] as returned by preprocess_multree()
+             (None if donot is 1 or 2)
+    """
+    if not temp:
+        return [1, None, None]
+
+    tree = treeswift.read_tree_newick(temp)
+
+    if label_map is not None:
+        relabel_gene_copies(tree, label_map)
+
+    if count_leaves(tree) < 4:
+        return [2, None, None]
+
+    counts = preprocess_multree(tree, label_map is not None, min_support,
+                                cache)
+    nLMX = counts[5]
+
+    if nLMX < 4:
+        return [3, None, counts]
+
+    return [0, tree.newick(), counts]
+
+
+STAGES = ["parse", "relabel_gene_copies", "unroot", "build_down_profiles",
+          "build_up_profiles", "contract_edges_w_invalid_bipartitions",
+          "prune_multiple_copies_of_species", "newick"]
+
+
+def profile_preprocess_newick(temp, memory=False, label_map=None,
+                              min_support=None, cache=None):
+    """
+    Same as preprocess_newick(), but records the wall time (and optionally
+    the peak memory allocated) of each stage
+
+    Parameters
+    ----------
+    temp : string
+           newick string without whitespace
+    memory : boolean
+             record peak memory with tracemalloc (must be tracing)
+    label_map, min_support, cache : see preprocess_newick()
+
+    Returns
+    -------
+    result : list
+             output of preprocess_newick()
+    times : dictionary
+            maps stage to wall time in seconds (stages that were not run
+            are missing)
+    peaks : dictionary
+            maps stage to peak memory in bytes above the memory in use
+            when the stage started (empty unless memory is True)
+    """
+    times = {}
+    peaks = {}
+
+    def run(stage, func, *args):
+        if memory:
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            else:
+                # Python < 3.9 can only reset the peak by restarting
+                tracemalloc.stop()
+                tracemalloc.start()
+            base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        value = func(*args)
+        times[stage] = time.perf_counter() - start
+        if memory:
+            peaks[stage] = tracemalloc.get_traced_memory()[1] - base
+        return value
+
+    if not temp:
+        return [[1, None, None], times, peaks]
+
+    tree = run("parse", treeswift.read_tree_newick, temp)
+
+    if label_map is not None:
+        run("relabel_gene_copies", relabel_gene_copies, tree, label_map)
+
+    if count_leaves(tree) < 4:
+        return [[2, None, None], times, peaks]
+
+    # Same steps as preprocess_multree()
+    run("unroot", unroot, tree)
+    run("build_down_profiles", build_down_profiles, tree, cache)
+    run("build_up_profiles", build_up_profiles, tree)
+    [nLM, nEM, nR, nO] = run("contract_edges_w_invalid_bipartitions",
+                             contract_edges_w_invalid_bipartitions, tree,
+                             min_support)
+    [nLMX, c] = run("prune_multiple_copies_of_species",
+                    prune_multiple_copies_of_species, tree,
+                    label_map is not None)
+    counts = [nEM, nLM, nR, c, nO + nLMX, nLMX]
+
+    if nLMX < 4:
+        return [[3, None, counts], times, peaks]
+
+    newick = run("newick", tree.newick)
+
+    return [[0, newick, counts], times, peaks]
+
+
+class Profiler:
+    """
+    Accumulates wall time (and optionally peak memory) of each stage of
+    preprocessing over gene trees, and writes per-tree rows to a CSV file;
+    only the given stages are reported (e.g., relabel_gene_copies only runs
+    with a label map)
+    """
+    def __init__(self, memory=False, pfile=None, stages=STAGES):
+        self.memory = memory
+        self.stages = stages
+        self.ntrees = 0
+        self.total = dict([(stage, 0.0) for stage in STAGES])
+        self.slowest = dict([(stage, 0.0) for stage in STAGES])
+        self.count = dict([(stage, 0) for stage in STAGES])
+        self.peak = dict([(stage, 0) for stage in STAGES])
+
+        self.csv = None
+        if pfile is not None:
+            self.csv = open(pfile, 'w')
+            header = ["line", "donot"] + [s + "_seconds" for s in stages]
+            if memory:
+                header += [s + "_peak_bytes" for s in stages]
+            self.csv.write(",".join(header) + '\n')
+
+        if memory:
+            tracemalloc.start()
+
+    def preprocess_newick(self, g, temp, label_map=None, min_support=None,
+                          cache=None):
+        """
+        Preprocesses MUL-tree on line g (see preprocess_newick())
+        """
+        [result, times, peaks] = profile_preprocess_newick(temp, self.memory,
+                                                           label_map,
+                                                           min_support,
+                                                           cache)
+
+        self.ntrees += 1
+        for [stage, seconds] in times.items():
+            self.total[stage] += seconds
+            self.count[stage] += 1
+            if seconds > self.slowest[stage]:
+                self.slowest[stage] = seconds
+        for [stage, nbytes] in peaks.items():
+            if nbytes > self.peak[stage]:
+                self.peak[stage] = nbytes
+
+        if self.csv is not None:
+            row = [str(g), str(result[0])]
+            row += ["%1.9f" % times[s] if s in times else ""
+                    for s in self.stages]
+            if self.memory:
+                row += [str(peaks[s]) if s in peaks else ""
+                        for s in self.stages]
+            self.csv.write(",".join(row) + '\n')
+
+        return result
+
+    def close(self):
+        if self.csv is not None:
+            self.csv.close()
+        if self.memory:
+            tracemalloc.stop()
+
+    def write_report(self):
+        """
+        Writes table with total, mean, and max wall time (and max peak
+        memory) of each stage
+        """
+        overall = sum(self.total.values())
+
+        sys.stdout.write("Profiled %d gene trees\n" % self.ntrees)
+        sys.stdout.write("%-40s %10s %7s %10s %10s"
+                         % ("stage", "total (s)", "%", "mean (ms)",
+                            "max (ms)"))
+        if self.memory:
+            sys.stdout.write(" %14s" % "peak mem (KB)")
+        sys.stdout.write('\n')
+
+        for stage in self.stages:
+            if self.count[stage]:
+                mean = self.total[stage] / self.count[stage]
+            else:
+                mean = 0.0
+            if overall > 0:
+                percent = 100.0 * self.total[stage] / overall
+            else:
+                percent = 0.0
+            sys.stdout.write("%-40s %10.3f %7.1f %10.3f %10.3f"
+                             % (stage, self.total[stage], percent,
+                                1000.0 * mean, 1000.0 * self.slowest[stage]))
+            if self.memory:
+                sys.stdout.write(" %14.1f" % (self.peak[stage] / 1024.0))
+            sys.stdout.write('\n')
+
+        sys.stdout.write("%-40s %10.3f\n" % ("total", overall))
+        sys.stdout.flush()
+
+
+def contract_low_support_edges(tree, min_support):
+    """
+    Contracts internal edges with support (internal node label) below
+    min_support, e.g., to score the MUL-tree that preprocessing with
+    min_support is equivalent to
+    """
+    nodes = [node for node in tree.traverse_postorder()
+             if not node.is_root() and not node.is_leaf() and
+             get_support(node) is not None and
+             get_support(node) < min_support]
+    for node in nodes:
+        node.contract()
+
+
+class Verifier:
+    """
+    Checks that the MulRF score of a gene family tree equals the MulRF score
+    of the preprocessed tree plus the score shift, for a random fraction of
+    the gene family trees, and records mismatches
+    """
+    def __init__(self, sfile, mulrf, fraction, seed=None, ffile=None):
+        self.stree = read_text(sfile)
+        self.mulrf = mulrf
+        self.fraction = fraction
+        self.seed = seed
+        self.ffile = ffile
+        self.ff = None
+        self.nchecked = 0
+        self.nfail = 0
+
+    def is_selected(self, g):
+        """
+        Decides whether to check the gene family tree on line g; with a
+        seed, the decision depends only on the seed and the line number, so
+        the same trees are checked with or without worker processes
+        """
+        if self.seed is None:
+            return random.SystemRandom().random() < self.fraction
+        rng = random.Random("%d:%d" % (self.seed, g))
+        return rng.random() < self.fraction
+
+    def check(self, g, temp, result, label_map=None, min_support=None):
+        """
+        Checks gene family tree on line g (can run in a worker process)
+
+        Parameters
+        ----------
+        g : int
+            line number of gene tree in input file
+        temp : string
+               newick string without whitespace
+        result : list
+                 output of preprocess_newick(temp, label_map, min_support)
+
+        Returns None if the tree was not checked, and otherwise
+        [g, mscore, mxscore, score_shift], where mscore and mxscore are None
+        if MulRF did not produce a score
+        """
+        [donot, newick, counts] = result
+        if donot or not self.is_selected(g):
+            return None
+
+        # Imported here, as check_mulrf_scores_v3.py imports this file
+        from check_mulrf_scores_v3 import remove_internal_node_labels
+        from check_mulrf_scores_v3 import score_with_MulRF
+
+        stree = treeswift.read_tree_newick(self.stree)
+        remove_internal_node_labels(stree)
+        stree.suppress_unifurcations()
+
+        mtree = treeswift.read_tree_newick(temp)
+        if label_map is not None:
+            relabel_gene_copies(mtree, label_map)
+        if min_support is not None:
+            contract_low_support_edges(mtree, min_support)
+        remove_internal_node_labels(mtree)
+        unroot(mtree)
+
+        mxtree = treeswift.read_tree_newick(newick)
+        remove_internal_node_labels(mxtree)
+
+        score_shift = compute_score_shift(*counts)
+
+        temp = os.path.join(tempfile.gettempdir(),
+                            "fastmulrfs-verify-%d-%d" % (os.getpid(), g))
+        try:
+            mscore = score_with_MulRF(self.mulrf, stree, mtree,
+                                      temp + "-scored")
+            mxscore = score_with_MulRF(self.mulrf, stree, mxtree,
+                                       temp + "-preprocessed-and-scored")
+        except (IOError, IndexError, ValueError):
+            mscore = None
+            mxscore = None
+
+        return [g, mscore, mxscore, score_shift]
+
+    def record(self, checked):
+        """
+        Records output of check(), writing a line if the scores do not match
+
+        Returns True if the scores match
+        """
+        [g, mscore, mxscore, score_shift] = checked
+        self.nchecked += 1
+        if mscore is not None and mxscore + score_shift == mscore:
+            return True
+
+        self.nfail += 1
+        if mscore is None:
+            msg = "Gene tree on line %d failed, as MulRF did not " \
+                  "produce a score!\n" % g
+        else:
+            msg = "Gene tree on line %d failed, as %d + %d != %d!\n" \
+                  % (g, mxscore, score_shift, mscore)
+        if self.ffile is None:
+            sys.stderr.write(msg)
+        else:
+            if self.ff is None:
+                self.ff = open_output(self.ffile)
+            self.ff.write(msg)
+            self.ff.flush()
+        return False
+
+    def close(self):
+        if self.ff is not None:
+            self.ff.close()
+        sys.stdout.write("Verified %d gene trees; %d failed\n"
+                         % (self.nchecked, self.nfail))
+        sys.stdout.flush()
+
+
+def write_preprocessed_multree(fo, g, result, verbose, dedup=None, fs=None):
+    """
+    Writes result of preprocess_newick() to output file
+
+    Parameters
+    ----------
+    fo : file object
+         output file
+    g : int
+        line number of gene tree in input file
+    result : list
+             output of preprocess_newick()
+    dedup : TopologyCounter object
+            if given, only the first tree with each topology is written
+            (as a canonical newick string)
+    fs : file object
+         if given, the score shift is written to this file (one line for
+         each preprocessed gene tree, even if dedup does not write it)
+    """
+    [donot, newick, counts] = result
+
+    if not donot:
+        if fs is not None:
+            fs.write("%d\n" % compute_score_shift(*counts))
+        if dedup is None:
+            fo.write(newick + '\n')
+        else:
+            newick = dedup.add(newick)
+            if newick is not None:
+                fo.write(newick + '\n')
+    elif verbose:
+        sys.stdout.write("...did not write tree as ")
+        if donot == 1:
+            sys.stdout.write("as line is empty!")
+        elif donot == 2:
+            sys.stdout.write("as tree has <4 leaves before "
+                             "preprocessing!")
+        elif donot == 3:
+            sys.stdout.write("as tree has <4 leaves after "
+                             "preprocessing!")
+        sys.stdout.write('\n')
+        sys.stdout.flush()
+
+
+def summarize_result(result):
+    """
+    Summarizes result of preprocess_newick()
+
+    Returns
+    -------
+    score_shift : int
+                  constant shift for the RF score (0 if the tree is not
+                  written)
+    ncontracted : int
+                  number of edges contracted as they induce invalid
+                  bipartitions
+    npruned : int
+              number of leaves pruned as they are extra copies of species
+    """
+    [donot, newick, counts] = result
+
+    score_shift = 0
+    ncontracted = 0
+    npruned = 0
+    if counts is not None:
+        [nEM, nLM, nR, c, nEMX, nLMX] = counts
+        # nEM = nLM + nX + nR + nO and nEMX = nO + nLMX
+        ncontracted = nEM - nLM - nR - (nEMX - nLMX)
+        npruned = nLM - nLMX
+        if not donot:
+            score_shift = compute_score_shift(*counts)
+
+    return [score_shift, ncontracted, npruned]
+
+
+def update_metrics(metrics, g, result):
+    """
+    Records result of preprocess_newick() in run metrics
+
+    Parameters
+    ----------
+    metrics : RunMetrics object
+    g : int
+        line number of gene tree in input file
+    result : list
+             output of preprocess_newick()
+    """
+    [score_shift, ncontracted, npruned] = summarize_result(result)
+    metrics.update(g, result[0], score_shift, ncontracted, npruned)
+
+
+def record_verification(verifier, metrics, checked):
+    """
+    Records output of Verifier.check() (if the tree was checked)
+    """
+    if checked is None:
+        return
+    passed = verifier.record(checked)
+    if metrics is not None:
+        metrics.update_verified(passed)
+
+
+def put_unless_stopped(q, item, stop):
+    """
+    Puts item on bounded queue, waiting for space until stop is set
+
+    Returns True if item was put on queue and False otherwise
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def read_lines(fi, in_q, start, size, nworkers, stop):
+    """
+    Reader stage of pipeline: puts blocks of lines on the input queue
+
+    Parameters
+    ----------
+    fi : file object
+         input file
+    in_q : multiprocessing queue
+           bounded queue of [line number of first line, lines]
+    start : int
+            number of lines to skip (when resuming)
+    size : int
+           number of lines per block
+    nworkers : int
+               number of preprocessing workers
+    stop : threading event
+           set by the writer if the pipeline is stopped early
+    """
+    g = 1
+    block = []
+    for line in fi:
+        if g > start:
+            if not block:
+                first = g
+            block.append(line)
+            if len(block) == size:
+                if not put_unless_stopped(in_q, [first, block], stop):
+                    return
+                block = []
+        g += 1
+    if block:
+        if not put_unless_stopped(in_q, [first, block], stop):
+            return
+
+    for w in range(nworkers):
+        if not put_unless_stopped(in_q, None, stop):
+            return
+
+
+def stop_pipeline(stop, workers, in_q, out_q):
+    """
+    Stops reader and workers of pipeline after an error, so that the process
+    can exit without waiting for items left on the queues
+    """
+    stop.set()
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.join()
+    in_q.cancel_join_thread()
+    out_q.cancel_join_thread()
+
+
+def preprocess_lines(in_q, out_q, label_map=None, min_support=None,
+                     verifier=None, memoize=None):
+    """
+    Preprocessing stage of pipeline (runs in a worker process)
+
+    Parameters
+    ----------
+    in_q : multiprocessing queue
+           bounded queue of [line number of first line, lines]
+    out_q : multiprocessing queue
+            bounded queue of [line number of first line, results, checks],
+            where checks has the output of Verifier.check() for each line
+    label_map, min_support : see preprocess_newick()
+    verifier : Verifier object
+               checks score shifts (optional)
+    memoize : int
+              if given, the worker keeps a SubtreeCache of this size
+    """
+    cache = None
+    if memoize is not None:
+        cache = SubtreeCache(memoize)
+
+    while True:
+        item = in_q.get()
+        if item is None:
+            break
+
+        [first, block] = item
+        results = []
+        checks = []
+        try:
+            for [i, line] in enumerate(block):
+                temp = "".join(line.split())
+                result = preprocess_newick(temp, label_map, min_support,
+                                           cache)
+                results.append(result)
+                if verifier is None:
+                    checks.append(None)
+                else:
+                    checks.append(verifier.check(first + i, temp, result,
+                                                 label_map, min_support))
+        except Exception as e:
+            out_q.put([first, "%s: %s" % (type(e).__name__, e), None])
+            break
+        out_q.put([first, results, checks])
+
+    out_q.put(None)
+
+
+def sample_queue_size(q, samples):
+    """
+    Records number of items on queue (if supported by the platform)
+    """
+    try:
+        samples.append(q.qsize())
+    except NotImplementedError:
+        pass
+
+
+def write_queue_report(name, samples, maxsize):
+    """
+    Writes mean and max occupancy of bounded queue
+    """
+    if samples:
+        mean = sum(samples) / float(len(samples))
+        sys.stdout.write("%s queue: mean occupancy %1.1f/%d (%1.0f%%), "
+                         "max %d/%d\n" % (name, mean, maxsize,
+                                          100.0 * mean / maxsize,
+                                          max(samples), maxsize))
+    else:
+        sys.stdout.write("%s queue: occupancy not available\n" % name)
+
+
+def pipeline_preprocess_and_write_multrees(fi, fo, verbose, nworkers, cfile,
+                                           every, start, ifile, metrics=None,
+                                           label_map=None, dedup=None,
+                                           min_support=None, verifier=None,
+                                           memoize=None, fs=None):
+    """
+    Preprocesses MUL-trees with a reader thread, a pool of preprocessing
+    worker processes, and a writer (the calling thread) connected by bounded
+    queues; trees are written in the same order as the sequential version
+
+    A full input queue means the workers are the bottleneck, a full output
+    queue means the writer is the bottleneck, and two (nearly) empty queues
+    mean the reader is the bottleneck.
+
+    Parameters
+    ----------
+    fi : file object
+         input file
+    fo : file object
+         output file
+    nworkers : int
+               number of preprocessing workers
+    metrics : RunMetrics object
+              records progress (optional)
+    label_map, min_support : see preprocess_newick()
+    dedup : TopologyCounter object
+            see write_preprocessed_multree()
+    verifier : Verifier object
+               checks score shifts in the workers (optional)
+    memoize : int
+              size of the SubtreeCache of each worker (optional)
+    fs : file object
+         output file for score shifts (optional)
+    """
+    size = 64
+    maxsize = 2 * nworkers
+
+    in_q = multiprocessing.Queue(maxsize)
+    out_q = multiprocessing.Queue(maxsize)
+
+    workers = [multiprocessing.Process(target=preprocess_lines,
+                                       args=(in_q, out_q, label_map,
+                                             min_support, verifier,
+                                             memoize),
+                                       daemon=True)
+               for w in range(nworkers)]
+    for worker in workers:
+        worker.start()
+
+    stop = threading.Event()
+    reader = threading.Thread(target=read_lines,
+                              args=(fi, in_q, start, size, nworkers, stop),
+                              daemon=True)
+    reader.start()
+
+    in_samples = []
+    out_samples = []
+    pending = {}
+    g = start + 1
+    ndone = 0
+
+    while ndone < nworkers:
+        sample_queue_size(in_q, in_samples)
+        sample_queue_size(out_q, out_samples)
+
+        # A worker that was killed (e.g., out of memory) never puts its
+        # result on the queue, so the writer would wait for it forever
+        for worker in workers:
+            if worker.exitcode is not None and worker.exitcode != 0:
+                stop_pipeline(stop, workers, in_q, out_q)
+                sys.exit("Error: Preprocessing worker %d exited with code "
+                         "%d!\n" % (worker.pid, worker.exitcode))
+
+        try:
+            item = out_q.get(timeout=1)
+        except queue.Empty:
+            continue
+
+        if item is None:
+            ndone += 1
+            continue
+
+        [first, results, checks] = item
+        if isinstance(results, str):
+            stop_pipeline(stop, workers, in_q, out_q)
+            sys.exit("Error: Failed to preprocess gene tree in lines %d-%d "
+                     "(%s)!\n" % (first, first + size - 1, results))
+        pending[first] = [results, checks]
+
+        while g in pending:
+            [results, checks] = pending.pop(g)
+            for [result, checked] in zip(results, checks):
+                if verbose:
+                    sys.stdout.write("Preprocessing gene tree on line %d...\n"
+                                     % g)
+                write_preprocessed_multree(fo, g, result, verbose, dedup, fs)
+                if metrics is not None:
+                    update_metrics(metrics, g, result)
+                if verifier is not None:
+                    record_verification(verifier, metrics, checked)
+
+                if cfile is not None and g % every == 0:
+                    fo.flush()
+                    write_checkpoint(cfile, ifile, {"line": g,
+                                                    "offset": fo.tell()})
+                g += 1
+
+    reader.join()
+    for worker in workers:
+        worker.join()
+
+    write_queue_report("Input (reader -> workers)", in_samples, maxsize)
+    write_queue_report("Output (workers -> writer)", out_samples, maxsize)
+    sys.stdout.flush()
+
+    return g
+
+
+def read_preprocess_and_write_multrees(ifile, ofile, verbose, cfile=None,
+                                       every=1000, resume=False, nworkers=0,
+                                       profiler=None, metrics=None,
+                                       mfile=None, dedup=None,
+                                       min_support=None, verifier=None,
+                                       cache=None, memoize=None, sfile=None):
     """
     Creates file with preprocessed MUL-trees for FastRFS
 
@@ -246,65 +1179,442 @@ def read_preprocess_and_write_multrees(ifile, ofile, verbose):
             (one newick string per line)
     ofile : string
             name of output file (one newick string per line)
+    cfile : string
+            name of checkpoint file (optional)
+    every : int
+            number of lines between checkpoints
+    resume : boolean
+             resume from checkpoint file (if it exists)
+    nworkers : int
+               number of preprocessing workers; if greater than 0, reading,
+               preprocessing, and writing are run as a pipeline
+    profiler : Profiler object
+               records wall time of each stage (optional; only used when
+               nworkers is 0)
+    metrics : RunMetrics object
+              records progress (optional)
+    mfile : string
+            name of file containing label map, if leaves are labeled by gene
+            copy (optional); each row has form:
+            species_name:gene_name_1,gene_name_2,...
+    dedup : TopologyCounter object
+            if given, only the first tree with each topology is written
+            (optional; cannot be used with checkpoints)
+    min_support : float
+                  contract internal edges with lower support (optional; see
+                  contract_edges_w_invalid_bipartitions())
+    verifier : Verifier object
+               checks score shifts for a random fraction of the gene family
+               trees as they are written (optional)
+    cache : SubtreeCache object
+            shares down profiles of identical subtrees across gene family
+            trees (optional; only used when nworkers is 0)
+    memoize : int
+              size of the SubtreeCache of each worker (optional; only used
+              when nworkers is greater than 0)
+    sfile : string
+            name of output file for the score shift of each preprocessed
+            gene family tree (optional; cannot be used with checkpoints)
     """
-    with open(ifile, 'r') as fi, open(ofile, 'w') as fo:
-        g = 1
+    label_map = None
+    if mfile is not None:
+        label_map = read_gene_to_species_map(mfile)
+
+    start = 0
+    offset = 0
+    if resume:
+        state = read_checkpoint(cfile, ifile)
+        if state is not None:
+            start = state["line"]
+            offset = state["offset"]
+            if verbose:
+                sys.stdout.write("Resuming after gene tree on line %d...\n"
+                                 % start)
+                sys.stdout.flush()
 
-        for line in fi.readlines():
+    if start:
+        fo = open_for_resume(ofile, offset)
+    else:
+        fo = open_output(ofile)
+
+    fs = None
+    if sfile is not None:
+        fs = open_output(sfile)
+
+    with open_input(ifile) as fi, fo:
+        if nworkers > 0:
+            g = pipeline_preprocess_and_write_multrees(fi, fo, verbose,
+                                                       nworkers, cfile,
+                                                       every, start, ifile,
+                                                       metrics, label_map,
+                                                       dedup, min_support,
+                                                       verifier, memoize, fs)
+        else:
+            g = 1
+            for line in fi:
+                if g > start:
+                    if verbose:
+                        sys.stdout.write("Preprocessing gene tree on line "
+                                         "%d...\n" % g)
+                        sys.stdout.flush()
+
+                    temp = "".join(line.split())
+                    if profiler is None:
+                        result = preprocess_newick(temp, label_map,
+                                                   min_support, cache)
+                    else:
+                        result = profiler.preprocess_newick(g, temp,
+                                                            label_map,
+                                                            min_support,
+                                                            cache)
+                    write_preprocessed_multree(fo, g, result, verbose,
+                                               dedup, fs)
+                    if metrics is not None:
+                        update_metrics(metrics, g, result)
+                    if verifier is not None:
+                        checked = verifier.check(g, temp, result, label_map,
+                                                 min_support)
+                        record_verification(verifier, metrics, checked)
+
+                    if cfile is not None and g % every == 0:
+                        fo.flush()
+                        write_checkpoint(cfile, ifile, {"line": g,
+                                                        "offset": fo.tell()})
+                g += 1
+
+        if cfile is not None:
+            fo.flush()
+            write_checkpoint(cfile, ifile, {"line": g - 1,
+                                            "offset": fo.tell()})
+
+    if fs is not None:
+        fs.close()
+
+
+def sample_preprocess_and_write_multrees(ifile, ofile, verbose, k, seed=None,
+                                         profiler=None, metrics=None,
+                                         mfile=None, dedup=None,
+                                         min_support=None, verifier=None,
+                                         cache=None, sfile=None):
+    """
+    Preprocesses K gene family trees sampled uniformly at random (in one pass
+    over the input file), writes them in the order of the input, and
+    estimates totals over all gene family trees from the sample
+
+    Parameters
+    ----------
+    k : int
+        number of gene family trees to sample
+    seed : int
+           seed for random number generator (optional)
+
+    See read_preprocess_and_write_multrees() for the other parameters
+
+    Returns
+    -------
+    rows : list
+           [name, values] pairs for write_estimates()
+    n : int
+        number of lines in input file
+    """
+    label_map = None
+    if mfile is not None:
+        label_map = read_gene_to_species_map(mfile)
+
+    with open_input(ifile) as fi:
+        [sample, n] = reservoir_sample(fi, k, seed)
+
+    written = []
+    shifts = []
+    contracted = []
+    pruned = []
+    duplicated = []
+    fs = None
+    if sfile is not None:
+        fs = open_output(sfile)
+
+    with open_output(ofile) as fo:
+        for [g, line] in sample:
             if verbose:
                 sys.stdout.write("Preprocessing gene tree on line %d...\n" % g)
                 sys.stdout.flush()
 
             temp = "".join(line.split())
-
-            donot = 0
-            if not temp:
-                donot = 1
+            if profiler is None:
+                result = preprocess_newick(temp, label_map, min_support,
+                                           cache)
             else:
-                tree = treeswift.read_tree_newick(temp)
-
-                if count_leaves(tree) < 4:
-                    dotnot = 2
-                else:
-                    [nEM, nLM, nR, c, nEMX, nLMX] = preprocess_multree(tree)
-                    score_shift = compute_score_shift(nEM, nLM, nR, c, nEMX,
-                                                      nLMX)
-
-                    if nLMX < 4:
-                        donot = 3
-                    else:
-                        fo.write(tree.newick() + '\n')
+                result = profiler.preprocess_newick(g, temp, label_map,
+                                                    min_support, cache)
+            write_preprocessed_multree(fo, g, result, verbose, dedup, fs)
+            if metrics is not None:
+                update_metrics(metrics, g, result)
+            if verifier is not None:
+                checked = verifier.check(g, temp, result, label_map,
+                                         min_support)
+                record_verification(verifier, metrics, checked)
+
+            [score_shift, ncontracted, npruned] = summarize_result(result)
+            [donot, newick, counts] = result
+            written.append(int(not donot))
+            shifts.append(score_shift)
+            contracted.append(ncontracted)
+            pruned.append(npruned)
+            if counts is None:
+                duplicated.append(0)
+            else:
+                duplicated.append(counts[3])
 
-                if donot and verbose:
-                    sys.stdout.write("...did not write tree as ")
-                    if donot == 1:
-                        sys.stdout.write("as line is empty!")
-                    elif donot == 2:
-                        sys.stdout.write("as tree has <4 leaves before "
-                                         "preprocessing!")
-                    elif donot == 3:
-                        sys.stdout.write("as tree has <4 leaves after "
-                                         "preprocessing!")
-                    sys.stdout.write('\n')
-                    sys.stdout.flush()
+    if fs is not None:
+        fs.close()
 
-            g += 1
+    rows = [["trees written", written],
+            ["score shift", shifts],
+            ["edges contracted", contracted],
+            ["leaves pruned", pruned],
+            ["species with multiple copies", duplicated]]
+    return [rows, n]
 
 
 def main(args):
-    read_preprocess_and_write_multrees(args.input, args.output, args.verbose)
-
-
-if __name__ == '__main__':
+    if args.resume and args.checkpoint is None:
+        sys.exit("Error: --resume requires a checkpoint file (-c)!\n")
+
+    if args.checkpoint is not None and \
+       get_codec(args.output, 'w') is not None:
+        sys.exit("Error: Cannot checkpoint a compressed output file!\n")
+
+    if args.sample is not None:
+        if args.checkpoint is not None:
+            sys.exit("Error: Cannot checkpoint with --sample!\n")
+        if args.workers > 0:
+            sys.exit("Error: Cannot sample with worker processes (-w)!\n")
+        if args.sample < 2:
+            sys.exit("Error: --sample must be at least 2!\n")
+
+    if args.score_shifts is not None and args.checkpoint is not None:
+        sys.exit("Error: Cannot checkpoint with --score-shifts!\n")
+
+    dedup = None
+    if args.dedup is not None:
+        if args.checkpoint is not None:
+            sys.exit("Error: Cannot checkpoint with --dedup!\n")
+        dedup = TopologyCounter()
+
+    profiler = None
+    if args.profile or args.profile_memory or args.profile_csv is not None:
+        if args.workers > 0:
+            sys.exit("Error: Cannot profile with worker processes (-w)!\n")
+        stages = STAGES
+        if args.map is None:
+            stages = [s for s in STAGES if s != "relabel_gene_copies"]
+        profiler = Profiler(memory=args.profile_memory,
+                            pfile=args.profile_csv, stages=stages)
+
+    verifier = None
+    if args.verify_stree is not None:
+        if args.mulrf is None:
+            sys.exit("Error: --verify-stree requires MulRFScorer (-x)!\n")
+        if not os.path.exists(args.mulrf):
+            sys.exit("Error: %s does not exist!\n" % args.mulrf)
+        verifier = Verifier(args.verify_stree, args.mulrf,
+                            args.verify_fraction, seed=args.seed,
+                            ffile=args.verify_log)
+
+    cache = None
+    if args.memoize is not None:
+        if args.memoize < 1:
+            sys.exit("Error: --memoize must be at least 1!\n")
+        if args.workers == 0:
+            cache = SubtreeCache(args.memoize)
+
+    metrics = None
+    if args.metrics is not None or args.progress is not None:
+        metrics = RunMetrics(args.input, mfile=args.metrics,
+                             metrics_every=args.metrics_every,
+                             progress_every=args.progress)
+
+    done = False
+    rows = None
+    try:
+        if args.sample is not None:
+            [rows, n] = sample_preprocess_and_write_multrees(
+                            args.input, args.output, args.verbose,
+                            args.sample, seed=args.seed,
+                            profiler=profiler,
+                            metrics=metrics,
+                            mfile=args.map,
+                            dedup=dedup,
+                            min_support=args.min_support,
+                            verifier=verifier,
+                            cache=cache,
+                            sfile=args.score_shifts)
+        else:
+            read_preprocess_and_write_multrees(args.input, args.output,
+                                               args.verbose,
+                                               cfile=args.checkpoint,
+                                               every=args.checkpoint_every,
+                                               resume=args.resume,
+                                               nworkers=args.workers,
+                                               profiler=profiler,
+                                               metrics=metrics,
+                                               mfile=args.map,
+                                               dedup=dedup,
+                                               min_support=args.min_support,
+                                               verifier=verifier,
+                                               cache=cache,
+                                               memoize=args.memoize,
+                                               sfile=args.score_shifts)
+        done = True
+    finally:
+        if metrics is not None:
+            metrics.close(done)
+
+    if rows is not None:
+        write_estimates(rows, args.sample, n)
+
+    if dedup is not None:
+        with open_output(args.dedup) as f:
+            for count in dedup.counts:
+                f.write("%d\n" % count)
+        sys.stdout.write("Wrote %d distinct topologies for %d gene trees "
+                         "(compression ratio %1.2f)\n"
+                         % (len(dedup.counts), dedup.ntrees,
+                            dedup.get_ratio()))
+        sys.stdout.flush()
+
+    if profiler is not None:
+        profiler.close()
+        profiler.write_report()
+
+    if cache is not None:
+        cache.write_report()
+
+    if verifier is not None:
+        verifier.close()
+        if verifier.nfail:
+            sys.exit("Error: %d gene trees failed verification!\n"
+                     % verifier.nfail)
+
+
+def get_parser():
     parser = argparse.ArgumentParser()
 
     parser.add_argument("-i", "--input", type=str,
                         help="Input file containing gene family trees "
                              "(one newick string per line)",
                         required=True)
+    parser.add_argument("-a", "--map", type=str,
+                        help="Input file containing label map, if leaves "
+                             "are labeled by gene copy; each row has form: "
+                             "'species_name:gene_name_1,gene_name_2,...' and "
+                             "the first gene copy listed is kept",
+                        required=False)
     parser.add_argument("-o", "--output", type=str,
-                        help="Output file name",
+                        help="Output file name; output is compressed if "
+                             "name ends with .gz, .bz2, or .xz",
                         required=True)
+    parser.add_argument("-c", "--checkpoint", type=str,
+                        help="Checkpoint file recording the last line "
+                             "committed to the output file",
+                        required=False)
+    parser.add_argument("--checkpoint-every", type=int, default=1000,
+                        help="Number of lines between checkpoints "
+                             "(default: 1000)",
+                        required=False)
+    parser.add_argument("--resume", action="store_true",
+                        help="Resume from checkpoint file (if it exists)")
+    parser.add_argument("-w", "--workers", type=int, default=0,
+                        help="Number of preprocessing worker processes; "
+                             "if greater than 0, reading, preprocessing, and "
+                             "writing run as a pipeline (default: 0)",
+                        required=False)
+    parser.add_argument("--min-support", type=float,
+                        help="Contract internal edges whose support (read "
+                             "from internal node labels) is below this value "
+                             "before finding invalid bipartitions; edges "
+                             "without support values are kept",
+                        required=False)
+    parser.add_argument("--score-shifts", type=str,
+                        help="Output file with the score shift of each "
+                             "preprocessed gene tree (one per line), e.g., "
+                             "for refine_species_tree.py; the MulRF score "
+                             "of a species tree is the sum of its RF "
+                             "distances to the preprocessed gene trees and "
+                             "the score shifts",
+                        required=False)
+    parser.add_argument("--memoize", type=int,
+                        help="Share the down profiles of identical rooted "
+                             "subtrees across gene trees, keeping profiles "
+                             "with at most this many species labels in "
+                             "total (least recently used subtrees are "
+                             "evicted first; with -w, each worker keeps its "
+                             "own subtrees)",
+                        required=False)
+    parser.add_argument("--dedup", type=str,
+                        help="Write each distinct topology once (as a "
+                             "canonical newick string) and write the number "
+                             "of gene trees with each topology to this file "
+                             "(one count per line, in the same order); only "
+                             "for tools that can weight trees by the counts, "
+                             "as FastRFS needs the repeated trees",
+                        required=False)
+    parser.add_argument("--sample", type=int,
+                        help="Preprocess only this many gene trees, sampled "
+                             "uniformly at random in one pass, and print "
+                             "totals estimated from the sample with 95%% "
+                             "confidence intervals",
+                        required=False)
+    parser.add_argument("--verify-stree", type=str,
+                        help="Input file containing species tree; if given, "
+                             "check that the MulRF score of a gene tree "
+                             "equals the MulRF score of the preprocessed "
+                             "tree plus the score shift for a random "
+                             "fraction of the gene trees as they are written",
+                        required=False)
+    parser.add_argument("--verify-fraction", type=float, default=0.01,
+                        help="Fraction of gene trees to check with "
+                             "--verify-stree (default: 0.01)",
+                        required=False)
+    parser.add_argument("-x", "--mulrf", type=str,
+                        help="MulRFScorer binary including full path "
+                             "(for --verify-stree)",
+                        required=False)
+    parser.add_argument("--verify-log", type=str,
+                        help="Output file recording the line number and "
+                             "scores of each gene tree that fails "
+                             "verification (default: standard error)",
+                        required=False)
+    parser.add_argument("--seed", type=int,
+                        help="Seed for --sample and --verify-fraction "
+                             "(optional)",
+                        required=False)
+    parser.add_argument("--progress", type=float,
+                        help="Write number of gene trees preprocessed at "
+                             "most every this many seconds",
+                        required=False)
+    parser.add_argument("-m", "--metrics", type=str,
+                        help="Output file with run metrics in the Prometheus "
+                             "text format (e.g., for the textfile collector "
+                             "of node-exporter); name should end with .prom",
+                        required=False)
+    parser.add_argument("--metrics-every", type=float, default=15.0,
+                        help="Seconds between updates of the metrics file "
+                             "(default: 15)",
+                        required=False)
+    parser.add_argument("--profile", action="store_true",
+                        help="Print wall time of each preprocessing stage")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="Also print peak memory of each stage (traced "
+                             "with tracemalloc, which slows down the run)")
+    parser.add_argument("--profile-csv", type=str,
+                        help="Output CSV file with wall time (and peak "
+                             "memory) of each stage for each gene tree",
+                        required=False)
     parser.add_argument("--verbose", action="store_true")
 
-    main(parser.parse_args())
+    return parser
+
+
+if __name__ == '__main__':
+    main(get_parser().parse_args())
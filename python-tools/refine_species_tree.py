@@ -0,0 +1,389 @@
+"""
+This file is used to refine a species tree (e.g., estimated by FastMulRFS)
+by hill climbing with nearest neighbor interchanges (NNIs): a move is taken
+if it lowers the total RF distance between the species tree and the
+preprocessed gene trees (i.e., the MulRF score, as the score shifts do not
+depend on the species tree), until no NNI lowers it.
+
+An NNI changes one bipartition of the species tree, so each move is scored
+by looking up the old and new bipartitions (restricted to the species in
+each group of gene trees with the same species) in an index of gene tree
+bipartition frequencies, without going over the gene trees. Only groups with
+species in all four subtrees around the edge of the move are looked at, as
+the move does not change the score of the other groups.
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import argparse
+from fastmulrfs.tree_file_io import open_input
+from fastmulrfs.tree_file_io import open_output
+from fastmulrfs.tree_file_io import read_text
+from fastmulrfs.tree_topology import count_internal_edges
+from fastmulrfs.tree_topology import get_splits
+from fastmulrfs.tree_topology import newick_topology
+from fastmulrfs.tree_topology import parse_newick
+from fastmulrfs.tree_topology import restrict_split
+import sys
+
+
+def build_split_index(gfile, index):
+    """
+    Counts bipartitions of preprocessed gene trees, grouping gene trees by
+    their species
+
+    Parameters
+    ----------
+    gfile : string
+            name of file containing preprocessed gene trees (one newick
+            string per line)
+    index : dictionary
+            maps species label to bit (see get_splits())
+
+    Returns
+    -------
+    groups : dictionary
+             maps bitmask of species to [number of gene trees, dictionary
+             mapping side of bipartition (see get_splits()) to number of
+             gene trees]
+    nedges : int
+             total number of internal edges in gene trees
+    """
+    nspecies = len(index)
+    groups = {}
+    nedges = 0
+
+    with open_input(gfile) as f:
+        for g, line in enumerate(f, 1):
+            temp = "".join(line.split())
+            if not temp:
+                continue
+
+            [labels, adj] = parse_newick(temp)
+            [leafset, splits] = get_splits(labels, adj, index)
+            if len(index) > nspecies:
+                sys.exit("Error: Gene tree on line %d has species that are "
+                         "not in the species tree!\n" % g)
+
+            group = groups.get(leafset)
+            if group is None:
+                group = [0, {}]
+                groups[leafset] = group
+            group[0] += 1
+            for side in splits:
+                group[1][side] = group[1].get(side, 0) + 1
+            nedges += count_internal_edges(labels, adj)
+
+    return [groups, nedges]
+
+
+class SpeciesTree:
+    """
+    Unrooted binary species tree with the bipartition of each internal edge
+    and, for each group of gene trees, the set of bipartitions of the
+    species tree restricted to the species in the group
+
+    Groups are indexed by bit, and each side of each edge keeps the bitmask
+    of groups with species on that side (an inverted index from edges to
+    groups), so the groups whose score an NNI can change are found without
+    going over all groups.
+    """
+    def __init__(self, labels, adj, index, groups):
+        self.labels = labels
+        self.adj = adj
+        self.groups = groups
+        self.leafsets = list(groups.keys())
+
+        for v in range(len(labels)):
+            if labels[v] is None and len(adj[v]) != 3:
+                sys.exit("Error: Species tree must be binary!\n")
+
+        self.species = 0
+        for label in labels:
+            if label is not None:
+                self.species |= 1 << index[label]
+
+        # Bitmask of groups with each species
+        found = {}
+        for [i, leafset] in enumerate(self.leafsets):
+            for label in index:
+                if leafset & (1 << index[label]):
+                    found[label] = found.get(label, 0) | (1 << i)
+
+        # Bitmask of species (and of groups with species) on the side of
+        # edge (u, v) that contains v
+        self.side = {}
+        self.touch = {}
+        start = [v for v in range(len(labels)) if labels[v] is not None][0]
+        order = []
+        stack = [[adj[start][0], start]]
+        while stack:
+            [node, above] = stack.pop()
+            order.append([node, above])
+            for u in adj[node]:
+                if u != above:
+                    stack.append([u, node])
+        for [node, above] in reversed(order):
+            if labels[node] is not None:
+                mask = 1 << index[labels[node]]
+                gmask = found.get(labels[node], 0)
+            else:
+                mask = 0
+                gmask = 0
+                for u in adj[node]:
+                    if u != above:
+                        mask |= self.side[(node, u)]
+                        gmask |= self.touch[(node, u)]
+            self.side[(above, node)] = mask
+            self.side[(node, above)] = self.species ^ mask
+            self.touch[(above, node)] = gmask
+        for [node, above] in order:
+            if labels[above] is not None:
+                gmask = found.get(labels[above], 0)
+            else:
+                gmask = 0
+                for u in adj[above]:
+                    if u != node:
+                        gmask |= self.touch[(above, u)]
+            self.touch[(node, above)] = gmask
+
+        self.splits = dict([(leafset, set([])) for leafset in groups])
+        for [u, v] in self.get_internal_edges():
+            for leafset in groups:
+                r = restrict_split(self.side[(u, v)], leafset)
+                if r is not None:
+                    self.splits[leafset].add(r)
+
+    def get_internal_edges(self):
+        """
+        Returns list of [u, v] for each internal edge, with u < v
+        """
+        return [[u, v] for u in range(len(self.labels))
+                if self.labels[u] is None
+                for v in self.adj[u]
+                if self.labels[v] is None and u < v]
+
+    def get_affected_groups(self, u, v):
+        """
+        Returns list of leaf sets of the groups with species in all four
+        subtrees around internal edge (u, v)
+
+        If a group has no species in one of the subtrees, say b, then
+        after restricting the species tree to the group, u has two
+        neighbors; an NNI across (u, v) then replaces one restricted
+        bipartition with another that both stay induced by other edges
+        (e.g., by the edges to a and to d), so the score of the group does
+        not change. Otherwise, u and v both have three neighbors after
+        restricting the species tree to the group, so (u, v) is the only
+        edge that induces its restricted bipartition, before and after
+        the NNI.
+        """
+        masks = [self.touch[(u, x)] for x in self.adj[u] if x != v] + \
+                [self.touch[(v, x)] for x in self.adj[v] if x != u]
+        gmask = masks[0] & masks[1] & masks[2] & masks[3]
+
+        leafsets = []
+        while gmask:
+            low = gmask & -gmask
+            leafsets.append(self.leafsets[low.bit_length() - 1])
+            gmask ^= low
+        return leafsets
+
+    def get_score(self, nedges):
+        """
+        Computes total RF distance to the gene trees
+
+        Parameters
+        ----------
+        nedges : int
+                 total number of internal edges in gene trees (see
+                 build_split_index())
+        """
+        score = nedges
+        for [leafset, [ntrees, freq]] in self.groups.items():
+            for r in self.splits[leafset]:
+                score += ntrees - 2 * freq.get(r, 0)
+        return score
+
+    def get_nni(self, u, v, b, c):
+        """
+        Returns change in total RF distance if subtree b (a neighbor of u)
+        is swapped with subtree c (a neighbor of v)
+        """
+        # Before the swap, the side of (u, v) with u has b; after the swap,
+        # it has c instead
+        old = self.side[(v, u)]
+        new = old ^ self.side[(u, b)] ^ self.side[(v, c)]
+
+        delta = 0
+        for leafset in self.get_affected_groups(u, v):
+            freq = self.groups[leafset][1]
+            r_old = restrict_split(old, leafset)
+            r_new = restrict_split(new, leafset)
+            delta += 2 * (freq.get(r_old, 0) - freq.get(r_new, 0))
+        return delta
+
+    def do_nni(self, u, v, b, c):
+        """
+        Swaps subtree b (a neighbor of u) with subtree c (a neighbor of v)
+        """
+        old = self.side[(v, u)]
+        new = old ^ self.side[(u, b)] ^ self.side[(v, c)]
+
+        # The groups with species in all four subtrees are the same after
+        # the swap
+        for leafset in self.get_affected_groups(u, v):
+            splits = self.splits[leafset]
+            splits.remove(restrict_split(old, leafset))
+            splits.add(restrict_split(new, leafset))
+
+        adj = self.adj
+        adj[u][adj[u].index(b)] = c
+        adj[v][adj[v].index(c)] = b
+        adj[b][adj[b].index(u)] = v
+        adj[c][adj[c].index(v)] = u
+
+        # Only the sides of (u, v) change; the other sides are moved to
+        # their new edges
+        for d in [self.side, self.touch]:
+            d[(u, c)] = d.pop((v, c))
+            d[(c, u)] = d.pop((c, v))
+            d[(v, b)] = d.pop((u, b))
+            d[(b, v)] = d.pop((b, u))
+        self.side[(v, u)] = new
+        self.side[(u, v)] = self.species ^ new
+        for [x, y] in [[u, v], [v, u]]:
+            gmask = 0
+            for w in adj[x]:
+                if w != y:
+                    gmask |= self.touch[(x, w)]
+            self.touch[(y, x)] = gmask
+
+
+def refine_species_tree(stree, groups, nedges, max_moves=None, verbose=False):
+    """
+    Refines species tree by NNI hill climbing (first improvement): internal
+    edges are visited in turn, and a move is taken as soon as it lowers the
+    score, until a full pass over the edges finds no such move
+
+    Parameters
+    ----------
+    stree : SpeciesTree object
+    groups : dictionary
+             output of build_split_index()
+    nedges : int
+             output of build_split_index()
+    max_moves : int
+                stop after this many moves (optional)
+
+    Returns
+    -------
+    score : int
+            total RF distance of refined species tree
+    nmoves : int
+            number of moves taken
+    """
+    score = stree.get_score(nedges)
+    nmoves = 0
+
+    improved = True
+    while improved and (max_moves is None or nmoves < max_moves):
+        improved = False
+        for [u, v] in stree.get_internal_edges():
+            # The edge may have changed in an earlier move of this pass
+            if v not in stree.adj[u]:
+                continue
+            b = [x for x in stree.adj[u] if x != v][1]
+            for c in [x for x in stree.adj[v] if x != u]:
+                delta = stree.get_nni(u, v, b, c)
+                if delta < 0:
+                    stree.do_nni(u, v, b, c)
+                    score += delta
+                    nmoves += 1
+                    improved = True
+                    if verbose:
+                        sys.stdout.write("Move %d lowers score by %d to %d\n"
+                                         % (nmoves, -delta, score))
+                        sys.stdout.flush()
+                    break
+            if max_moves is not None and nmoves >= max_moves:
+                break
+
+    return [score, nmoves]
+
+
+def read_score_shifts(sfile):
+    """
+    Returns sum of score shifts in file (output of preprocess_multrees_v3.py
+    with --score-shifts)
+    """
+    total = 0
+    with open_input(sfile) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                total += int(line)
+    return total
+
+
+def main(args):
+    [labels, adj] = parse_newick("".join(read_text(args.stree).split()))
+    index = {}
+    for label in labels:
+        if label is not None:
+            index[label] = len(index)
+
+    [groups, nedges] = build_split_index(args.gtrees, index)
+    if not groups:
+        sys.exit("Error: No trees in %s!\n" % args.gtrees)
+
+    stree = SpeciesTree(labels, adj, index, groups)
+    before = stree.get_score(nedges)
+
+    [after, nmoves] = refine_species_tree(stree, groups, nedges,
+                                          max_moves=args.max_moves,
+                                          verbose=args.verbose)
+
+    with open_output(args.output) as f:
+        f.write(newick_topology(stree.labels, stree.adj) + '\n')
+
+    shift = 0
+    name = "RF score"
+    if args.score_shifts is not None:
+        shift = read_score_shifts(args.score_shifts)
+        name = "MulRF score"
+
+    sys.stdout.write("%s: %d before, %d after %d NNI moves\n"
+                     % (name, before + shift, after + shift, nmoves))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-s", "--stree", type=str,
+                        help="Input file containing species tree (e.g., "
+                             "estimated by FastMulRFS)",
+                        required=True)
+    parser.add_argument("-g", "--gtrees", type=str,
+                        help="Input file containing preprocessed gene trees "
+                             "(output of preprocess_multrees_v3.py)",
+                        required=True)
+    parser.add_argument("-f", "--score-shifts", type=str,
+                        help="Input file containing score shifts (output of "
+                             "preprocess_multrees_v3.py with --score-shifts); "
+                             "if given, MulRF scores are reported instead "
+                             "of RF scores",
+                        required=False)
+    parser.add_argument("-o", "--output", type=str,
+                        help="Output file for refined species tree",
+                        required=True)
+    parser.add_argument("--max-moves", type=int,
+                        help="Stop after this many moves (optional)",
+                        required=False)
+    parser.add_argument("--verbose", action="store_true")
+
+    main(parser.parse_args())
@@ -1,8 +1,89 @@
 import argparse
+from fastmulrfs.tree_file_io import open_input
+from fastmulrfs.tree_file_io import open_output
+from fastmulrfs.tree_file_io import split_compression_ext
+import multiprocessing
+import re
 import treeswift
 
 
-def relabel_multrees_simphy(ifil, ofil):
+BRANCH_LENGTH = re.compile(r":[^(),;]*")
+INTERNAL_LABEL = re.compile(r"\)[^(),;]+")
+LEAF_LABEL_SUFFIX = re.compile(r"_[^(),;]*")
+
+
+def relabel_newick_simphy_treeswift(temp):
+    """
+    Relabels tree given as a newick string by building a treeswift tree;
+    see relabel_multrees_simphy()
+
+    Parameters
+    ----------
+    temp : string
+           newick string without whitespace
+
+    Returns newick string
+    """
+    tree = treeswift.read_tree(temp, "newick")
+
+    for node in tree.traverse_postorder():
+        if node.is_leaf():
+            node.label = node.label.split('_')[0]
+        else:
+            node.label = None
+        node.edge_length = None
+
+    return tree.newick()
+
+
+def relabel_newick_simphy(temp):
+    """
+    Relabels tree given as a newick string by rewriting the string, without
+    building a tree; the output is the same as for
+    relabel_newick_simphy_treeswift(), which is used for strings with
+    comments ([...]) or quoted labels
+
+    Parameters
+    ----------
+    temp : string
+           newick string without whitespace
+
+    Returns newick string
+    """
+    if '[' in temp or "'" in temp or temp.find(';') != len(temp) - 1:
+        return relabel_newick_simphy_treeswift(temp)
+
+    # After branch lengths and internal node labels are removed, the only
+    # text left between delimiters is leaf labels
+    temp = BRANCH_LENGTH.sub("", temp)
+    temp = INTERNAL_LABEL.sub(")", temp)
+    return LEAF_LABEL_SUFFIX.sub("", temp)
+
+
+def relabel_lines_simphy(lines):
+    """
+    Relabels block of lines (runs in a worker process)
+
+    Returns list of newick strings
+    """
+    return [relabel_newick_simphy("".join(line.split())) for line in lines]
+
+
+def read_blocks(fi, size):
+    """
+    Yields blocks of lines from file
+    """
+    block = []
+    for line in fi:
+        block.append(line)
+        if len(block) == size:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+def relabel_multrees_simphy(ifil, ofil, nworkers=0):
     """
     Relabels leaves of locus or gene trees generated by SimPhy; specifically,
     [sid]_[lid]_[gid] is relabled to [sid]. Also, removes internal node labels
@@ -14,29 +95,31 @@ def relabel_multrees_simphy(ifil, ofil):
            name of input file (one newick string per line)
     ofil : string
            name of output file (one newick string per line)
+    nworkers : int
+               number of worker processes; if greater than 0, blocks of
+               lines are relabeled in parallel (and written in order)
     """
-    with open(ifil, 'r') as fi, open(ofil, 'w') as fo:
-        for line in fi.readlines():
-            temp = "".join(line.split())
-            tree = treeswift.read_tree(temp, "newick")
-
-            for node in tree.traverse_postorder():
-                if node.is_leaf():
-                    node.label = node.label.split('_')[0]
-                else:
-                    node.label = None
-                node.edge_length = None
-
-            fo.write(tree.newick())
-            fo.write('\n')
+    with open_input(ifil) as fi, open_output(ofil) as fo:
+        if nworkers > 0:
+            with multiprocessing.Pool(nworkers) as pool:
+                for newicks in pool.imap(relabel_lines_simphy,
+                                         read_blocks(fi, 1024)):
+                    for newick in newicks:
+                        fo.write(newick)
+                        fo.write('\n')
+        else:
+            for line in fi:
+                fo.write(relabel_newick_simphy("".join(line.split())))
+                fo.write('\n')
 
 
 def main(args):
-    base = args.input.rsplit('.', 1)
+    [name, ext] = split_compression_ext(args.input)
+    base = name.rsplit('.', 1)
     prefix = base[0]
     suffix = base[1]
-    output = base[0] + "-mult." + base[1]
-    relabel_multrees_simphy(args.input, output)
+    output = base[0] + "-mult." + base[1] + ext
+    relabel_multrees_simphy(args.input, output, nworkers=args.workers)
 
 
 if __name__ == '__main__':
@@ -44,5 +127,8 @@ if __name__ == '__main__':
 
     parser.add_argument("-i", "--input", type=str,
                         help="Input file", required=True)
+    parser.add_argument("-w", "--workers", type=int, default=0,
+                        help="Number of worker processes (default: 0)",
+                        required=False)
 
     main(parser.parse_args())
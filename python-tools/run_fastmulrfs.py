@@ -0,0 +1,330 @@
+"""
+This file is used to run the FastMulRFS pipeline end-to-end: gene family trees
+are preprocessed and written to a file, and then FastRFS is run on it. With
+--fifo, preprocessed trees are instead streamed into FastRFS through a named
+pipe, so that FastRFS starts reading trees while preprocessing is still
+running; this only works with builds of FastRFS that read their input once.
+The wall time and peak memory of each stage are reported at the end.
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import argparse
+import errno
+from fastmulrfs.external_tools import get_fastrfs
+from fastmulrfs.tree_file_io import open_input
+from fastmulrfs.tree_file_io import open_output
+from fastmulrfs.tree_file_io import split_compression_ext
+import os
+from preprocess_multrees_v3 import preprocess_newick
+from preprocess_multrees_v3 import read_gene_to_species_map
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+def get_peak_rss_mb(rusage):
+    """
+    Returns peak resident set size in MB from resource usage
+    """
+    if sys.platform == "darwin":
+        return rusage.ru_maxrss / (1024.0 * 1024.0)
+    return rusage.ru_maxrss / 1024.0
+
+
+class Stage:
+    """
+    External program run as a stage of the pipeline; a thread waits for the
+    program to finish, so its wall time and peak memory can be recorded
+    """
+    def __init__(self, name, cmd, lfile):
+        self.name = name
+        self.cmd = cmd
+        self.status = None
+        self.peak_rss = None
+        self.log = open(lfile, 'w')
+        self.start = time.time()
+        self.proc = subprocess.Popen(cmd, stdout=self.log,
+                                     stderr=subprocess.STDOUT)
+        self.end = None
+        self.waiter = threading.Thread(target=self._wait, daemon=True)
+        self.waiter.start()
+
+    def _wait(self):
+        [pid, status, rusage] = os.wait4(self.proc.pid, 0)
+        self.end = time.time()
+        if os.WIFSIGNALED(status):
+            self.proc.returncode = -os.WTERMSIG(status)
+        else:
+            self.proc.returncode = os.WEXITSTATUS(status)
+        self.status = self.proc.returncode
+        self.peak_rss = get_peak_rss_mb(rusage)
+
+    def is_running(self):
+        return self.waiter.is_alive()
+
+    def wait(self):
+        self.waiter.join()
+        self.log.close()
+        return self.status
+
+    def kill(self):
+        if self.is_running():
+            self.proc.kill()
+        self.wait()
+
+
+def open_fifo_for_writing(fifo, stage):
+    """
+    Opens named pipe for writing once the stage has opened it for reading;
+    gives up if the stage exits before opening it
+
+    Parameters
+    ----------
+    fifo : string
+           name of named pipe
+    stage : Stage object
+            stage reading the named pipe
+
+    Returns file object or None
+    """
+    while True:
+        try:
+            fd = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            if not stage.is_running():
+                return None
+            time.sleep(0.01)
+            continue
+        os.set_blocking(fd, True)
+        return os.fdopen(fd, 'w')
+
+
+def preprocess_and_stream(ifile, sinks, label_map=None, min_support=None):
+    """
+    Preprocesses gene family trees and writes them to every sink
+
+    Parameters
+    ----------
+    ifile : string
+            name of file containing gene family trees
+    sinks : dictionary
+            maps name of sink to file object
+    label_map : dictionary
+                maps gene copy label to [species label, rank], if leaves are
+                labeled by gene copy (optional)
+    min_support : float
+                  contract edges with support below this value (optional)
+
+    Returns
+    -------
+    nwritten : int
+               number of preprocessed trees written
+    broken : list of strings
+             names of sinks that stopped reading early
+    """
+    nwritten = 0
+    broken = []
+
+    with open_input(ifile) as fi:
+        for line in fi:
+            if not sinks:
+                break
+
+            [donot, newick, counts] = preprocess_newick(
+                                          "".join(line.split()),
+                                          label_map=label_map,
+                                          min_support=min_support)
+            if donot:
+                continue
+
+            for name in list(sinks.keys()):
+                try:
+                    sinks[name].write(newick + '\n')
+                except BrokenPipeError:
+                    broken.append(name)
+                    del sinks[name]
+            nwritten += 1
+
+    for name in list(sinks.keys()):
+        try:
+            sinks[name].close()
+        except BrokenPipeError:
+            broken.append(name)
+
+    return [nwritten, broken]
+
+
+def write_timings(rows, tfile):
+    """
+    Writes table with wall time and peak memory of each stage
+
+    Parameters
+    ----------
+    rows : list
+           [stage, status, wall time in seconds, peak RSS in MB]
+    tfile : string
+            name of TSV file (optional)
+    """
+    sys.stdout.write("%-12s %8s %12s %14s\n"
+                     % ("stage", "status", "wall (s)", "peak RSS (MB)"))
+    for [name, status, wall, rss] in rows:
+        sys.stdout.write("%-12s %8s %12.2f %14.1f\n"
+                         % (name, status, wall, rss))
+    sys.stdout.flush()
+
+    if tfile is not None:
+        with open(tfile, 'w') as f:
+            f.write("stage\tstatus\twall_seconds\tpeak_rss_mb\n")
+            for [name, status, wall, rss] in rows:
+                f.write("%s\t%s\t%1.3f\t%1.1f\n" % (name, status, wall, rss))
+
+
+def run_fastmulrfs(args):
+    """
+    Runs preprocessing and FastRFS
+
+    Returns exit status (0 if all stages succeeded)
+    """
+    prefix = args.output.rsplit('.', 1)[0]
+    workdir = tempfile.mkdtemp(prefix="fastmulrfs-",
+                               dir=os.path.dirname(os.path.abspath(
+                                   args.output)))
+
+    label_map = None
+    if args.map is not None:
+        label_map = read_gene_to_species_map(args.map)
+
+    stages = []
+    sinks = {}
+    begin = time.time()
+
+    try:
+        # FastRFS only reads plain text, so a compressed copy (-p) is
+        # written separately
+        keep = args.preprocessed
+        if args.fifo:
+            fastrfs_input = os.path.join(workdir, "fastrfs.fifo")
+            os.mkfifo(fastrfs_input)
+        elif keep is None or split_compression_ext(keep)[1]:
+            fastrfs_input = os.path.join(workdir, "preprocessed.trees")
+            sinks["FastRFS input"] = open(fastrfs_input, 'w')
+        else:
+            fastrfs_input = keep
+            sinks["FastRFS input"] = open(fastrfs_input, 'w')
+            keep = None
+        if keep is not None:
+            sinks["file"] = open_output(keep)
+
+        def start_fastrfs():
+            stages.append(Stage("FastRFS",
+                                [args.fastrfs, "-i", fastrfs_input,
+                                 "-o", args.output],
+                                prefix + ".log"))
+
+        if args.fifo:
+            # Start reader first, so trees flow as soon as they are ready
+            start_fastrfs()
+            f = open_fifo_for_writing(fastrfs_input, stages[0])
+            if f is None:
+                sys.stderr.write("FastRFS exited before reading any trees "
+                                 "(see its log)!\n")
+            else:
+                sinks["FastRFS"] = f
+
+        start = time.time()
+        [nwritten, broken] = preprocess_and_stream(
+                                 args.input, sinks, label_map=label_map,
+                                 min_support=args.min_support)
+        end = time.time()
+        self_rss = get_peak_rss_mb(resource.getrusage(resource.RUSAGE_SELF))
+
+        for name in broken:
+            sys.stderr.write("%s stopped reading trees early "
+                             "(see its log)!\n" % name)
+
+        if not args.fifo:
+            start_fastrfs()
+
+        rows = [["preprocess", 0, end - start, self_rss]]
+        status = 0
+        for stage in stages:
+            code = stage.wait()
+            rows.append([stage.name, code, stage.end - stage.start,
+                         stage.peak_rss])
+            if code != 0:
+                status = 1
+        rows.append(["total", status, time.time() - begin,
+                     max([row[3] for row in rows])])
+
+        sys.stdout.write("Preprocessed %d gene trees\n" % nwritten)
+        write_timings(rows, args.timings)
+    except BaseException:
+        for stage in stages:
+            stage.kill()
+        raise
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return status
+
+
+def main(args):
+    if not os.path.exists(args.fastrfs):
+        sys.exit("Error: %s does not exist; need to get external "
+                 "dependencies!\n" % args.fastrfs)
+
+    sys.exit(run_fastmulrfs(args))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-i", "--input", type=str,
+                        help="Input file containing gene family trees "
+                             "(one newick string per line)",
+                        required=True)
+    parser.add_argument("-a", "--map", type=str,
+                        help="Input file containing label map, if leaves "
+                             "are labeled by gene copy (see "
+                             "preprocess_multrees_v3.py)",
+                        required=False)
+    parser.add_argument("-o", "--output", type=str,
+                        help="Output file name for FastMulRFS species tree; "
+                             "the FastRFS log is written next to it",
+                        required=True)
+    parser.add_argument("-p", "--preprocessed", type=str,
+                        help="Keep preprocessed gene trees in this file (by "
+                             "default they are removed at the end); file is "
+                             "compressed if name ends with .gz, .bz2, or .xz",
+                        required=False)
+    parser.add_argument("--min-support", type=float,
+                        help="Contract internal edges whose support is below "
+                             "this value before preprocessing (see "
+                             "preprocess_multrees_v3.py)",
+                        required=False)
+    parser.add_argument("-x", "--fastrfs", type=str, default=get_fastrfs(),
+                        help="FastRFS binary including full path "
+                             "(default: external/FastRFS/build/FastRFS or "
+                             "FastRFS on the PATH)",
+                        required=False)
+    parser.add_argument("--fifo", action="store_true",
+                        help="Stream preprocessed gene trees into FastRFS "
+                             "through a named pipe while preprocessing is "
+                             "running (experimental; only for builds of "
+                             "FastRFS that read their input once)")
+    parser.add_argument("-t", "--timings", type=str,
+                        help="Output TSV file with wall time and peak memory "
+                             "of each stage",
+                        required=False)
+
+    main(parser.parse_args())
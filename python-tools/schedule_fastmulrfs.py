@@ -0,0 +1,395 @@
+"""
+This file is used to run the FastMulRFS pipeline (preprocessing, FastRFS,
+and scoring) over many datasets on a single machine. Steps of different
+datasets run at the same time as long as they fit within the CPU and memory
+budgets, so the cheap python steps of some datasets are interleaved with the
+external programs (FastRFS, MulRF) of others. The status and timing
+of every step are recorded in a ledger.
+
+Each line of the manifest has the form:
+name,gene_trees[,output_directory]
+where gene_trees is a file of gene family trees (one newick string per line)
+and the outputs of the dataset are written to output_directory (by default,
+the directory containing gene_trees) with names starting with name.
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import argparse
+import asyncio
+import concurrent.futures
+from compute_total_rf_score import compute_total_rf_score
+from fastmulrfs.external_tools import get_fastrfs
+import os
+from preprocess_multrees_v3 import read_preprocess_and_write_multrees
+import shutil
+import sys
+import time
+
+
+class ResourcePool:
+    """
+    CPUs and memory (in GB) shared by all running steps
+    """
+    def __init__(self, cpus, memory):
+        self.cpus = cpus
+        self.memory = memory
+        self.free_cpus = cpus
+        self.free_memory = memory
+        self.condition = asyncio.Condition()
+
+    def clamp(self, cpus, memory):
+        # A step that needs more than the budget runs alone
+        return [min(cpus, self.cpus), min(memory, self.memory)]
+
+    async def acquire(self, cpus, memory):
+        [cpus, memory] = self.clamp(cpus, memory)
+        async with self.condition:
+            await self.condition.wait_for(
+                lambda: cpus <= self.free_cpus and
+                memory <= self.free_memory)
+            self.free_cpus -= cpus
+            self.free_memory -= memory
+
+    async def release(self, cpus, memory):
+        [cpus, memory] = self.clamp(cpus, memory)
+        async with self.condition:
+            self.free_cpus += cpus
+            self.free_memory += memory
+            self.condition.notify_all()
+
+
+class Ledger:
+    """
+    CSV file with one row per step: dataset, step, status, start and end
+    times (seconds since the epoch), wall time (seconds), CPUs, memory (GB),
+    and a message
+    """
+    def __init__(self, name):
+        exists = os.path.exists(name) and os.path.getsize(name) > 0
+        self.f = open(name, 'a')
+        if not exists:
+            self.f.write("dataset,step,status,start,end,wall_seconds,"
+                         "cpus,memory_gb,message\n")
+            self.f.flush()
+
+    def record(self, job, step, status, start, end, cpus, memory, message):
+        self.f.write("%s,%s,%s,%1.3f,%1.3f,%1.3f,%d,%1.1f,%s\n"
+                     % (job, step, status, start, end, end - start,
+                        cpus, memory, message.replace(',', ';')))
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def is_up_to_date(ofile, ifiles):
+    """
+    Checks whether output file exists and is newer than all input files
+    """
+    if not os.path.exists(ofile):
+        return False
+    mtime = os.path.getmtime(ofile)
+    return all([os.path.getmtime(ifile) <= mtime for ifile in ifiles])
+
+
+def preprocess_step(ifile, ofile):
+    """
+    Preprocesses gene family trees (runs in a worker process)
+    """
+    temp = ofile + ".tmp"
+    read_preprocess_and_write_multrees(ifile, temp, False)
+    os.replace(temp, ofile)
+    return ""
+
+
+def score_step(sfile, gfile, ofile):
+    """
+    Scores species tree against preprocessed gene trees (runs in a worker
+    process)
+    """
+    [total_fn, total_fp, total_rf] = compute_total_rf_score(sfile, gfile)
+    with open(ofile, 'w') as f:
+        f.write('%d,%d,%d\n' % (total_fn, total_fp, total_rf))
+    return "total FN=%d FP=%d" % (total_fn, total_fp)
+
+
+async def run_external(cmd, lfile, ofile=None):
+    """
+    Runs external program with output written to log file
+
+    Parameters
+    ----------
+    cmd : list of strings
+          command to run
+    lfile : string
+            name of log file
+    ofile : string
+            name of file to copy log file to if the program succeeds
+            (optional)
+
+    Returns empty string (raises RuntimeError if program fails)
+    """
+    with open(lfile, 'w') as log:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=log, stderr=asyncio.subprocess.STDOUT)
+        status = await proc.wait()
+    if status != 0:
+        raise RuntimeError("exited with status %d (see %s)"
+                           % (status, lfile))
+    if ofile is not None:
+        shutil.copyfile(lfile, ofile)
+    return ""
+
+
+class Scheduler:
+    """
+    Runs the steps of all datasets within the CPU and memory budgets
+    """
+    def __init__(self, args, pool, executor, ledger):
+        self.args = args
+        self.pool = pool
+        self.executor = executor
+        self.ledger = ledger
+        self.nfail = 0
+
+    async def run_step(self, job, step, cpus, memory, outputs, inputs, run):
+        """
+        Runs step once resources are available
+
+        Parameters
+        ----------
+        job : string
+              name of dataset
+        step : string
+               name of step
+        cpus : int
+               number of CPUs used by step
+        memory : float
+                 memory (GB) used by step
+        outputs : list of strings
+                  names of files written by step
+        inputs : list of strings
+                 names of files read by step
+        run : function
+              coroutine function running step; returns message
+
+        Returns True if step succeeded or was up-to-date
+        """
+        if not self.args.force and \
+           all([is_up_to_date(ofile, inputs) for ofile in outputs]):
+            now = time.time()
+            self.ledger.record(job, step, "up-to-date", now, now, 0, 0, "")
+            return True
+
+        await self.pool.acquire(cpus, memory)
+        start = time.time()
+        try:
+            message = await run()
+            status = "ok"
+        except Exception as e:
+            message = "%s: %s" % (type(e).__name__, e)
+            status = "failed"
+        finally:
+            await self.pool.release(cpus, memory)
+        end = time.time()
+
+        # Do not leave behind outputs that look up-to-date
+        if status == "failed":
+            for ofile in outputs:
+                if os.path.exists(ofile) and os.path.getmtime(ofile) >= start:
+                    os.remove(ofile)
+
+        self.ledger.record(job, step, status, start, end, cpus, memory,
+                           message)
+        if self.args.verbose:
+            sys.stdout.write("%s %s %s (%1.1f s) %s\n"
+                             % (job, step, status, end - start, message))
+            sys.stdout.flush()
+
+        return status == "ok"
+
+    def run_python(self, function, *args):
+        loop = asyncio.get_running_loop()
+
+        async def run():
+            return await loop.run_in_executor(self.executor, function, *args)
+
+        return run
+
+    async def run_job(self, job, ifile, outdir):
+        """
+        Runs the steps of one dataset; steps whose inputs failed are not run
+        """
+        args = self.args
+        prefix = os.path.join(outdir, job)
+        pfile = prefix + "-for-fastrfs.trees"
+        sfile = prefix + "-fastmulrfs.tree"
+
+        ok = await self.run_step(job, "preprocess", 1, args.python_memory,
+                                 [pfile], [ifile],
+                                 self.run_python(preprocess_step,
+                                                 ifile, pfile))
+        if not ok:
+            self.nfail += 1
+            return
+
+        ok = await self.run_step(
+            job, "FastRFS", 1, args.fastrfs_memory, [sfile], [pfile],
+            lambda: run_external([args.fastrfs, "-i", pfile, "-o", sfile],
+                                 prefix + "-fastmulrfs.log"))
+        if ok:
+            ok = await self.run_step(
+                job, "score", 1, args.python_memory,
+                [prefix + "-score.txt"], [sfile, pfile],
+                self.run_python(score_step, sfile, pfile,
+                                prefix + "-score.txt"))
+
+        if ok and args.mulrf is not None:
+            script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  "check_mulrf_scores_v3.py")
+            ok = await self.run_step(
+                job, "MulRF", 1, args.python_memory,
+                [prefix + "-mulrf.txt"], [sfile, ifile],
+                lambda: run_external([sys.executable, script,
+                                      "-s", sfile, "-g", ifile,
+                                      "-x", args.mulrf],
+                                     prefix + "-mulrf.log",
+                                     prefix + "-mulrf.txt"))
+
+        if not ok:
+            self.nfail += 1
+
+
+def read_manifest(mfile):
+    """
+    Reads manifest of datasets
+
+    Parameters
+    ----------
+    mfile : string
+            name of manifest file; each row has form:
+            name,gene_trees[,output_directory]
+            relative paths are relative to the directory of the manifest
+
+    Returns list of [name, gene_trees, output_directory]
+    """
+    root = os.path.dirname(mfile)
+    jobs = []
+    names = set([])
+    with open(mfile, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            words = [word.strip() for word in line.split(',')]
+            name = words[0]
+            ifile = os.path.join(root, words[1])
+            if len(words) > 2:
+                outdir = os.path.join(root, words[2])
+            else:
+                outdir = os.path.dirname(ifile)
+
+            if name in names:
+                sys.exit("Error: Dataset %s is listed twice in %s!\n"
+                         % (name, mfile))
+            names.add(name)
+            jobs.append([name, ifile, outdir])
+
+    return jobs
+
+
+def get_total_memory_gb():
+    """
+    Returns total physical memory in GB (or None if unknown)
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / \
+            (1024.0 ** 3)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+async def schedule(args, jobs):
+    pool = ResourcePool(args.cpus, args.memory)
+    ledger = Ledger(args.ledger)
+    with concurrent.futures.ProcessPoolExecutor(args.cpus) as executor:
+        scheduler = Scheduler(args, pool, executor, ledger)
+        await asyncio.gather(*[scheduler.run_job(name, ifile, outdir)
+                               for [name, ifile, outdir] in jobs])
+    ledger.close()
+    return scheduler.nfail
+
+
+def main(args):
+    if not os.path.exists(args.fastrfs):
+        sys.exit("Error: %s does not exist; need to get external "
+                 "dependencies!\n" % args.fastrfs)
+
+    if args.memory is None:
+        args.memory = get_total_memory_gb()
+        if args.memory is None:
+            sys.exit("Error: Cannot get total memory; use --memory!\n")
+
+    jobs = read_manifest(args.manifest)
+    for [name, ifile, outdir] in jobs:
+        if not os.path.exists(ifile):
+            sys.exit("Error: %s does not exist!\n" % ifile)
+        os.makedirs(outdir, exist_ok=True)
+
+    nfail = asyncio.run(schedule(args, jobs))
+
+    sys.stdout.write("%d of %d datasets finished, %d failed (see %s)\n"
+                     % (len(jobs) - nfail, len(jobs), nfail, args.ledger))
+    sys.stdout.flush()
+    if nfail:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-m", "--manifest", type=str,
+                        help="Input file listing datasets; each row has "
+                             "form: 'name,gene_trees[,output_directory]'",
+                        required=True)
+    parser.add_argument("-l", "--ledger", type=str,
+                        default="fastmulrfs-ledger.csv",
+                        help="Output CSV file recording status and timing "
+                             "of every step; rows are appended "
+                             "(default: fastmulrfs-ledger.csv)",
+                        required=False)
+    parser.add_argument("--cpus", type=int, default=os.cpu_count(),
+                        help="Number of CPUs to use "
+                             "(default: number of CPUs)",
+                        required=False)
+    parser.add_argument("--memory", type=float,
+                        help="Memory (GB) to use (default: total memory)",
+                        required=False)
+    parser.add_argument("-x", "--fastrfs", type=str, default=get_fastrfs(),
+                        help="FastRFS binary including full path "
+                             "(default: external/FastRFS/build/FastRFS or "
+                             "FastRFS on the PATH)",
+                        required=False)
+    parser.add_argument("--fastrfs-memory", type=float, default=4.0,
+                        help="Memory (GB) needed by FastRFS (default: 4)",
+                        required=False)
+    parser.add_argument("--mulrf", type=str,
+                        help="MulRFScorer binary including full path; if "
+                             "given, the MulRF score of each species tree is "
+                             "checked with check_mulrf_scores_v3.py",
+                        required=False)
+    parser.add_argument("--python-memory", type=float, default=1.0,
+                        help="Memory (GB) needed by python steps "
+                             "(default: 1)",
+                        required=False)
+    parser.add_argument("--force", action="store_true",
+                        help="Run steps even if their outputs are "
+                             "up-to-date")
+    parser.add_argument("--verbose", action="store_true")
+
+    main(parser.parse_args())
@@ -0,0 +1,284 @@
+"""
+This file is used to simulate gene family trees (MUL-trees) for testing and
+benchmarking. A random species tree is simulated first; each gene family tree
+is then a copy of the species tree in which extra copies of species are added
+as siblings of random nodes on the path from the root to the species (i.e.,
+duplications at random depths), species are lost at random, and edges are
+contracted at random to create polytomies.
+
+Copyright (c) 2020 Erin K. Molloy
+All rights reserved.
+
+License: 3-Clause BSD,
+see https://opensource.org/licenses/BSD-3-Clause
+"""
+import argparse
+from fastmulrfs.tree_file_io import open_output
+import random
+
+
+def simulate_species_tree(species, rng):
+    """
+    Simulates random binary tree by joining random pairs of subtrees
+
+    Parameters
+    ----------
+    species : list of strings
+              species labels
+    rng : random.Random object
+
+    Returns tree as nested lists (leaves are strings)
+    """
+    nodes = list(species)
+    while len(nodes) > 1:
+        i = rng.randrange(len(nodes))
+        left = nodes[i]
+        nodes[i] = nodes[-1]
+        nodes.pop()
+        j = rng.randrange(len(nodes))
+        nodes[j] = [left, nodes[j]]
+    return nodes[0]
+
+
+def get_copy_numbers(species, copies, skew, rng):
+    """
+    Gets number of copies of each species in a gene family tree
+
+    Parameters
+    ----------
+    species : list of strings
+              species labels
+    copies : float
+             mean number of copies per species (at least 1)
+    skew : float
+           extra copies are given to species with probability proportional
+           to 1 / rank^skew, where the ranks are shuffled for each gene tree;
+           0 spreads duplications evenly and larger values concentrate them
+           in a few species
+    rng : random.Random object
+
+    Returns dictionary mapping species label to number of copies
+    """
+    ncopy = dict([(s, 1) for s in species])
+    nextra = int(round((copies - 1.0) * len(species)))
+    if nextra > 0:
+        ranked = list(species)
+        rng.shuffle(ranked)
+        weights = [1.0 / ((r + 1) ** skew) for r in range(len(ranked))]
+        for s in rng.choices(ranked, weights=weights, k=nextra):
+            ncopy[s] += 1
+    return ncopy
+
+
+def find_path(tree, label, path):
+    """
+    Finds path from root to (first) leaf with label
+
+    Parameters
+    ----------
+    tree : nested lists
+    label : string
+    path : list
+           filled with [parent, index of child] pairs
+
+    Returns True if leaf was found
+    """
+    if isinstance(tree, str):
+        return tree == label
+    for i, child in enumerate(tree):
+        path.append([tree, i])
+        if find_path(child, label, path):
+            return True
+        path.pop()
+    return False
+
+
+def remove_leaves(tree, lost):
+    """
+    Removes leaves with labels in lost and suppresses unifurcations
+
+    Returns tree (None if no leaves remain)
+    """
+    if isinstance(tree, str):
+        if tree in lost:
+            return None
+        return tree
+    children = [remove_leaves(child, lost) for child in tree]
+    children = [child for child in children if child is not None]
+    if not children:
+        return None
+    if len(children) == 1:
+        return children[0]
+    return children
+
+
+def contract_edges(tree, degree, rng):
+    """
+    Contracts random internal edges as long as no node has more than degree
+    children
+
+    Returns tree
+    """
+    if isinstance(tree, str):
+        return tree
+    children = []
+    count = len(tree)
+    for child in tree:
+        child = contract_edges(child, degree, rng)
+        if not isinstance(child, str) and \
+           count + len(child) - 1 <= degree and rng.random() < 0.5:
+            children += child
+            count += len(child) - 1
+        else:
+            children.append(child)
+    return children
+
+
+def write_newick(tree, rng):
+    """
+    Returns newick string for tree with children in random order
+    """
+    if isinstance(tree, str):
+        return tree
+    children = [write_newick(child, rng) for child in tree]
+    rng.shuffle(children)
+    return "(" + ",".join(children) + ")"
+
+
+def copy_tree(tree):
+    """
+    Returns copy of tree
+    """
+    if isinstance(tree, str):
+        return tree
+    return [copy_tree(child) for child in tree]
+
+
+def simulate_multree(stree, species, copies, skew, degree, loss, rng):
+    """
+    Simulates gene family tree
+
+    Parameters
+    ----------
+    stree : nested lists
+            species tree
+    species : list of strings
+              species labels
+    copies : float
+             mean number of copies per species
+    skew : float
+           see get_copy_numbers()
+    degree : int
+             maximum number of children of a node
+    loss : float
+           probability that a species is missing from the gene tree
+    rng : random.Random object
+
+    Returns newick string
+    """
+    gtree = copy_tree(stree)
+
+    ncopy = get_copy_numbers(species, copies, skew, rng)
+    for s in species:
+        for c in range(1, ncopy[s]):
+            # Add copy as sibling of random node on path from root to s
+            path = []
+            find_path(gtree, s, path)
+            k = rng.randrange(len(path) + 1)
+            if k == 0:
+                gtree = [gtree, s]
+            else:
+                [parent, i] = path[k - 1]
+                parent[i] = [parent[i], s]
+
+    lost = set([s for s in species if rng.random() < loss])
+    if len(species) - len(lost) < 4:
+        lost = set([])
+    gtree = remove_leaves(gtree, lost)
+
+    if degree > 2:
+        gtree = contract_edges(gtree, degree, rng)
+
+    return write_newick(gtree, rng) + ";"
+
+
+def simulate_multrees(nspecies, ntrees, copies, skew, degree, loss, seed):
+    """
+    Simulates species tree and gene family trees
+
+    Parameters
+    ----------
+    nspecies : int
+               number of species
+    ntrees : int
+             number of gene family trees
+    copies, skew, degree, loss : see simulate_multree()
+    seed : int
+           seed for random number generator
+
+    Returns
+    -------
+    stree : string
+            newick string for species tree
+    gtrees : list of strings
+             newick strings for gene family trees
+    """
+    rng = random.Random(seed)
+    species = [str(i + 1) for i in range(nspecies)]
+    stree = simulate_species_tree(species, rng)
+    gtrees = [simulate_multree(stree, species, copies, skew, degree, loss,
+                               rng)
+              for g in range(ntrees)]
+    return [write_newick(stree, rng) + ";", gtrees]
+
+
+def main(args):
+    [stree, gtrees] = simulate_multrees(args.species, args.trees,
+                                        args.copies, args.skew,
+                                        args.degree, args.loss, args.seed)
+
+    with open_output(args.output) as f:
+        for gtree in gtrees:
+            f.write(gtree + '\n')
+
+    if args.stree is not None:
+        with open_output(args.stree) as f:
+            f.write(stree + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-n", "--species", type=int, default=50,
+                        help="Number of species (default: 50)",
+                        required=False)
+    parser.add_argument("-t", "--trees", type=int, default=100,
+                        help="Number of gene family trees (default: 100)",
+                        required=False)
+    parser.add_argument("-c", "--copies", type=float, default=1.5,
+                        help="Mean number of copies per species "
+                             "(default: 1.5)",
+                        required=False)
+    parser.add_argument("--skew", type=float, default=1.0,
+                        help="Skew of extra copies across species; 0 spreads "
+                             "duplications evenly (default: 1)",
+                        required=False)
+    parser.add_argument("-d", "--degree", type=int, default=2,
+                        help="Maximum number of children of a node; 2 gives "
+                             "binary trees (default: 2)",
+                        required=False)
+    parser.add_argument("--loss", type=float, default=0.0,
+                        help="Probability that a species is missing from a "
+                             "gene family tree (default: 0)",
+                        required=False)
+    parser.add_argument("--seed", type=int, default=1,
+                        help="Seed for random number generator (default: 1)",
+                        required=False)
+    parser.add_argument("-o", "--output", type=str,
+                        help="Output file for gene family trees",
+                        required=True)
+    parser.add_argument("-s", "--stree", type=str,
+                        help="Output file for species tree (optional)",
+                        required=False)
+
+    main(parser.parse_args())
@@ -0,0 +1,16 @@
+from setuptools import setup
+
+
+setup(name="fastmulrfs",
+      version="1.0",
+      description="Preprocessing MUL-trees for FastMulRFS",
+      author="Erin K. Molloy",
+      url="https://github.com/ekmolloy/fastmulrfs",
+      license="BSD-3-Clause",
+      package_dir={"": "python-tools"},
+      packages=["fastmulrfs"],
+      py_modules=["check_mulrf_scores_v3",
+                  "preprocess_multrees_v2",
+                  "preprocess_multrees_v3"],
+      install_requires=["treeswift"],
+      python_requires=">=3.7")
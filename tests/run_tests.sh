@@ -79,3 +79,901 @@ done
 
 # This should always be 0!
 sed 's/,/ /g' compare_trees.csv | awk '{print $9}'
+
+
+# Check that the pipeline (-w) exits instead of hanging when a worker fails
+# or is killed
+big="pipeline-test-input.trees"
+for k in $(seq 4800); do cat g_trees_1-mult.trees; done > $big
+
+(echo "((a,b);"; cat $big) > pipeline-test-bad.trees
+timeout 60 python $preprocessv3 -i pipeline-test-bad.trees \
+                                -o pipeline-test-output.trees \
+                                -w 2 &> /dev/null
+status=$?
+if [ $status != 0 ] && [ $status != 124 ]; then
+    echo "Pipeline passed test of failed worker."
+else
+    echo "Pipeline failed test of failed worker, because"
+    echo "    exit status is $status"
+fi
+
+python $preprocessv3 -i $big -o pipeline-test-output.trees -w 2 &> /dev/null &
+pid=$!
+sleep 2
+kill -9 $(pgrep -P $pid | head -n 1)
+( sleep 60; kill -9 $pid ) &> /dev/null &
+watchdog=$!
+wait $pid
+status=$?
+kill $watchdog &> /dev/null
+if [ $status != 0 ] && [ $status != 137 ]; then
+    echo "Pipeline passed test of killed worker."
+else
+    echo "Pipeline failed test of killed worker, because"
+    echo "    exit status is $status"
+fi
+pkill -9 -P $pid &> /dev/null
+
+rm -f $big pipeline-test-bad.trees pipeline-test-output.trees
+
+
+# Check that resuming from a checkpoint gives the same output, after
+# discarding anything written after the last checkpoint
+for i in 1 2 3; do
+    python $preprocessv3 -i g_trees_${i}-mult.trees \
+                         -o resume-test-expected.trees &> /dev/null
+    python $preprocessv3 -i g_trees_${i}-mult.trees \
+                         -o resume-test-output.trees \
+                         -c resume-test.ckpt --checkpoint-every 10 &> /dev/null
+    echo "partial tree written after last checkpoint" \
+        >> resume-test-output.trees
+    python $preprocessv3 -i g_trees_${i}-mult.trees \
+                         -o resume-test-output.trees \
+                         -c resume-test.ckpt --resume &> /dev/null
+    if cmp -s resume-test-output.trees resume-test-expected.trees; then
+        echo "Resume passed test $i."
+    else
+        echo "Resume failed test $i, because outputs differ"
+    fi
+
+    data=$(term=ansi python $checkv3 -s s_tree_${i}.trees \
+                                     -g g_trees_${i}-mult.trees \
+                                     -x $mulrfscorer \
+                                     -c resume-test.ckpt \
+                                     --checkpoint-every 10)
+    data=$(term=ansi python $checkv3 -s s_tree_${i}.trees \
+                                     -g g_trees_${i}-mult.trees \
+                                     -x $mulrfscorer \
+                                     -c resume-test.ckpt --resume)
+    esti_rf=$(echo $data | awk '{print $1}')
+    if [ ${true_rfs[$[i-1]]} == "$esti_rf" ]; then
+        echo "Resume of version 3 passed test $i."
+    else
+        echo "Resume of version 3 failed test $i, because"
+        echo "    $data"
+    fi
+    rm -f resume-test*
+done
+
+
+# Check that --keep-going records every failure instead of exiting on the
+# first one (MulRF is replaced by a program that never writes a score)
+python $checkv3 -s s_tree_1.trees -g g_trees_1-mult.trees -x /bin/false \
+                --keep-going -f keep-going-test.txt &> /dev/null
+status=$?
+nfail=$(cat keep-going-test.txt | wc -l)
+if [ $status == 1 ] && [ $nfail == 25 ]; then
+    echo "Keep going passed test."
+else
+    echo "Keep going failed test, because"
+    echo "    exit status is $status and $nfail failures were recorded"
+fi
+rm -f keep-going-test.txt g_trees_1-mult-*scored.*
+
+
+# Check that compressed input and output give the same trees
+for i in 1 2 3; do
+    python $preprocessv3 -i g_trees_${i}-mult.trees \
+                         -o compress-test-expected.trees &> /dev/null
+    gzip -c g_trees_${i}-mult.trees > compress-test-input.trees.gz
+    python $preprocessv3 -i compress-test-input.trees.gz \
+                         -o compress-test-output.trees.xz &> /dev/null
+    python $preprocessv3 -i compress-test-input.trees.gz \
+                         -o compress-test-output.trees.bz2 &> /dev/null
+    if xz -dc compress-test-output.trees.xz \
+           | cmp -s - compress-test-expected.trees && \
+       bzip2 -dc compress-test-output.trees.bz2 \
+           | cmp -s - compress-test-expected.trees; then
+        echo "Compression passed test $i."
+    else
+        echo "Compression failed test $i, because outputs differ"
+    fi
+    rm -f compress-test*
+done
+
+
+# Check that the pipeline (-w) writes the same trees as the sequential
+# version
+for i in 1 2 3; do
+    python $preprocessv3 -i g_trees_${i}-mult.trees \
+                         -o workers-test-expected.trees &> /dev/null
+    python $preprocessv3 -i g_trees_${i}-mult.trees \
+                         -o workers-test-output.trees -w 2 &> /dev/null
+    if cmp -s workers-test-output.trees workers-test-expected.trees; then
+        echo "Pipeline passed test $i."
+    else
+        echo "Pipeline failed test $i, because outputs differ"
+    fi
+    rm -f workers-test*
+done
+
+
+# Check that the python API gives the same trees and score shifts as the
+# command line tool
+for i in 1 2 3; do
+    python $preprocessv3 -i g_trees_${i}-mult.trees \
+                         -o api-test-expected.trees \
+                         --score-shifts api-test-shifts.txt &> /dev/null
+
+    data=$(python - g_trees_${i}-mult.trees <<'END'
+import sys
+sys.path.insert(0, "../python-tools")
+from fastmulrfs import iter_preprocessed
+
+with open(sys.argv[1]) as f:
+    results = [x for x in iter_preprocessed(f) if x[0] is not None]
+with open("api-test-expected.trees") as f:
+    trees = [line.strip() for line in f]
+with open("api-test-shifts.txt") as f:
+    shifts = [int(line) for line in f]
+if [x[0] for x in results] != trees:
+    sys.exit("trees differ")
+if [x[1]["score_shift"] for x in results] != shifts:
+    sys.exit("score shifts differ")
+print("ok")
+END
+)
+    if [ "$data" == "ok" ]; then
+        echo "Python API passed test $i."
+    else
+        echo "Python API failed test $i, because"
+        echo "    $data"
+    fi
+    rm -f api-test*
+done
+
+
+# Check that preprocessing on the server gives the same trees as running the
+# script, and that a second server does not take over the socket
+server="../python-tools/fastmulrfs_server.py"
+client="../python-tools/fastmulrfs_client.py"
+sock="$(pwd)/server-test.sock"
+
+python $server -S $sock &> /dev/null &
+pid=$!
+for k in $(seq 100); do
+    [ -S $sock ] && break
+    sleep 0.1
+done
+
+for i in 1 2 3; do
+    python $preprocessv3 -i g_trees_${i}-mult.trees \
+                         -o server-test-expected.trees &> /dev/null
+    python $client -S $sock preprocess -i g_trees_${i}-mult.trees \
+                                       -o server-test-output.trees &> /dev/null
+    if cmp -s server-test-output.trees server-test-expected.trees; then
+        echo "Server passed test $i."
+    else
+        echo "Server failed test $i, because outputs differ"
+    fi
+done
+
+python $server -S $sock &> /dev/null
+status=$?
+if [ $status != 0 ] && python $client -S $sock score -h &> /dev/null; then
+    echo "Server passed test of socket in use."
+else
+    echo "Server failed test of socket in use, because"
+    echo "    exit status is $status"
+fi
+
+python $client -S $sock shutdown &> /dev/null
+wait $pid
+rm -f server-test*
+
+
+# Check that batch preprocessing gives the same trees as running the script
+# on each file, and that running the batch again skips every file
+batch="../python-tools/batch_preprocess_multrees.py"
+
+for i in 1 2 3; do
+    mkdir -p batch-test/rep$i
+    cp g_trees_${i}-mult.trees batch-test/rep$i/g_trees-mult.trees
+done
+
+for check in mtime hash; do
+    rm -f batch-test/rep*/*-for-fastrfs.trees*
+    python $batch -i "batch-test/rep*/*" -w 2 --check $check &> /dev/null
+    data=$(python $batch -i "batch-test/rep*/*" -w 2 --check $check)
+    for i in 1 2 3; do
+        python $preprocessv3 -i g_trees_${i}-mult.trees \
+                             -o batch-test-expected.trees &> /dev/null
+        if cmp -s batch-test/rep$i/g_trees-mult-for-fastrfs.trees \
+                  batch-test-expected.trees; then
+            echo "Batch passed test $i with --check $check."
+        else
+            echo "Batch failed test $i with --check $check, because"
+            echo "    outputs differ"
+        fi
+    done
+    if [ "$data" == \
+         "Preprocessed 0 files, skipped 3 up-to-date files, 0 files failed" ]
+    then
+        echo "Batch passed test of rerun with --check $check."
+    else
+        echo "Batch failed test of rerun with --check $check, because"
+        echo "    $data"
+    fi
+done
+rm -rf batch-test batch-test-expected.trees
+
+
+# Check that the driver gives FastRFS the preprocessed gene trees, when they
+# are written to a file and when they are streamed through a named pipe
+# (FastRFS is replaced by a program that copies its input to its output)
+driver="../python-tools/run_fastmulrfs.py"
+cat > driver-test-fastrfs.sh <<'END'
+#!/bin/bash
+cat "$2" > "$4"
+END
+chmod +x driver-test-fastrfs.sh
+
+for i in 1 2 3; do
+    python $preprocessv3 -i g_trees_${i}-s2g.trees \
+                         -a g_trees_${i}-s2g-map.txt \
+                         -o driver-test-expected.trees &> /dev/null
+    python $driver -i g_trees_${i}-s2g.trees -a g_trees_${i}-s2g-map.txt \
+                   -o driver-test-file.tree -x ./driver-test-fastrfs.sh \
+                   -p driver-test-kept.trees.gz &> /dev/null
+    python $driver -i g_trees_${i}-s2g.trees -a g_trees_${i}-s2g-map.txt \
+                   -o driver-test-fifo.tree -x ./driver-test-fastrfs.sh \
+                   --fifo &> /dev/null
+    if cmp -s driver-test-file.tree driver-test-expected.trees && \
+       gzip -dc driver-test-kept.trees.gz \
+           | cmp -s - driver-test-expected.trees && \
+       cmp -s driver-test-fifo.tree driver-test-expected.trees; then
+        echo "Driver passed test $i."
+    else
+        echo "Driver failed test $i, because outputs differ"
+    fi
+    rm -f driver-test-*.tree* driver-test-*.log
+done
+rm -f driver-test*
+
+
+# Check that the scheduler runs every step of every dataset, and that
+# running it again skips every step (FastRFS is replaced by a program that
+# copies its input to its output)
+schedule="../python-tools/schedule_fastmulrfs.py"
+cat > schedule-test-fastrfs.sh <<'END'
+#!/bin/bash
+cat "$2" > "$4"
+END
+chmod +x schedule-test-fastrfs.sh
+
+for i in 1 2 3; do
+    echo "data$i,g_trees_${i}-mult.trees,schedule-test"
+done > schedule-test-manifest.csv
+
+for run in 1 2; do
+    python $schedule -m schedule-test-manifest.csv \
+                     -l schedule-test-ledger-$run.csv \
+                     -x ./schedule-test-fastrfs.sh --memory 8 &> /dev/null
+done
+
+for i in 1 2 3; do
+    python $preprocessv3 -i g_trees_${i}-mult.trees \
+                         -o schedule-test-expected.trees &> /dev/null
+    nok=$(grep -c "^data$i,.*,ok," schedule-test-ledger-1.csv)
+    nskip=$(grep -c "^data$i,.*,up-to-date," schedule-test-ledger-2.csv)
+    if cmp -s schedule-test/data$i-for-fastrfs.trees \
+              schedule-test-expected.trees && \
+       cmp -s schedule-test/data$i-fastmulrfs.tree \
+              schedule-test-expected.trees && \
+       [ $nok == 3 ] && [ $nskip == 3 ]; then
+        echo "Scheduler passed test $i."
+    else
+        echo "Scheduler failed test $i, because"
+        echo "    $nok steps ran and $nskip steps were skipped on rerun"
+    fi
+done
+rm -rf schedule-test*
+
+
+# Check that the metrics file is in the Prometheus text format and that its
+# counts match the output
+for i in 1 2 3; do
+    python $preprocessv3 -i g_trees_${i}-mult.trees \
+                         -o metrics-test-output.trees \
+                         --score-shifts metrics-test-shifts.txt \
+                         -m metrics-test.prom &> /dev/null
+
+    data=$(python - g_trees_${i}-mult.trees <<'END'
+import re
+import sys
+
+sample = re.compile(r'^([a-z_]+)\{input="[^"]*"(,reason="[a-z_]+")?\} '
+                    r'(-?[0-9.e+-]+)$')
+values = {}
+described = set([])
+with open("metrics-test.prom") as f:
+    for line in f:
+        line = line.rstrip('\n')
+        if line.startswith("# HELP ") or line.startswith("# TYPE "):
+            described.add((line[2:6], line.split()[2]))
+            continue
+        match = sample.match(line)
+        if match is None:
+            sys.exit("bad line: %s" % line)
+        name = match.group(1)
+        if ("HELP", name) not in described or \
+           ("TYPE", name) not in described:
+            sys.exit("no HELP or TYPE for %s" % name)
+        values[name] = values.get(name, 0) + float(match.group(3))
+
+with open(sys.argv[1]) as f:
+    nread = len(f.readlines())
+with open("metrics-test-output.trees") as f:
+    nwritten = len(f.readlines())
+with open("metrics-test-shifts.txt") as f:
+    shift = sum([int(line) for line in f])
+prefix = "fastmulrfs_preprocess_"
+expected = {"trees_read_total": nread,
+            "trees_written_total": nwritten,
+            "trees_skipped_total": nread - nwritten,
+            "score_shift_total": shift,
+            "done": 1}
+for [name, value] in expected.items():
+    if values.get(prefix + name) != value:
+        sys.exit("%s is %s, not %s" % (name, values.get(prefix + name),
+                                       value))
+print("ok")
+END
+)
+    if [ "$data" == "ok" ]; then
+        echo "Metrics passed test $i."
+    else
+        echo "Metrics failed test $i, because"
+        echo "    $data"
+    fi
+    rm -f metrics-test*
+done
+
+
+# Check that relabeling SimPhy trees by rewriting newick strings gives the
+# same trees as relabeling them with treeswift
+relabel="../python-tools/relabel_and_strip_multrees_simphy.py"
+
+for i in 1 2 3; do
+    python - g_trees_${i}.trees > relabel-test-expected.trees <<'END'
+import sys
+sys.path.insert(0, "../python-tools")
+from relabel_and_strip_multrees_simphy import relabel_newick_simphy_treeswift
+
+with open(sys.argv[1]) as f:
+    for line in f:
+        print(relabel_newick_simphy_treeswift("".join(line.split())))
+END
+    cp g_trees_${i}.trees relabel-test.trees
+    python $relabel -i relabel-test.trees
+    mv relabel-test-mult.trees relabel-test-output.trees
+    python $relabel -i relabel-test.trees -w 2
+    if cmp -s relabel-test-output.trees relabel-test-expected.trees && \
+       cmp -s relabel-test-mult.trees relabel-test-expected.trees && \
+       cmp -s relabel-test-mult.trees g_trees_${i}-mult.trees; then
+        echo "Relabel passed test $i."
+    else
+        echo "Relabel failed test $i, because outputs differ"
+    fi
+    rm -f relabel-test*
+done
+
+
+# Check that the single-pass SimPhy converter writes the same files as
+# relabel_and_strip_multrees_simphy.py and map_species_to_gene_simphy.py
+convert="../python-tools/convert_simphy.py"
+mapsimphy="../python-tools/map_species_to_gene_simphy.py"
+
+for i in 1 2 3; do
+    cp g_trees_${i}.trees convert-test-old.trees
+    cp g_trees_${i}.trees convert-test-new.trees
+    python $relabel -i convert-test-old.trees
+    python $mapsimphy -i convert-test-old.trees
+    python $convert -i convert-test-new.trees -w 2
+    if cmp -s convert-test-new-mult.trees convert-test-old-mult.trees && \
+       cmp -s convert-test-new-s2g.trees convert-test-old-s2g.trees && \
+       cmp -s convert-test-new-s2g-map.txt convert-test-old-s2g-map.txt
+    then
+        echo "Convert passed test $i."
+    else
+        echo "Convert failed test $i, because outputs differ"
+    fi
+    rm -f convert-test*
+done
+
+
+# Check that version 3 with a label map (-a) writes the same trees as
+# version 2, with and without the pipeline (-w)
+for i in 1 2 3; do
+    python $preprocessv2 -i g_trees_${i}-s2g.trees \
+                         -a g_trees_${i}-s2g-map.txt \
+                         -o map-test-expected.trees &> /dev/null
+    python $preprocessv3 -i g_trees_${i}-s2g.trees \
+                         -a g_trees_${i}-s2g-map.txt \
+                         -o map-test-output.trees &> /dev/null
+    python $preprocessv3 -i g_trees_${i}-s2g.trees \
+                         -a g_trees_${i}-s2g-map.txt \
+                         -o map-test-workers.trees -w 2 &> /dev/null
+    if cmp -s map-test-output.trees map-test-expected.trees && \
+       cmp -s map-test-workers.trees map-test-expected.trees; then
+        echo "Label map passed test $i."
+    else
+        echo "Label map failed test $i, because outputs differ"
+    fi
+    rm -f map-test*
+done
+
+
+# Check that deduplication writes each distinct topology once with the
+# number of gene trees that have it
+for i in 1 2 3; do
+    (cat g_trees_${i}-mult.trees; head -n 10 g_trees_${i}-mult.trees) \
+        > dedup-test-input.trees
+    python $preprocessv3 -i dedup-test-input.trees \
+                         -o dedup-test-expected.trees &> /dev/null
+    python $preprocessv3 -i dedup-test-input.trees \
+                         -o dedup-test-output.trees \
+                         --dedup dedup-test-counts.txt &> /dev/null
+
+    data=$(python - <<'END'
+import collections
+import sys
+sys.path.insert(0, "../python-tools")
+from fastmulrfs import canonical_newick
+
+with open("dedup-test-expected.trees") as f:
+    expected = collections.Counter([canonical_newick(line.strip())
+                                    for line in f])
+with open("dedup-test-output.trees") as f:
+    trees = [line.strip() for line in f]
+with open("dedup-test-counts.txt") as f:
+    counts = [int(line) for line in f]
+if len(set(trees)) != len(trees):
+    sys.exit("topologies are repeated")
+if collections.Counter(dict(zip(trees, counts))) != expected:
+    sys.exit("counts differ")
+print("ok")
+END
+)
+    if [ "$data" == "ok" ]; then
+        echo "Deduplication passed test $i."
+    else
+        echo "Deduplication failed test $i, because"
+        echo "    $data"
+    fi
+    rm -f dedup-test*
+done
+
+
+# Check that comparing tree lists gives the same rows when identical
+# topologies are detected by hashing as when every pair is compared with
+# DendroPy
+for i in 1 2 3; do
+    python $preprocessv3 -i g_trees_${i}-mult.trees \
+                         -o compare-test-input.trees &> /dev/null
+
+    data=$(python - <<'END'
+import dendropy
+import re
+import sys
+sys.path.insert(0, "../python-tools")
+from compare_tree_lists import get_parser
+from compare_tree_lists import main
+from compare_two_trees import compare_trees
+from fastmulrfs import canonical_newick
+
+
+def swap_leaves(tree):
+    labels = re.findall(r"[^(),;]+", tree)
+    return re.sub(r"[^(),;]+",
+                  lambda m: {labels[0]: labels[-1],
+                             labels[-1]: labels[0]}.get(m.group(0),
+                                                        m.group(0)),
+                  tree)
+
+
+# Pairs with the same topology (written differently) and with different
+# topologies (after swapping two leaves)
+with open("compare-test-input.trees") as f:
+    trees1 = [line.strip() for line in f]
+trees2 = [canonical_newick(tree) if k % 2 == 0 else swap_leaves(tree)
+          for k, tree in enumerate(trees1)]
+for [name, trees] in [["compare-test-1.trees", trees1],
+                      ["compare-test-2.trees", trees2]]:
+    with open(name, 'w') as f:
+        f.write('\n'.join(trees) + '\n')
+main(get_parser().parse_args(["-l1", "compare-test-1.trees",
+                              "-l2", "compare-test-2.trees",
+                              "-o", "compare-test.csv"]))
+
+with open("compare-test.csv") as f:
+    rows = [line.strip() for line in f]
+for k in range(len(trees1)):
+    taxa = dendropy.TaxonNamespace()
+    [tre1, tre2] = [dendropy.Tree.get(string=tree, schema="newick",
+                                      rooting="force-unrooted",
+                                      taxon_namespace=taxa)
+                    for tree in [trees1[k], trees2[k]]]
+    row = "%d,%d,%d,%d,%d,%d,%1.6f" % ((k + 1,) +
+                                       tuple(compare_trees(tre1, tre2)))
+    if rows[k] != row:
+        sys.exit("%s != %s" % (rows[k], row))
+print("ok")
+END
+)
+    if [ "$data" == "ok" ]; then
+        echo "Compare passed test $i."
+    else
+        echo "Compare failed test $i, because"
+        echo "    $data"
+    fi
+    rm -f compare-test*
+done
+
+
+# Check that the constraint set has every bipartition found in at least two
+# gene trees, with the number of gene trees it is in (counted with DendroPy);
+# the first five gene trees are given twice
+for i in 1 2 3; do
+    python $preprocessv3 -i g_trees_${i}-mult.trees \
+                         -o constraint-test-once.trees &> /dev/null
+    (cat constraint-test-once.trees; head -n 5 constraint-test-once.trees) \
+        > constraint-test-input.trees
+    python ../python-tools/build_constraint_set.py \
+        -i constraint-test-input.trees -o constraint-test.tsv \
+        --min-count 2 &> /dev/null
+
+    data=$(python - <<'END'
+import collections
+import dendropy
+import sys
+
+expected = collections.Counter()
+with open("constraint-test-input.trees") as f:
+    for line in f:
+        tree = dendropy.Tree.get(data=line, schema="newick",
+                                 rooting="force-unrooted")
+        leaves = frozenset([leaf.taxon.label for leaf in tree.leaf_nodes()])
+        splits = set([])
+        for node in tree.postorder_internal_node_iter(exclude_seed_node=True):
+            side = frozenset([leaf.taxon.label for leaf in node.leaf_nodes()])
+            if 1 < len(side) < len(leaves) - 1:
+                splits.add(frozenset([side, leaves - side]))
+        expected.update(splits)
+expected = dict([(split, count) for [split, count] in expected.items()
+                 if count >= 2])
+
+found = {}
+with open("constraint-test.tsv") as f:
+    f.readline()
+    for line in f:
+        [count, frequency, side1, side2] = line.strip().split('\t')
+        split = frozenset([frozenset(side1.split(',')),
+                           frozenset(side2.split(','))])
+        found[split] = int(count)
+if found != expected:
+    sys.exit("%d bipartitions found, %d expected"
+             % (len(found), len(expected)))
+print("ok")
+END
+)
+    if [ "$data" == "ok" ]; then
+        echo "Constraint set passed test $i."
+    else
+        echo "Constraint set failed test $i, because"
+        echo "    $data"
+    fi
+    rm -f constraint-test*
+done
+
+
+# Check that edges with low support are contracted before preprocessing
+echo "(((a,b)90,(c,a)20),((d,e)95,(f,g)30),h);" > min-support-test.trees
+python $preprocessv3 -i min-support-test.trees \
+                     -o min-support-test-output.trees \
+                     --min-support 50 &> /dev/null
+data=$(cat min-support-test-output.trees)
+if [ "$data" == "((b,c,a),((d,e)95,f,g),h);" ]; then
+    echo "Minimum support passed test."
+else
+    echo "Minimum support failed test, because"
+    echo "    $data"
+fi
+rm -f min-support-test*
+
+
+# Check that sampling every tree estimates the exact totals
+for i in 1 2 3; do
+    python $preprocessv3 -i g_trees_${i}-mult.trees \
+                         -o sample-test-output.trees \
+                         --score-shifts sample-test-shifts.txt &> /dev/null
+    true_shift=$(awk '{s += $1} END {print s}' sample-test-shifts.txt)
+    data=$(python $preprocessv3 -i g_trees_${i}-mult.trees \
+                                -o sample-test-output.trees \
+                                --sample 1000 | grep "^score shift")
+    esti_shift=$(echo $data | awk '{print $3}')
+    if [ "$true_shift.0" == "$esti_shift" ]; then
+        echo "Sampling passed test $i."
+    else
+        echo "Sampling failed test $i, because"
+        echo "    $true_shift != $data"
+    fi
+    rm -f sample-test*
+done
+
+
+# Check that score shifts are verified as trees are written
+for i in 1 2 3; do
+    ntrees=$(cat g_trees_${i}-mult.trees | wc -l)
+    data=$(python $preprocessv3 -i g_trees_${i}-mult.trees \
+                                -o verify-test-output.trees \
+                                --verify-stree s_tree_${i}.trees \
+                                --verify-fraction 1 \
+                                -x $mulrfscorer 2>&1 | tail -n 1)
+    if [ "$data" == "Verified $ntrees gene trees; 0 failed" ]; then
+        echo "Verification passed test $i."
+    else
+        echo "Verification failed test $i, because"
+        echo "    $data"
+    fi
+    rm -f verify-test*
+done
+
+
+# Check that the pairwise distances between MUL-trees match counting
+# multiset bipartitions directly
+for i in 1 2 3; do
+    python ../python-tools/multree_distance_matrix.py \
+        -i g_trees_${i}-mult.trees -o distance-test.npy &> /dev/null
+
+    data=$(python - g_trees_${i}-mult.trees <<'END'
+import collections
+import numpy
+import sys
+sys.path.insert(0, "../python-tools")
+from fastmulrfs.tree_topology import get_postorder
+from fastmulrfs.tree_topology import parse_newick
+
+
+def get_bipartitions(line):
+    [labels, adj] = parse_newick("".join(line.split()))
+    start = [v for v in range(len(labels)) if labels[v] is not None][0]
+    below = {}
+    for [node, above] in get_postorder(adj, adj[start][0], start):
+        if labels[node] is not None:
+            below[node] = collections.Counter([labels[node]])
+        else:
+            below[node] = sum([below[u] for u in adj[node] if u != above],
+                              collections.Counter())
+    total = below[adj[start][0]] + collections.Counter([labels[start]])
+    keys = collections.Counter()
+    for node in below:
+        if labels[node] is None and node != adj[start][0]:
+            sides = [tuple(sorted(below[node].elements())),
+                     tuple(sorted((total - below[node]).elements()))]
+            keys[tuple(sorted(sides))] += 1
+    return keys
+
+
+with open(sys.argv[1]) as f:
+    trees = [get_bipartitions(line) for line in f if line.strip()]
+matrix = numpy.load("distance-test.npy")
+for a in range(len(trees)):
+    for b in range(len(trees)):
+        shared = sum((trees[a] & trees[b]).values())
+        expected = sum(trees[a].values()) + sum(trees[b].values()) - 2 * shared
+        if matrix[a, b] != expected:
+            sys.exit("distance %d != %d for trees %d and %d"
+                     % (matrix[a, b], expected, a + 1, b + 1))
+print("ok")
+END
+)
+    if [ "$data" == "ok" ]; then
+        echo "Distances passed test $i."
+    else
+        echo "Distances failed test $i, because"
+        echo "    $data"
+    fi
+    rm -f distance-test*
+done
+
+
+# Check that memoizing down profiles gives the same trees, builds the
+# profile of each distinct subtree once while it stays in the cache, and
+# evicts subtrees when the cache is full
+for i in 1 2 3; do
+    cat g_trees_${i}-mult.trees g_trees_${i}-mult.trees \
+        g_trees_${i}-mult.trees > memoize-test-input.trees
+    python $preprocessv3 -i memoize-test-input.trees \
+                         -o memoize-test-expected.trees &> /dev/null
+    once=$(python $preprocessv3 -i g_trees_${i}-mult.trees \
+                                -o memoize-test-output.trees \
+                                --memoize 1000000 | grep "^Subtree cache")
+    data=$(python $preprocessv3 -i memoize-test-input.trees \
+                                -o memoize-test-output.trees \
+                                --memoize 1000000 | grep "^Subtree cache")
+    nbuilt1=$(echo $once | awk '{print $9}')
+    nbuilt3=$(echo $data | awk '{print $9}')
+    ntotal1=$(echo $once | awk '{print $5}')
+    ntotal3=$(echo $data | awk '{print $5}')
+    if cmp -s memoize-test-output.trees memoize-test-expected.trees && \
+       [ "$nbuilt3" == "$nbuilt1" ] && [ "$ntotal3" == $[3 * ntotal1] ]; then
+        echo "Memoize passed test $i."
+    else
+        echo "Memoize failed test $i, because"
+        echo "    $once (once) and $data (three times)"
+    fi
+
+    data=$(python $preprocessv3 -i memoize-test-input.trees \
+                                -o memoize-test-output.trees \
+                                --memoize 100 | grep "^Subtree cache")
+    nevicted=$(echo $data | awk '{print $12}')
+    if cmp -s memoize-test-output.trees memoize-test-expected.trees && \
+       [ "$nevicted" -gt 0 ]; then
+        echo "Memoize passed test $i with eviction."
+    else
+        echo "Memoize failed test $i with eviction, because"
+        echo "    $data"
+    fi
+    rm -f memoize-test*
+done
+
+
+# Check that the scores reported by NNI refinement match scoring the species
+# trees from scratch, and that MulRF scores use the score shifts
+refine="../python-tools/refine_species_tree.py"
+compute="../python-tools/compute_total_rf_score.py"
+
+for i in 1 2 3; do
+    j=$[i-1]
+    true_rf=${true_rfs[$j]}
+
+    python $preprocessv3 -i g_trees_${i}-mult.trees \
+                         -o refine-test-input.trees \
+                         --score-shifts refine-test-shifts.txt &> /dev/null
+    data=$(python $refine -s s_tree_${i}.trees \
+                          -g refine-test-input.trees \
+                          -f refine-test-shifts.txt \
+                          -o refine-test-output.tree)
+    shift=$(awk '{s += $1} END {print s}' refine-test-shifts.txt)
+    before=$(python $compute -s s_tree_${i}.trees \
+                             -g refine-test-input.trees \
+             | awk -F, -v s=$shift '{print $1 + $2 + s}')
+    after=$(python $compute -s refine-test-output.tree \
+                            -g refine-test-input.trees \
+            | awk -F, -v s=$shift '{print $1 + $2 + s}')
+    if [[ "$data" == "MulRF score: $true_rf before, $after after"* ]] && \
+       [ $before == $true_rf ]; then
+        echo "Refinement passed test $i."
+    else
+        echo "Refinement failed test $i, because"
+        echo "    $data ($before before, $after after from scratch)"
+    fi
+    rm -f refine-test*
+done
+
+
+# Check the support and conflict counts of annotating the species tree
+# against counting them directly with DendroPy
+annotate="../python-tools/annotate_species_tree.py"
+
+for i in 1 2 3; do
+    python $preprocessv3 -i g_trees_${i}-mult.trees \
+                         -o annotate-test-input.trees &> /dev/null
+    python $annotate -s s_tree_${i}.trees \
+                     -g annotate-test-input.trees \
+                     -o annotate-test-output.tree \
+                     -t annotate-test-table.tsv &> /dev/null
+    data=$(python - <<EOF2
+import dendropy
+
+trees = []
+with open("annotate-test-input.trees") as f:
+    for line in f:
+        tree = dendropy.Tree.get(data=line, schema="newick",
+                                 preserve_underscores=True)
+        leaves = set([leaf.taxon.label for leaf in tree.leaf_node_iter()])
+        clusters = []
+        for node in tree.postorder_internal_node_iter():
+            if node.parent_node is not None:
+                clusters.append(set([leaf.taxon.label
+                                     for leaf in node.leaf_iter()]))
+        trees.append([leaves, clusters])
+
+with open("annotate-test-table.tsv") as f:
+    rows = [line.strip().split("\t") for line in f][1:]
+
+for row in rows:
+    side1 = set(row[5].split(","))
+    side2 = set(row[6].split(","))
+    [support, conflict, informative] = [0, 0, 0]
+    for [leaves, clusters] in trees:
+        a = side1 & leaves
+        b = side2 & leaves
+        if len(a) < 2 or len(b) < 2:
+            continue
+        informative += 1
+        if [x for x in clusters if x == a or x == b]:
+            support += 1
+        elif [x for x in clusters
+              if not (x <= a or x <= b or a <= x or b <= x)]:
+            conflict += 1
+    if [int(x) for x in row[:3]] != [support, conflict, informative]:
+        print("%s,%s,%s (expected %d,%d,%d)"
+              % (row[0], row[1], row[2], support, conflict, informative))
+        break
+else:
+    print("ok")
+EOF2
+)
+    if [ "$data" == "ok" ]; then
+        echo "Annotation passed test $i."
+    else
+        echo "Annotation failed test $i, because"
+        echo "    $data"
+    fi
+    rm -f annotate-test*
+done
+
+
+# Check that the RF distances between the species tree and the preprocessed
+# gene trees computed with bitmasks match DendroPy, in one process and with
+# worker processes (-w)
+for i in 1 2 3; do
+    python $preprocessv3 -i g_trees_${i}-mult.trees \
+                         -o rf-test-input.trees &> /dev/null
+    python $compute -s s_tree_${i}.trees -g rf-test-input.trees \
+                    -o rf-test-rows.csv > rf-test-total.csv
+    python $compute -s s_tree_${i}.trees -g rf-test-input.trees \
+                    -o rf-test-rows-w.csv -w 2 > rf-test-total-w.csv
+
+    data=$(python - s_tree_${i}.trees <<'END'
+import sys
+sys.path.insert(0, "../python-tools")
+from compute_total_rf_score import compute_rf_score
+from compute_total_rf_score import read_species_tree
+from compute_total_rf_score import score_gene_tree
+
+with open(sys.argv[1]) as f:
+    temp = f.read()
+stree = read_species_tree(temp)
+with open("rf-test-input.trees") as f:
+    for g, line in enumerate(f, 1):
+        x = score_gene_tree(stree, line)
+        y = compute_rf_score(temp, line)
+        if x[:5] != y[:5] or abs(x[5] - y[5]) > 1e-9:
+            sys.exit("RF %s != %s for tree %d" % (x, y, g))
+print("ok")
+END
+)
+    if [ "$data" == "ok" ] && \
+       cmp -s rf-test-rows.csv rf-test-rows-w.csv && \
+       cmp -s rf-test-total.csv rf-test-total-w.csv; then
+        echo "RF distances passed test $i."
+    else
+        echo "RF distances failed test $i, because"
+        echo "    $data"
+    fi
+    rm -f rf-test*
+done